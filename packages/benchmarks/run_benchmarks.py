@@ -0,0 +1,418 @@
+"""
+Benchmark suite of the hemodynamic formulas and the data pipeline. Every
+benchmark uses synthetic patients, and the pull benchmark a local stub API,
+so runs are reproducible and can be compared across commits.
+
+    python run_benchmarks.py --output benchmarks.json
+    python run_benchmarks.py --benchmarks scalar,vectorized --quick
+
+Benchmarks:
+    scalar: latency of each formula of hemodynamic_parameters and of the full panel
+    vectorized: rows per second of vectorized_hemodynamic_parameters.compute_all by row count,
+        of every vectorized formula called separately and of the compiled kernel when Numba
+        is installed, with the speedup over the scalar formulas in a Python loop
+    build: time and peak memory of build_base_dataset by archive size
+    pull: patients per second of the API puller by concurrency
+"""
+
+import os
+import sys
+import json
+import time
+import timeit
+import functools
+import asyncio
+import inspect
+import argparse
+import datetime
+import platform
+import tempfile
+import subprocess
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+JUPYTER_PATH = os.path.join(BENCHMARKS_PATH, os.path.pardir, "jupyter")
+
+sys.path.append(os.path.join(BENCHMARKS_PATH, os.path.pardir, "python"))
+
+import hemodynamic_parameters
+import vectorized_hemodynamic_parameters
+import compiled_hemodynamic_parameters
+from api_client import ApiClient, pull_api_data
+
+from synthetic_patients import generate_archive, generate_measurements
+from stub_api_server import StubApiServer
+
+
+SCALAR_INPUTS = {
+    "age": 54,
+    "weight": 72.5,
+    "height": 1.68,
+    "systolic_blood_pressure": 128,
+    "diastolic_blood_pressure": 82,
+    "heart_rate": 71,
+    "left_ventricular_ejection_fraction": 0.65,
+}
+
+# Runs a notebook script in __main__, after setting the parameters given as
+# JSON at the end of its parameters cell
+NOTEBOOK_RUNNER = """
+import sys
+import json
+import __main__
+
+source = open(sys.argv[1]).read()
+parameters_cell = source.index('tags=["parameters"]')
+cell_end = source.index("\\n# +", parameters_cell)
+parameters = "".join(f"{name} = {value!r}\\n" for name, value in json.loads(sys.argv[2]).items())
+
+exec(compile(source[:cell_end] + "\\n" + parameters + source[cell_end:], sys.argv[1], "exec"), __main__.__dict__)
+"""
+
+
+def seconds_per_call(function, *arguments):
+    """ Best time of a call over several automatically sized runs
+
+    Parameters:
+        function (callable): Function to time
+        arguments: Arguments of the function
+
+    Returns:
+        float: Seconds per call
+    """
+
+    timer = timeit.Timer(lambda: function(*arguments))
+    number, _ = timer.autorange()
+
+    return min(timer.repeat(repeat=5, number=number)) / number
+
+
+def scalar_functions():
+    """ Public formulas of hemodynamic_parameters with their arguments
+
+    Returns:
+        dict: Function and argument values keyed by function name
+    """
+
+    functions = {}
+
+    for name in vectorized_hemodynamic_parameters.PARAMETERS:
+        function = getattr(hemodynamic_parameters, name)
+        functions[name] = (function, [SCALAR_INPUTS[argument] for argument in inspect.signature(function).parameters])
+
+    return functions
+
+
+def benchmark_scalar(arguments):
+    """ Latency of each scalar formula, and full panel throughput calling
+    every formula or compute_all
+    """
+
+    functions = scalar_functions()
+    latencies = {
+        name: seconds_per_call(function, *values) * 1e9
+        for name, (function, values) in functions.items()
+    }
+
+    def every_function():
+        for function, values in functions.values():
+            function(*values)
+
+    compute_all_arguments = [SCALAR_INPUTS[argument] for argument in inspect.signature(hemodynamic_parameters.compute_all).parameters]
+
+    results = {
+        "latency_ns": latencies,
+        "full_panel_per_second": {
+            "every_function": 1 / seconds_per_call(every_function),
+            "compute_all": 1 / seconds_per_call(hemodynamic_parameters.compute_all, *compute_all_arguments),
+        },
+    }
+
+    # Readings of a patient evaluated through its precomputed context
+    context = hemodynamic_parameters.PatientContext(SCALAR_INPUTS["age"], SCALAR_INPUTS["weight"], SCALAR_INPUTS["height"])
+    results["full_panel_per_second"]["patient_context"] = 1 / seconds_per_call(
+        context.compute_reading,
+        SCALAR_INPUTS["systolic_blood_pressure"],
+        SCALAR_INPUTS["diastolic_blood_pressure"],
+        SCALAR_INPUTS["heart_rate"]
+    )
+
+    # Repeated inputs, as in the readings of a study, are answered from the cache
+    hemodynamic_parameters.enable_cache()
+    try:
+        results["full_panel_per_second"]["compute_all_cache_hit"] = 1 / seconds_per_call(
+            hemodynamic_parameters.compute_all, *compute_all_arguments
+        )
+    finally:
+        hemodynamic_parameters.disable_cache()
+
+    return results
+
+
+def scalar_loop_rows_per_second(row_count, seed):
+    """ Rows per second of the full panel calling every scalar formula once
+    per row in a Python loop, the baseline of the vectorized benchmark
+
+    Parameters:
+        row_count (int): Number of rows of the loop
+        seed (int): Seed of the random inputs
+
+    Returns:
+        float: Rows per second
+    """
+
+    inputs = {name: values.tolist() for name, values in generate_measurements(row_count, seed).items()}
+    inputs["left_ventricular_ejection_fraction"] = [SCALAR_INPUTS["left_ventricular_ejection_fraction"]] * row_count
+    columns = [
+        (function, [inputs[argument] for argument in inspect.signature(function).parameters])
+        for function, _ in scalar_functions().values()
+    ]
+
+    start_time = time.perf_counter()
+    for function, values in columns:
+        for row in zip(*values):
+            function(*row)
+
+    return row_count / (time.perf_counter() - start_time)
+
+
+def vectorized_every_function(**inputs):
+    """ Full panel calling every vectorized formula separately, like the
+    scalar loop does
+    """
+
+    for name in vectorized_hemodynamic_parameters.PARAMETERS:
+        function = getattr(vectorized_hemodynamic_parameters, name)
+        function(*[inputs[argument] for argument in inspect.signature(function).parameters if argument in inputs])
+
+
+def benchmark_vectorized(arguments):
+    """ Rows per second of the vectorized full panel by number of rows, and of
+    the compiled kernel when Numba is installed, with the speedup over the
+    scalar formulas called in a Python loop
+    """
+
+    scalar_rows_per_second = scalar_loop_rows_per_second(arguments.scalar_loop_rows, arguments.seed)
+
+    backends = {
+        "numpy": vectorized_hemodynamic_parameters.compute_all,
+        "numpy_every_function": vectorized_every_function,
+    }
+    if compiled_hemodynamic_parameters.BACKEND == "numba":
+        backends["numba"] = compiled_hemodynamic_parameters.compute_all
+
+        # The first call compiles the kernel
+        compiled_hemodynamic_parameters.compute_all(**generate_measurements(10, arguments.seed))
+
+    results = {"scalar_loop_rows_per_second": scalar_rows_per_second}
+
+    for row_count in arguments.vectorized_sizes:
+        inputs = generate_measurements(row_count, arguments.seed)
+        repeat = 5 if row_count <= 1e5 else 2
+        results[str(row_count)] = {}
+
+        for backend, compute_all in backends.items():
+            seconds = min(timeit.repeat(functools.partial(compute_all, **inputs), repeat=repeat, number=1))
+            results[str(row_count)][backend] = {
+                "seconds": seconds,
+                "rows_per_second": row_count / seconds,
+                "speedup_over_scalar": row_count / seconds / scalar_rows_per_second,
+            }
+
+        del inputs
+
+    return results
+
+
+BUILD_CONFIGURATIONS = {
+    "csv": {},
+    "streaming_parquet": {"streaming": True, "output_format": "parquet"},
+}
+
+
+def run_notebook(notebook, parameters):
+    """ Run a notebook script in a child process from the jupyter package
+    directory
+
+    Parameters:
+        notebook (str): Name of the jupytext script in packages/jupyter
+        parameters (dict): Values of the parameters cell
+
+    Returns:
+        dict: Wall seconds and peak resident memory in MB of the child process
+    """
+
+    start_time = time.time()
+    process = subprocess.Popen(
+        [sys.executable, "-c", NOTEBOOK_RUNNER, notebook, json.dumps(parameters)],
+        cwd=JUPYTER_PATH,
+        stdout=subprocess.DEVNULL
+    )
+    _, status, usage = os.wait4(process.pid, 0)
+
+    # The child was reaped by wait4, so Popen must not wait for it again. Its
+    # return code follows Popen: the exit code, or minus the killing signal
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+
+    if process.returncode != 0:
+        raise RuntimeError(f"{notebook} failed with return code {process.returncode}")
+
+    # ru_maxrss is given in KB on Linux
+    return {"seconds": time.time() - start_time, "peak_memory_mb": usage.ru_maxrss / 1024}
+
+
+def benchmark_build(arguments):
+    """ Time and peak memory of build_base_dataset by archive size
+    """
+
+    results = {}
+
+    for patient_count in arguments.build_sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            api_data_path = os.path.join(directory, "api-data")
+            generate_archive(api_data_path, patient_count, arguments.measures, arguments.seed)
+
+            results[str(patient_count)] = {}
+
+            for name, configuration in BUILD_CONFIGURATIONS.items():
+                base_dataset_path = os.path.join(directory, f"dataset-{name}")
+                results[str(patient_count)][name] = run_notebook("build_base_dataset.py", dict(
+                    configuration,
+                    api_data_path=api_data_path,
+                    base_dataset_path=base_dataset_path,
+                ))
+
+    return results
+
+
+async def pull_patients(api_url, concurrent_workers):
+    """ Pull every patient of the stub API
+
+    Returns:
+        int: Number of patients pulled
+    """
+
+    patient_count = 0
+
+    async with ApiClient(api_url, "benchmark", "benchmark", max_in_flight=4 * concurrent_workers) as client:
+        patient_data_stream = pull_api_data(
+            client,
+            1,
+            datetime.datetime.max,
+            concurrent_workers,
+            max_consecutive_error=10
+        )
+
+        async for _ in patient_data_stream:
+            patient_count += 1
+
+    return patient_count
+
+
+def benchmark_pull(arguments):
+    """ Patients per second of the API puller by concurrency against the stub API
+    """
+
+    results = {}
+
+    with StubApiServer(arguments.pull_patients, arguments.pull_latency, measure_count=arguments.measures) as server:
+        for concurrent_workers in arguments.pull_concurrency:
+            requests_before = server.stats["requests"]
+            start_time = time.time()
+            patient_count = asyncio.run(pull_patients(server.url, concurrent_workers))
+            seconds = time.time() - start_time
+
+            results[str(concurrent_workers)] = {
+                "seconds": seconds,
+                "patients": patient_count,
+                "patients_per_second": patient_count / seconds,
+                "requests": server.stats["requests"] - requests_before,
+            }
+
+    return results
+
+
+BENCHMARKS = {
+    "scalar": benchmark_scalar,
+    "vectorized": benchmark_vectorized,
+    "build": benchmark_build,
+    "pull": benchmark_pull,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=BENCHMARKS_PATH, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_sizes(value):
+    return [int(float(size)) for size in value.split(",")]
+
+
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(description="Benchmark the hemodynamic formulas and the data pipeline")
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS), help="comma separated benchmarks to run")
+    parser.add_argument("--output", default=None, help="JSON results file, standard output by default")
+    parser.add_argument("--quick", action="store_true", help="small sizes for a fast smoke run")
+    parser.add_argument("--vectorized-sizes", type=parse_sizes, default=None, help="default 1e3,1e4,1e5,1e6,1e7")
+    parser.add_argument("--scalar-loop-rows", type=int, default=None, help="rows of the scalar loop baseline, default 100000")
+    parser.add_argument("--build-sizes", type=parse_sizes, default=None, help="patients per archive, default 100,1000,10000")
+    parser.add_argument("--measures", type=int, default=60, help="measurements per synthetic patient")
+    parser.add_argument("--pull-patients", type=int, default=None, help="patients served by the stub API, default 2000")
+    parser.add_argument("--pull-latency", type=float, default=0.02, help="mean seconds of stub API latency")
+    parser.add_argument("--pull-concurrency", type=parse_sizes, default=None, help="default 1,10,50,100")
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args(arguments)
+
+    arguments.benchmarks = [name.strip() for name in arguments.benchmarks.split(",") if name.strip()]
+    unknown_benchmarks = set(arguments.benchmarks) - set(BENCHMARKS)
+    if unknown_benchmarks:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown_benchmarks))}")
+
+    quick = arguments.quick
+    arguments.vectorized_sizes = arguments.vectorized_sizes or ([1000, 10000, 100000] if quick else [1000, 10000, 100000, 1000000, 10000000])
+    arguments.scalar_loop_rows = arguments.scalar_loop_rows or (10000 if quick else 100000)
+    arguments.build_sizes = arguments.build_sizes or ([50, 200] if quick else [100, 1000, 10000])
+    arguments.pull_patients = arguments.pull_patients or (200 if quick else 2000)
+    arguments.pull_concurrency = arguments.pull_concurrency or ([1, 10, 50] if quick else [1, 10, 50, 100])
+
+    return arguments
+
+
+def main(arguments=None):
+    arguments = parse_arguments(arguments)
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "arguments": {key: value for key, value in vars(arguments).items() if key != "output"},
+        },
+    }
+
+    for name in arguments.benchmarks:
+        print(f"Running {name} benchmark", file=sys.stderr)
+        results[name] = BENCHMARKS[name](arguments)
+
+    output = json.dumps(results, indent=2)
+
+    if arguments.output is None:
+        print(output)
+    else:
+        with open(arguments.output, "w") as output_file:
+            output_file.write(output + "\n")
+
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Local stub of the ABPM API serving synthetic patients, so the puller can be
+benchmarked without the real API.
+
+    python stub_api_server.py --port 8000 --patients 1000 --latency 0.02
+"""
+
+import random
+import socket
+import asyncio
+import argparse
+import threading
+
+from aiohttp import web
+
+from synthetic_patients import generate_patient
+
+
+# Key of each API endpoint in the generated patient data
+ENDPOINT_KEYS = {
+    "tabla_mediciones": "data",
+    "MAPA": "measure",
+    "medicamentos": "drugs",
+    "get_mapa": "meta_data",
+}
+
+
+def create_app(patient_count, latency=0.0, measure_count=60, seed=0):
+    """ Create the stub API application. Patients 1 to patient_count exist,
+    the other IDs answer empty lists like the real API
+
+    Parameters:
+        patient_count (int): Number of patients served
+        latency (float): Mean seconds of exponentially distributed latency per request
+        measure_count (int): Number of blood pressure measurements per patient
+        seed (int): Seed of the synthetic patients
+
+    Returns:
+        web.Application: Stub API application, with its request counts in
+        app["stats"] and the token it accepts in app["auth"]["token"], which
+        can be replaced to reject the tokens already issued
+    """
+
+    app = web.Application()
+    app["stats"] = {"login": 0, "requests": 0}
+    app["auth"] = {"token": "stub-token"}
+
+    async def login(request):
+        app["stats"]["login"] += 1
+        return web.json_response({"res": app["auth"]["token"]})
+
+    async def endpoint(request):
+        app["stats"]["requests"] += 1
+
+        if request.headers.get("authorization") != f"Bearer {app['auth']['token']}":
+            return web.Response(status=401)
+
+        if latency:
+            await asyncio.sleep(random.expovariate(1 / latency))
+
+        patient_id = int(request.match_info["patient_id"])
+
+        if not 1 <= patient_id <= patient_count:
+            return web.json_response([])
+
+        patient = generate_patient(patient_id, measure_count, seed)
+
+        return web.json_response(patient[ENDPOINT_KEYS[request.match_info["endpoint"]]])
+
+    async def stats(request):
+        return web.json_response(app["stats"])
+
+    app.router.add_post("/login", login)
+    app.router.add_get("/stats", stats)
+    app.router.add_get("/{endpoint}/{patient_id}/", endpoint)
+
+    return app
+
+
+class StubApiServer:
+    """ Run the stub API in a background thread, as a context manager
+
+    Parameters:
+        patient_count (int): Number of patients served
+        latency (float): Mean seconds of latency per request
+        port (int): Port to listen on, 0 picks a free port
+    """
+
+    def __init__(self, patient_count, latency=0.0, port=0, **app_arguments):
+        self.app = create_app(patient_count, latency, **app_arguments)
+        self.port = port
+        self.loop = asyncio.new_event_loop()
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def stats(self):
+        return dict(self.app["stats"])
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+
+        self.runner = web.AppRunner(self.app)
+        self.loop.run_until_complete(self.runner.setup())
+
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.bind(("127.0.0.1", self.port))
+        self.port = server_socket.getsockname()[1]
+        self.loop.run_until_complete(web.SockSite(self.runner, server_socket).start())
+
+        self.started.set()
+        self.loop.run_forever()
+        self.loop.run_until_complete(self.runner.cleanup())
+        self.loop.close()
+
+    def __enter__(self):
+        self.thread.start()
+        self.started.wait()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic patients with the ABPM API endpoints")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--patients", type=int, default=1000, help="number of patients served")
+    parser.add_argument("--latency", type=float, default=0.0, help="mean seconds of latency per request")
+    parser.add_argument("--measures", type=int, default=60, help="measurements per patient")
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    web.run_app(
+        create_app(arguments.patients, arguments.latency, arguments.measures, arguments.seed),
+        host="127.0.0.1",
+        port=arguments.port
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Generator of synthetic ABPM patients with the same JSON structure as the
+API, used by the benchmarks and the stub API server.
+"""
+
+import os
+import sys
+import random
+import datetime
+
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.pardir, "python"))
+
+from patient_archive import PatientArchive
+
+
+FIRST_TEST_DATE = datetime.datetime(2015, 1, 1, 8, 0, 0)
+
+
+def generate_patient(patient_id, measure_count=60, seed=0):
+    """ Generate the API data of a synthetic patient. The same patient ID and
+    seed always generate the same patient
+
+    Parameters:
+        patient_id (int): Patient ABPM test ID
+        measure_count (int): Number of blood pressure measurements
+        seed (int): Seed of the random generator
+
+    Returns:
+        dict: JSON data with the structure pulled from the API
+    """
+
+    generator = random.Random(seed * 1000003 + patient_id)
+    start_date = FIRST_TEST_DATE + datetime.timedelta(hours=6 * patient_id)
+    birth_date = start_date - datetime.timedelta(days=generator.randint(18 * 365, 90 * 365))
+
+    systolic_mean = generator.gauss(125, 15)
+    diastolic_mean = systolic_mean * generator.uniform(0.55, 0.7)
+    heart_rate_mean = generator.gauss(72, 10)
+
+    measures = []
+    for index in range(measure_count):
+        measure_date = start_date + datetime.timedelta(minutes=24 * 60 * index / measure_count)
+        systolic = round(generator.gauss(systolic_mean, 10))
+        diastolic = round(min(generator.gauss(diastolic_mean, 7), systolic - 15))
+
+        measures.append({
+            "fecha_dt": measure_date.strftime("%Y-%m-%d %H:%M:%S"),
+            "sistolica": systolic,
+            "diastolica": diastolic,
+            "valor": round(generator.gauss(heart_rate_mean, 8)),
+        })
+
+    return {
+        "id": patient_id,
+        "data": measures,
+        "measure": [],
+        "drugs": [],
+        "meta_data": [{
+            "fecha_nacimiento": birth_date.strftime("%Y-%m-%d"),
+            "fecha_inicio": start_date.strftime("%Y-%m-%d %H:%M:%S"),
+            "inicio_noche": "22:00:00",
+            "fin_noche": "06:00:00",
+            "genero": generator.choice(["M", "F"]),
+            "talla": round(generator.gauss(165, 10)),
+            "peso": round(generator.gauss(72, 14), 1),
+        }],
+    }
+
+
+def generate_archive(path, patient_count, measure_count=60, seed=0):
+    """ Write a patient archive with synthetic patients 1 to patient_count
+
+    Parameters:
+        path (str): Directory of the patient archive
+        patient_count (int): Number of patients
+        measure_count (int): Number of blood pressure measurements per patient
+        seed (int): Seed of the random generator
+    """
+
+    with PatientArchive(path) as archive:
+        for patient_id in range(1, patient_count + 1):
+            archive.append(generate_patient(patient_id, measure_count, seed))
+
+
+def generate_measurements(row_count, seed=0):
+    """ Generate random inputs of the hemodynamic parameters
+
+    Parameters:
+        row_count (int): Number of measurements
+        seed (int): Seed of the random generator
+
+    Returns:
+        dict: NumPy arrays keyed by the hemodynamic parameters argument names
+    """
+
+    generator = numpy.random.default_rng(seed)
+    systolic_blood_pressure = generator.normal(125, 15, row_count)
+
+    return {
+        "age": generator.uniform(18, 90, row_count),
+        "weight": generator.normal(72, 14, row_count).clip(40, 150),
+        "height": generator.normal(1.65, 0.1, row_count).clip(1.4, 2.1),
+        "systolic_blood_pressure": systolic_blood_pressure,
+        "diastolic_blood_pressure": systolic_blood_pressure * generator.uniform(0.55, 0.7, row_count),
+        "heart_rate": generator.normal(72, 10, row_count).clip(40, 140),
+    }
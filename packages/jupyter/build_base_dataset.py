@@ -15,103 +15,927 @@
 # +
 # %%capture
 
-# %pip install pandas seaborn
+# %pip install pandas pyarrow seaborn
 # %matplotlib inline
-# -
 
+# + tags=["parameters"]
+# Patient archive written by get_data_from_api. JSON files of the previous
+# one file per patient format in the same directory are also read
 api_data_path = "./api-data/"
 base_dataset_path = "./sleep_dataset.csv"
 
+# Streaming mode reads and writes chunks of max_patients_in_memory patients. Up to
+# two chunks per ingestion worker are in flight besides the one being written, so
+# memory holds at most (2 * ingestion_workers + 1) * max_patients_in_memory
+# patients. ingestion_workers = None uses every CPU core
+streaming = False
+max_patients_in_memory = 500
+ingestion_workers = None
+
+# Output format can be "csv" or "parquet". Parquet output can be partitioned
+# by "measure_month" or "patient_id_range", in which case base_dataset_path
+# is a directory
+output_format = "csv"
+parquet_compression = "zstd"
+partition_by = None
+patient_id_partition_size = 1000
+
+# Incremental mode keeps base_dataset_path as a directory of Parquet parts
+# and only parses patient files that are new or changed since the last build.
+# Files are compared by size and modification time, and also by content hash
+# if manifest_content_hash is True. Parts left with fewer than
+# compaction_threshold * max_patients_in_memory patients are merged together
+incremental = False
+manifest_content_hash = False
+compaction_threshold = 0.5
+
 # +
 import os
+import sys
 import glob
 import json
 import seaborn as sns
 
-patient_files = glob.glob(os.path.join(api_data_path, "*.json"))
-patient_data = [
-    json.loads(open(file, "r").read()) for file in patient_files
+# Patient archive shared with the other packages
+sys.path.append(os.path.join(os.path.pardir, "python"))
+
+from patient_archive import PatientArchive, PatientLocation, read_patient
+
+
+def list_patient_files(api_data_path):
+    """ List the patients of the archive and the JSON files of patients that
+    are not archived
+
+    Parameters:
+        api_data_path (str): Directory of the patient archive
+
+    Returns:
+        list: Paths of the patient JSON files and PatientLocation of the
+        archived patients, in patient ID order
+    """
+
+    locations = PatientArchive(api_data_path).locations
+    json_files = {
+        patient_id_from_file(file): file
+        for file in glob.glob(os.path.join(api_data_path, "*.json"))
+    }
+
+    return [
+        locations.get(patient_id) or json_files[patient_id]
+        for patient_id in sorted(set(locations) | set(json_files))
+    ]
+
+
+def read_patient_file(file):
+    """ Read the JSON data of a single patient file or archived patient
+
+    Parameters:
+        file (str or PatientLocation): Path of the patient JSON file or position in the archive
+
+    Returns:
+        dict: JSON data pulled from the API for the patient
+    """
+
+    if isinstance(file, PatientLocation):
+        return read_patient(file)
+
+    with open(file, "r") as patient_file:
+        return json.load(patient_file)
+
+
+def patient_id_from_file(file):
+    """ Get the patient ID of a patient file or archived patient
+
+    Parameters:
+        file (str or PatientLocation): Path of the patient JSON file or position in the archive
+
+    Returns:
+        int: Patient ABPM test ID
+    """
+
+    if isinstance(file, PatientLocation):
+        return file.patient_id
+
+    return int(os.path.basename(file).split('.')[0])
+
+
+patient_files = list_patient_files(api_data_path)
+
+
+# +
+META_DATA_COLUMNS = [
+    "patient_id",
+    "birth_date",
+    "start_date",
+    "start_night",
+    "end_night",
+    "gender",
+    "height",
+    "weight"
+]
+
+MEASURE_COLUMNS = [
+    "patient_id",
+    "measure_date_time",
+    "sistolic",
+    "diastolic",
+    "heart_reate",
 ]
 
+BASE_DATASET_COLUMNS = META_DATA_COLUMNS + MEASURE_COLUMNS[1:]
+
+
+def flatten_meta_data(patient):
+    """ Flatten the ABPM test meta data of a patient
+
+    Parameters:
+        patient (dict): JSON data pulled from the API for the patient
+
+    Returns:
+        list: Row with the META_DATA_COLUMNS values
+    """
+
+    meta_data = patient["meta_data"][0]
+
+    return [
+        patient["id"],
+        meta_data["fecha_nacimiento"],
+        meta_data["fecha_inicio"],
+        meta_data["inicio_noche"],
+        meta_data["fin_noche"],
+        meta_data["genero"],
+        meta_data["talla"],
+        meta_data["peso"],
+    ]
+
+
+def flatten_measures(patient):
+    """ Flatten the ABPM measurements of a patient
+
+    Parameters:
+        patient (dict): JSON data pulled from the API for the patient
+
+    Returns:
+        list: One row with the MEASURE_COLUMNS values for each measurement
+    """
+
+    return [
+        [
+            patient["id"],
+            measure["fecha_dt"],
+            measure["sistolica"],
+            measure["diastolica"],
+            measure["valor"],
+        ] for measure in patient["data"]
+    ]
+
+
+def flatten_patient(patient):
+    """ Flatten meta data and measurements of a patient together, the same
+    way the inner merge of the meta data and measure data frames does
+
+    Parameters:
+        patient (dict): JSON data pulled from the API for the patient
+
+    Returns:
+        list: One row with the BASE_DATASET_COLUMNS values for each measurement
+    """
+
+    meta_data = flatten_meta_data(patient)
+
+    return [meta_data + measure[1:] for measure in flatten_measures(patient)]
+
+
+# -
+
+# ## Dataset writers
+
 # +
+import shutil
 import pandas
+import pyarrow
+import pyarrow.dataset
+import pyarrow.parquet
 
-data = []
 
-for patient in patient_data:    
-    patient_id = patient["id"]
+BASE_DATASET_SCHEMA = pyarrow.schema([
+    ("patient_id", pyarrow.int64()),
+    ("birth_date", pyarrow.timestamp("us")),
+    ("start_date", pyarrow.timestamp("us")),
+    ("start_night", pyarrow.duration("us")),
+    ("end_night", pyarrow.duration("us")),
+    ("gender", pyarrow.string()),
+    ("height", pyarrow.float32()),
+    ("weight", pyarrow.float32()),
+    ("measure_date_time", pyarrow.timestamp("us")),
+    ("sistolic", pyarrow.float32()),
+    ("diastolic", pyarrow.float32()),
+    ("heart_reate", pyarrow.float32()),
+])
 
-    birth_date = patient["meta_data"][0]["fecha_nacimiento"]
-    start_date = patient["meta_data"][0]["fecha_inicio"]
+PARTITION_COLUMN_TYPES = {
+    "measure_month": pyarrow.string(),
+    "patient_id_range": pyarrow.int64(),
+}
 
-    start_night = patient["meta_data"][0]["inicio_noche"]
-    end_night = patient["meta_data"][0]["fin_noche"]
 
-    gender = patient["meta_data"][0]["genero"]
-    height = patient["meta_data"][0]["talla"]
-    weight = patient["meta_data"][0]["peso"]
+def to_typed_frame(dataset_df):
+    """ Convert the text columns of the base dataset to typed columns.
+    Night start and end are stored as the time elapsed since midnight
 
-    data.append([patient_id, birth_date, start_date, start_night, end_night, gender, height, weight])
-    
+    Parameters:
+        dataset_df (DataFrame): Base dataset with BASE_DATASET_COLUMNS columns
 
-meta_data_df = pandas.DataFrame(
-    data, 
-    columns=[
-        "patient_id", 
-        "birth_date", 
-        "start_date", 
-        "start_night", 
-        "end_night", 
-        "gender", 
-        "height", 
-        "weight"
-    ]
-)
+    Returns:
+        DataFrame: Base dataset with the types of BASE_DATASET_SCHEMA
+    """
+
+    return pandas.DataFrame({
+        "patient_id": dataset_df["patient_id"].astype("int64"),
+        "birth_date": pandas.to_datetime(dataset_df["birth_date"], errors="coerce"),
+        "start_date": pandas.to_datetime(dataset_df["start_date"], errors="coerce"),
+        "start_night": pandas.to_timedelta(dataset_df["start_night"], errors="coerce"),
+        "end_night": pandas.to_timedelta(dataset_df["end_night"], errors="coerce"),
+        "gender": dataset_df["gender"].astype("object"),
+        "height": pandas.to_numeric(dataset_df["height"], errors="coerce").astype("float32"),
+        "weight": pandas.to_numeric(dataset_df["weight"], errors="coerce").astype("float32"),
+        "measure_date_time": pandas.to_datetime(dataset_df["measure_date_time"], errors="coerce"),
+        "sistolic": pandas.to_numeric(dataset_df["sistolic"], errors="coerce").astype("float32"),
+        "diastolic": pandas.to_numeric(dataset_df["diastolic"], errors="coerce").astype("float32"),
+        "heart_reate": pandas.to_numeric(dataset_df["heart_reate"], errors="coerce").astype("float32"),
+    })
+
+
+class CsvDatasetWriter:
+    """ Append chunks of the base dataset to a CSV file
+
+    Parameters:
+        path (str): Path of the output CSV
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.header = True
 
-meta_data_df.set_index("patient_id", inplace=True)
-meta_data_df
+    def write(self, dataset_df):
+        dataset_df.set_index("patient_id").to_csv(
+            self.path,
+            mode="w" if self.header else "a",
+            header=self.header
+        )
+        self.header = False
+
+    def close(self):
+        if self.header:
+            self.write(pandas.DataFrame(columns=BASE_DATASET_COLUMNS))
+
+
+def is_partitioned_dataset(path):
+    """ Check if a directory only holds a base dataset written by
+    ParquetDatasetWriter: hive partition directories of Parquet parts
+
+    Parameters:
+        path (str): Path of the directory
+
+    Returns:
+        bool: True if every entry is a known partition with only Parquet parts
+    """
+
+    for entry in os.scandir(path):
+        column, separator, _ = entry.name.partition("=")
+
+        if not entry.is_dir(follow_symlinks=False) or not separator or column not in PARTITION_COLUMN_TYPES:
+            return False
+
+        for part in os.scandir(entry.path):
+            if not part.is_file(follow_symlinks=False) or not (part.name.startswith("part-") and part.name.endswith(".parquet")):
+                return False
+
+    return True
+
+
+class ParquetDatasetWriter:
+    """ Append chunks of the base dataset to a typed and compressed Parquet
+    file, or to a Parquet dataset directory partitioned by partition_by
+
+    Parameters:
+        path (str): Path of the output file or directory
+        compression (str): Parquet compression codec
+        partition_by (str): None, "measure_month" or "patient_id_range"
+        patient_id_partition_size (int): Number of patient IDs per patient_id_range partition
+    """
+
+    def __init__(self, path, compression="zstd", partition_by=None, patient_id_partition_size=1000):
+        self.path = path
+        self.compression = compression
+        self.partition_by = partition_by
+        self.patient_id_partition_size = patient_id_partition_size
+        self.chunk_index = 0
+        self.writer = None
+        self.schema = BASE_DATASET_SCHEMA
+
+        if partition_by is not None:
+            if partition_by not in PARTITION_COLUMN_TYPES:
+                raise ValueError(f"Unknown partition column: {partition_by}")
+
+            self.schema = self.schema.append(pyarrow.field(partition_by, PARTITION_COLUMN_TYPES[partition_by]))
+
+            # Only a previous partitioned dataset is replaced, never another directory
+            if os.path.isdir(path):
+                if not is_partitioned_dataset(path):
+                    raise ValueError(f"{path} is not a partitioned base dataset, remove it or choose another path")
+
+                shutil.rmtree(path)
+
+    def to_table(self, dataset_df):
+        typed_df = to_typed_frame(dataset_df)
+
+        if self.partition_by == "measure_month":
+            typed_df["measure_month"] = typed_df["measure_date_time"].dt.strftime("%Y-%m")
+        elif self.partition_by == "patient_id_range":
+            typed_df["patient_id_range"] = (
+                typed_df["patient_id"] // self.patient_id_partition_size
+            ) * self.patient_id_partition_size
+
+        return pyarrow.Table.from_pandas(typed_df, schema=self.schema, preserve_index=False)
+
+    def write(self, dataset_df):
+        table = self.to_table(dataset_df)
+
+        if self.partition_by is None:
+            if self.writer is None:
+                self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema, compression=self.compression)
+
+            self.writer.write_table(table)
+        else:
+            pyarrow.dataset.write_dataset(
+                table,
+                self.path,
+                format="parquet",
+                partitioning=[self.partition_by],
+                partitioning_flavor="hive",
+                basename_template=f"part-{self.chunk_index}-{{i}}.parquet",
+                existing_data_behavior="overwrite_or_ignore",
+                file_options=pyarrow.dataset.ParquetFileFormat().make_write_options(compression=self.compression),
+            )
+
+        self.chunk_index += 1
+
+    def close(self):
+        if self.partition_by is None and self.writer is None:
+            self.write(pandas.DataFrame(columns=BASE_DATASET_COLUMNS))
+
+        if self.writer is not None:
+            self.writer.close()
+
+
+def open_dataset_writer(path, output_format):
+    """ Create the writer for the configured output format
+
+    Parameters:
+        path (str): Path of the output file or directory
+        output_format (str): "csv" or "parquet"
+
+    Returns:
+        CsvDatasetWriter or ParquetDatasetWriter
+    """
+
+    if output_format == "csv":
+        return CsvDatasetWriter(path)
+
+    if output_format == "parquet":
+        return ParquetDatasetWriter(
+            path,
+            compression=parquet_compression,
+            partition_by=partition_by,
+            patient_id_partition_size=patient_id_partition_size
+        )
+
+    raise ValueError(f"Unknown output format: {output_format}")
+
+
+FILTER_OPERATORS = {
+    "=": lambda values, value: values == value,
+    "==": lambda values, value: values == value,
+    "!=": lambda values, value: values != value,
+    "<": lambda values, value: values < value,
+    "<=": lambda values, value: values <= value,
+    ">": lambda values, value: values > value,
+    ">=": lambda values, value: values >= value,
+    "in": lambda values, value: values.isin(value),
+    "not in": lambda values, value: ~values.isin(value),
+}
+
+
+def filter_rows(dataset_df, filters):
+    """ Select the rows that match row filters, with the same meaning as the
+    Parquet filters: a list of (column, operator, value) tuples that must all
+    match, or a list of such lists of which any must match
+
+    Parameters:
+        dataset_df (DataFrame): Base dataset rows
+        filters (list): Row filters
+
+    Returns:
+        DataFrame: The matching rows
+    """
+
+    if filters and isinstance(filters[0], tuple):
+        filters = [filters]
+
+    mask = pandas.Series(False, index=dataset_df.index)
+
+    for conjunction in filters:
+        conjunction_mask = pandas.Series(True, index=dataset_df.index)
+
+        for column, operator, value in conjunction:
+            if column not in dataset_df.columns:
+                raise ValueError(f"Unknown filter column: {column}")
+            if operator not in FILTER_OPERATORS:
+                raise ValueError(f"Unknown filter operator: {operator}")
+
+            conjunction_mask &= FILTER_OPERATORS[operator](dataset_df[column], value)
+
+        mask |= conjunction_mask
+
+    return dataset_df[mask]
+
+
+def read_base_dataset(path, columns=None, filters=None):
+    """ Read the base dataset. For Parquet output the column selection and the
+    row filters are pushed down, so only the needed columns, partitions and
+    row groups are read. CSV output is read whole and then filtered, and it
+    has no partition columns to filter on
+
+    Parameters:
+        path (str): Path of the CSV file, Parquet file or Parquet dataset directory
+        columns (list): Columns to read, all of them if None
+        filters (list): Row filters as (column, operator, value) tuples, for
+        example [("measure_month", "=", "2019-05"), ("patient_id", ">=", 5000)]
+
+    Returns:
+        DataFrame: The selected base dataset rows and columns
+    """
+
+    if os.path.isfile(path) and path.endswith(".csv"):
+        if not filters:
+            return pandas.read_csv(path, usecols=columns)
+
+        filter_columns = [column for conjunction in filters for column in (
+            [conjunction[0]] if isinstance(conjunction, tuple) else [condition[0] for condition in conjunction]
+        )]
+        usecols = None if columns is None else list(dict.fromkeys(list(columns) + filter_columns))
+        dataset_df = filter_rows(pandas.read_csv(path, usecols=usecols), filters).reset_index(drop=True)
+
+        return dataset_df if columns is None else dataset_df[list(columns)]
+
+    return pandas.read_parquet(path, columns=columns, filters=filters)
+
+
+# -
+
+# ## Parallel ingestion
 
 # +
-data = []
-
-for patient in patient_data:   
-    patient_id = patient["id"]
-    
-    for measure in patient["data"]:
-        measure_date_time = measure["fecha_dt"]
-        sistolic = measure["sistolica"]
-        diastolic = measure["diastolica"]
-        heart_reate = measure["valor"]
-        
-        data.append([patient_id, measure_date_time, sistolic, diastolic, heart_reate])
-        
-        
-measure_df = pandas.DataFrame(
-    data, 
-    columns=[
-        "patient_id",
-        "measure_date_time", 
-        "sistolic", 
-        "diastolic", 
-        "heart_reate",
+import numpy
+import collections
+import multiprocessing
+import concurrent.futures
+
+
+def column_array(values):
+    """ Pack the values of a flattened column in a NumPy array, which is
+    pickled as a single buffer when it is sent back from a worker
+
+    Parameters:
+        values (tuple): Values of the column
+
+    Returns:
+        numpy.ndarray: Numbers or strings of a single type, or Python objects
+        if the types are mixed, so no value is converted
+    """
+
+    array = numpy.array(values)
+
+    # NumPy turns numbers mixed with strings into strings
+    if array.dtype.kind == "U" and not all(isinstance(value, str) for value in values):
+        array = numpy.array(values, dtype=object)
+
+    return array
+
+
+def flatten_patient_files(files):
+    """ Read and flatten a chunk of patient files. Runs in the ingestion
+    worker processes, so it returns compact column arrays instead of the
+    patient dicts
+
+    Parameters:
+        files (list): Paths of the patient JSON files or PatientLocation of archived patients
+
+    Returns:
+        dict: One NumPy array of values for each of the BASE_DATASET_COLUMNS
+    """
+
+    rows = [row for file in files for row in flatten_patient(read_patient_file(file))]
+    columns = list(zip(*rows)) if rows else [()] * len(BASE_DATASET_COLUMNS)
+
+    return {column: column_array(values) for column, values in zip(BASE_DATASET_COLUMNS, columns)}
+
+
+def iter_flattened_chunks(patient_files, chunk_size, workers):
+    """ Flatten the patient files in chunks of chunk_size patients across a
+    pool of worker processes. Chunks are generated in file order and at most
+    two chunks per worker are in flight, so memory stays bounded
+
+    Parameters:
+        patient_files (list): Paths of the patient JSON files or PatientLocation of archived patients
+        chunk_size (int): Maximum number of patients per chunk
+        workers (int): Number of worker processes, 1 flattens in this process
+
+    Returns:
+        generator: Generates the columns of each flattened chunk
+    """
+
+    file_chunks = [
+        patient_files[index:index + chunk_size]
+        for index in range(0, len(patient_files), chunk_size)
     ]
-)
 
-measure_df.set_index("patient_id", inplace=True)
-measure_df
+    if workers == 1:
+        for files in file_chunks:
+            yield flatten_patient_files(files)
+
+        return
+
+    # Fork so that the workers see the functions defined in this notebook
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("fork")
+    ) as executor:
+        pending = collections.deque()
+
+        for files in file_chunks:
+            pending.append(executor.submit(flatten_patient_files, files))
+
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def concatenate_columns(chunks):
+    """ Concatenate the columns of all the flattened chunks once
+
+    Parameters:
+        chunks (iterable): Columns of each flattened chunk
+
+    Returns:
+        dict: One NumPy array of values for each of the BASE_DATASET_COLUMNS
+    """
+
+    chunks = [chunk for chunk in chunks if len(chunk["patient_id"])]
+
+    if not chunks:
+        return {column: column_array(()) for column in BASE_DATASET_COLUMNS}
+
+    columns = {}
+
+    for column in BASE_DATASET_COLUMNS:
+        arrays = [chunk[column] for chunk in chunks]
+
+        # Integer and decimal chunks are promoted, strings mixed with other types stay Python objects
+        if len({array.dtype.kind == "U" for array in arrays}) > 1:
+            arrays = [array.astype(object) for array in arrays]
+
+        columns[column] = numpy.concatenate(arrays)
+
+    return columns
+
+
+# -
+
+# ## Streaming dataset build
+
+def write_base_dataset_streaming(patient_files, writer, chunk_size, workers):
+    """ Build the base dataset appending chunk_size patients at a time to the
+    output, so memory does not grow with the size of the archive
+
+    Parameters:
+        patient_files (list): Paths of the patient JSON files or PatientLocation of archived patients
+        writer (CsvDatasetWriter or ParquetDatasetWriter): Output dataset writer
+        chunk_size (int): Maximum number of patients per chunk
+        workers (int): Number of ingestion worker processes
+
+    Returns:
+        int: Number of measurement rows written
+    """
+
+    row_count = 0
+
+    for columns in iter_flattened_chunks(patient_files, chunk_size, workers):
+        chunk_df = pandas.DataFrame(columns, columns=BASE_DATASET_COLUMNS)
+
+        writer.write(chunk_df)
+        row_count += len(chunk_df)
+
+    writer.close()
+
+    return row_count
+
+
+# -
+
+# ## Incremental dataset build
 
 # +
-patient_df = pandas.merge(
-    meta_data_df, 
-    measure_df, 
-    how="inner", 
-    left_index=True, 
-    right_index=True
-)
-
-patient_df
+import time
+import uuid
+import hashlib
+import pyarrow.compute
+
+
+def patient_file_signature(file, content_hash=False):
+    """ Get the values used to detect changes of a patient file
+
+    Parameters:
+        file (str or PatientLocation): Path of the patient JSON file or position in the archive
+        content_hash (bool): Also include the SHA-256 of the file content
+
+    Returns:
+        dict: File size, modification time and optionally content hash, or
+        the shard, offset and length of an archived patient
+    """
+
+    if isinstance(file, PatientLocation):
+        return {"shard": os.path.basename(file.shard), "offset": file.offset, "length": file.length}
+
+    stat = os.stat(file)
+    signature = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+    if content_hash:
+        with open(file, "rb") as patient_file:
+            signature["sha256"] = hashlib.sha256(patient_file.read()).hexdigest()
+
+    return signature
+
+
+def is_patient_file_modified(entry, file, content_hash=False):
+    """ Check if a patient file changed since it was recorded in the manifest
+
+    Parameters:
+        entry (dict): Manifest entry of the patient
+        file (str or PatientLocation): Path of the patient JSON file or position in the archive
+        content_hash (bool): Compare content hashes when the modification time changed
+
+    Returns:
+        bool: True if the patient file has to be parsed again
+    """
+
+    # Archive shards are append only, so an archived patient only changes if
+    # it is appended again to another shard
+    if isinstance(file, PatientLocation):
+        return entry.get("shard") != os.path.basename(file.shard) or entry.get("offset") != file.offset
+
+    if "size" not in entry:
+        return True
+
+    stat = os.stat(file)
+
+    if stat.st_size != entry["size"]:
+        return True
+
+    if stat.st_mtime_ns == entry["mtime"]:
+        return False
+
+    if content_hash and "sha256" in entry:
+        return patient_file_signature(file, content_hash=True)["sha256"] != entry["sha256"]
+
+    return True
+
+
+def load_manifest(manifest_path):
+    """ Load the incremental build manifest
+
+    Parameters:
+        manifest_path (str): Path of the manifest JSON file
+
+    Returns:
+        dict: Manifest entries keyed by patient ID, empty if there is no manifest
+    """
+
+    if not os.path.exists(manifest_path):
+        return {}
+
+    with open(manifest_path, "r") as manifest_file:
+        return {int(patient_id): entry for patient_id, entry in json.load(manifest_file).items()}
+
+
+def save_manifest(manifest, manifest_path):
+    """ Atomically replace the incremental build manifest
+
+    Parameters:
+        manifest (dict): Manifest entries keyed by patient ID
+        manifest_path (str): Path of the manifest JSON file
+    """
+
+    temporary_path = f"{manifest_path}.tmp"
+
+    with open(temporary_path, "w") as manifest_file:
+        json.dump({str(patient_id): entry for patient_id, entry in manifest.items()}, manifest_file)
+
+    os.replace(temporary_path, manifest_path)
+
+
+def remove_patients_from_part(part_path, patient_ids):
+    """ Rewrite a Parquet part without the rows of the given patients
+
+    Parameters:
+        part_path (str): Path of the Parquet part
+        patient_ids (list): Patient IDs whose rows are removed
+    """
+
+    table = pyarrow.parquet.read_table(part_path)
+    keep = pyarrow.compute.invert(
+        pyarrow.compute.is_in(table["patient_id"], value_set=pyarrow.array(patient_ids, pyarrow.int64()))
+    )
+    table = table.filter(keep)
+
+    if table.num_rows == 0:
+        os.remove(part_path)
+        return
+
+    temporary_path = f"{part_path}.tmp"
+    pyarrow.parquet.write_table(table, temporary_path, compression=parquet_compression)
+    os.replace(temporary_path, part_path)
+
+
+def compact_parts(dataset_path, manifest, chunk_size, run_id, compaction_threshold=0.5):
+    """ Merge the parts with fewer than compaction_threshold * chunk_size
+    patients into parts of up to chunk_size patients, as incremental builds
+    leave small parts behind when patients are removed or rebuilt. The
+    manifest is saved before the old parts are removed, so an interrupted
+    compaction leaves unreferenced parts that the next build removes
+
+    Parameters:
+        dataset_path (str): Path of the Parquet base dataset directory
+        manifest (dict): Manifest entries keyed by patient ID, updated with the new parts
+        chunk_size (int): Maximum number of patients per part
+        run_id (str): Name of the build run used in the new part names
+        compaction_threshold (float): Fraction of chunk_size below which a part is small
+
+    Returns:
+        int: Number of parts merged
+    """
+
+    part_patients = collections.defaultdict(list)
+    for patient_id, entry in manifest.items():
+        if entry["partition"] is not None:
+            part_patients[entry["partition"]].append(patient_id)
+
+    small_parts = sorted(
+        part for part, patient_ids in part_patients.items()
+        if len(patient_ids) < compaction_threshold * chunk_size
+    )
+
+    if len(small_parts) < 2:
+        return 0
+
+    groups = [[]]
+    group_patients = 0
+    for part in small_parts:
+        if groups[-1] and group_patients + len(part_patients[part]) > chunk_size:
+            groups.append([])
+            group_patients = 0
+
+        groups[-1].append(part)
+        group_patients += len(part_patients[part])
+
+    for index, group in enumerate(groups):
+        compacted_part = f"part-{run_id}-compacted-{index}.parquet"
+        table = pyarrow.concat_tables([pyarrow.parquet.read_table(os.path.join(dataset_path, part)) for part in group])
+        pyarrow.parquet.write_table(table, os.path.join(dataset_path, compacted_part), compression=parquet_compression)
+
+        for part in group:
+            for patient_id in part_patients[part]:
+                manifest[patient_id]["partition"] = compacted_part
+
+    save_manifest(manifest, os.path.join(dataset_path, "_manifest.json"))
+
+    for part in small_parts:
+        os.remove(os.path.join(dataset_path, part))
+
+    return len(small_parts)
+
+
+def rebuild_base_dataset_incremental(patient_files, dataset_path, chunk_size, workers, content_hash=False, compaction_threshold=0.5):
+    """ Update a Parquet base dataset directory parsing only the patient files
+    that are new or changed since the last build. The manifest keeps for
+    every patient the file signature and the part that holds its rows, so
+    changed and deleted patients are removed only from their own parts
+
+    Parameters:
+        patient_files (list): Paths of the patient JSON files or PatientLocation of archived patients
+        dataset_path (str): Path of the Parquet base dataset directory
+        chunk_size (int): Maximum number of patients per part
+        workers (int): Number of ingestion worker processes
+        content_hash (bool): Compare content hashes when the modification time changed
+        compaction_threshold (float): Parts with fewer than this fraction of
+        chunk_size patients are merged, see compact_parts
+
+    Returns:
+        tuple: Number of parsed patient files and number of removed patients
+    """
+
+    os.makedirs(dataset_path, exist_ok=True)
+    manifest_path = os.path.join(dataset_path, "_manifest.json")
+    manifest = load_manifest(manifest_path)
+
+    # Parts not referenced by the manifest come from an interrupted build
+    referenced_parts = {entry["partition"] for entry in manifest.values()}
+    for part in glob.glob(os.path.join(dataset_path, "part-*.parquet")):
+        if os.path.basename(part) not in referenced_parts:
+            os.remove(part)
+
+    current_files = {patient_id_from_file(file): file for file in patient_files}
+    changed_ids = []
+
+    for patient_id, file in sorted(current_files.items()):
+        if patient_id not in manifest or is_patient_file_modified(manifest[patient_id], file, content_hash):
+            changed_ids.append(patient_id)
+        elif not isinstance(file, PatientLocation) and manifest[patient_id]["mtime"] != os.stat(file).st_mtime_ns:
+            # Same content hash with a new modification time, refreshed so the file is not hashed again
+            manifest[patient_id].update(patient_file_signature(file))
+
+    removed_ids = [patient_id for patient_id in manifest if patient_id not in current_files]
+
+    stale_parts = collections.defaultdict(list)
+    for patient_id in removed_ids + [patient_id for patient_id in changed_ids if patient_id in manifest]:
+        if manifest[patient_id]["partition"] is not None:
+            stale_parts[manifest[patient_id]["partition"]].append(patient_id)
+
+    for part, patient_ids in stale_parts.items():
+        remove_patients_from_part(os.path.join(dataset_path, part), patient_ids)
+
+    for patient_id in removed_ids:
+        del manifest[patient_id]
+
+    # Unique even for builds started in the same second, so a build never
+    # overwrites a part that the manifest of another one references
+    run_id = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex}"
+    changed_files = [current_files[patient_id] for patient_id in changed_ids]
+    chunks = iter_flattened_chunks(changed_files, chunk_size, workers)
+
+    for index, columns in enumerate(chunks):
+        part = f"part-{run_id}-{index}.parquet"
+        chunk_ids = changed_ids[index * chunk_size:(index + 1) * chunk_size]
+
+        if len(columns["patient_id"]):
+            writer = ParquetDatasetWriter(os.path.join(dataset_path, part), compression=parquet_compression)
+            writer.write(pandas.DataFrame(columns, columns=BASE_DATASET_COLUMNS))
+            writer.close()
+
+        patients_with_rows = set(columns["patient_id"])
+        for patient_id in chunk_ids:
+            manifest[patient_id] = dict(
+                patient_file_signature(current_files[patient_id], content_hash),
+                partition=part if patient_id in patients_with_rows else None
+            )
+
+    save_manifest(manifest, manifest_path)
+    compact_parts(dataset_path, manifest, chunk_size, run_id, compaction_threshold)
+
+    return len(changed_ids), len(removed_ids)
+
+
 # -
 
-patient_df.to_csv(sleep_dataset_path)
+# ## Build dataset
 
+# +
+ingestion_workers = ingestion_workers or os.cpu_count()
+dataset_writer = None if incremental else open_dataset_writer(base_dataset_path, output_format)
 
+if incremental:
+    if output_format != "parquet" or partition_by is not None:
+        raise ValueError("Incremental builds need a non partitioned parquet output")
+
+    rebuild_base_dataset_incremental(
+        patient_files,
+        base_dataset_path,
+        max_patients_in_memory,
+        ingestion_workers,
+        content_hash=manifest_content_hash,
+        compaction_threshold=compaction_threshold
+    )
+elif streaming:
+    write_base_dataset_streaming(patient_files, dataset_writer, max_patients_in_memory, ingestion_workers)
+else:
+    patient_df = pandas.DataFrame(
+        concatenate_columns(iter_flattened_chunks(patient_files, max_patients_in_memory, ingestion_workers)),
+        columns=BASE_DATASET_COLUMNS
+    )
+
+    dataset_writer.write(patient_df)
+    dataset_writer.close()
+# -
@@ -19,19 +19,31 @@
 # + papermill={"duration": 6.692203, "end_time": "2020-03-08T15:34:40.469491", "exception": false, "start_time": "2020-03-08T15:34:33.777288", "status": "completed"} tags=[]
 # %%capture
 
-# %pip install -U ray requests
+# %pip install -U aiohttp
 
 # + papermill={"duration": 0.644836, "end_time": "2020-03-08T15:34:41.127733", "exception": false, "start_time": "2020-03-08T15:34:40.482897", "status": "completed"} tags=[]
 import os
-import ray
+import sys
 import datetime
-import requests
 
-# IPython tools
-from IPython.display import clear_output
-
-# + papermill={"duration": 0.815036, "end_time": "2020-03-08T15:34:41.954566", "exception": false, "start_time": "2020-03-08T15:34:41.139530", "status": "completed"} tags=[]
-_ = ray.init(redis_max_memory=10**9, object_store_memory=7.8**9)
+# API client shared with the other packages
+sys.path.append(os.path.join(os.path.pardir, "python"))
+
+from api_client import (
+    KNOWN_GAP,
+    AdaptiveConcurrency,
+    ApiClient,
+    RetryPolicy,
+    list_contains_date_grater_than,
+    pull_api_data,
+    pull_patient_ids,
+    run_sync,
+)
+from retry_queue import RetryQueue
+from pull_checkpoint import PullCheckpoint
+from patient_archive import PatientArchive
+from pull_metrics import PullMetrics
+from known_gaps import KnownGaps
 
 # + [markdown] papermill={"duration": 0.090414, "end_time": "2020-03-08T15:34:42.117306", "exception": false, "start_time": "2020-03-08T15:34:42.026892", "status": "completed"} tags=[]
 # ## Parameters
@@ -41,29 +53,112 @@ api_url = "https://apimapa.sicor.com.co"
 api_username = ""
 api_password = ""
 
+# Seconds an API token is valid, None reads the expiry from the token itself.
+# Tokens are also refreshed whenever the API answers 401
+api_token_ttl = None
+
 test_patient_id = 5331
 
 pull_data_end_date = "2020-01-01"
 
 concurrent_workers = 100
+max_in_flight_requests = 100
 max_consecutive_error = 150
+
+# With adaptive_concurrency the requests in flight start at
+# initial_in_flight_requests and are tuned during the pull between
+# min_in_flight_requests and max_in_flight_requests: raised while latency
+# and errors stay low, cut when the API slows down or answers 429/5xx.
+# concurrent_workers still caps the patients in flight
+adaptive_concurrency = True
+initial_in_flight_requests = 16
+min_in_flight_requests = 4
+
+# Transient failures (timeouts, connection errors, 429 and 5xx) are retried
+# with exponential backoff and jitter. api_rate_limit caps the requests per
+# second to the API host, None leaves it unlimited
+api_retry_attempts = 5
+api_retry_base_delay = 0.5
+api_retry_max_delay = 30
+api_request_timeout = 60
+api_rate_limit = None
+api_rate_burst = None
+
+# Directory of the patient archive. Every pull appends the new patients to
+# its own compressed shard
 api_data_save_path = "./api-data/"
-api_error_save_path = "./ERROR"
+
+# Highest patient ID saved and the IDs that failed, updated as patients are
+# saved so an interrupted pull resumes where it stopped
+api_checkpoint_path = "./api-data.checkpoint"
+
+# Patients whose pull failed are queued in this SQLite database. With
+# retry_failed only the queued patients are pulled again, skipping the ones
+# that already failed max_retry_attempts times (None retries all of them)
+api_retry_queue_path = "./failed_patients.sqlite"
+retry_failed = False
+max_retry_attempts = None
+
+# The endpoint of api_probe_endpoint ("data", "measure", "drugs" or
+# "meta_data") is requested first and the other three only if it is not
+# empty, None requests the four at once. Patient IDs confirmed missing below
+# a patient that exists are kept in the api_known_gaps_path bitmap and
+# skipped by later pulls unless skip_known_gaps is False
+api_probe_endpoint = "meta_data"
+api_known_gaps_path = "./known-gaps.bitmap"
+skip_known_gaps = True
+
+# Request counts by endpoint and status, latency histograms by endpoint and
+# by stage (auth, fetch, serialize, write) and queue depths are written as
+# JSON and Prometheus text when the pull ends and with every progress line.
+# Progress is logged as JSON lines every metrics_report_interval seconds
+api_metrics_path = "./pull-metrics.json"
+api_metrics_prometheus_path = "./pull-metrics.prom"
+api_metrics_log_path = "./pull-metrics.log"
+metrics_report_interval = 30
 
 # + [markdown] papermill={"duration": 0.034861, "end_time": "2020-03-08T15:34:42.990112", "exception": false, "start_time": "2020-03-08T15:34:42.955251", "status": "completed"} tags=[]
-# ## Build URLs
+# ## Parse dates
 
 # + papermill={"duration": 0.089013, "end_time": "2020-03-08T15:34:43.153377", "exception": false, "start_time": "2020-03-08T15:34:43.064364", "status": "completed"} tags=[]
-import urllib.parse
+pull_data_end_date = datetime.datetime.strptime(pull_data_end_date, "%Y-%m-%d")
 
 
-auth_url = urllib.parse.urljoin(api_url, "login")
-map_meta_data_url = urllib.parse.urljoin(api_url, "get_mapa/") 
-map_data_url = urllib.parse.urljoin(api_url, "tabla_mediciones/")
-map_measure_url = urllib.parse.urljoin(api_url, "MAPA/")
-map_drug_url = urllib.parse.urljoin(api_url, "medicamentos/")
+# +
+def open_api_client(metrics=None):
+    """ Create the API client with the configured concurrency, retries and rate
+    limit. Every client gets its own adaptive concurrency, starting again from
+    initial_in_flight_requests
 
-pull_data_end_date = datetime.datetime.strptime(pull_data_end_date, "%Y-%m-%d")
+    Parameters:
+        metrics (PullMetrics): Collects the metrics of the requests, None discards them
+
+    Returns:
+        ApiClient: API client to be used as an async context manager
+    """
+
+    return ApiClient(
+        api_url,
+        api_username,
+        api_password,
+        max_in_flight=max_in_flight_requests,
+        token_ttl=api_token_ttl,
+        retry_policy=RetryPolicy(
+            attempts=api_retry_attempts,
+            base_delay=api_retry_base_delay,
+            max_delay=api_retry_max_delay,
+            timeout=api_request_timeout
+        ),
+        rate_limit=api_rate_limit,
+        rate_burst=api_rate_burst,
+        metrics=metrics,
+        probe_key=api_probe_endpoint,
+        adaptive_concurrency=AdaptiveConcurrency(
+            initial=initial_in_flight_requests,
+            minimum=min_in_flight_requests,
+            maximum=max_in_flight_requests
+        ) if adaptive_concurrency else None
+    )
 
 # + [markdown] papermill={"duration": 0.088115, "end_time": "2020-03-08T15:34:43.315549", "exception": false, "start_time": "2020-03-08T15:34:43.227434", "status": "completed"} tags=[]
 # ## Get latest patient Id
@@ -81,184 +176,110 @@ def get_max_patient_id(api_data_save_path):
     return 0
 
 
-start_patient_id = get_max_patient_id(api_data_save_path)
+checkpoint = PullCheckpoint(api_checkpoint_path)
+
+# Without a checkpoint, resume once from the patients already pulled, either
+# archived or in the JSON files of the previous format
+if not checkpoint.exists:
+    checkpoint.high_water_mark = max(
+        get_max_patient_id(api_data_save_path),
+        PatientArchive(api_data_save_path).max_patient_id()
+    )
+    checkpoint.save()
+
+start_patient_id = checkpoint.start_patient_id
 start_patient_id
 
 
 # + [markdown] papermill={"duration": 0.031449, "end_time": "2020-03-08T15:34:43.569648", "exception": false, "start_time": "2020-03-08T15:34:43.538199", "status": "completed"} tags=[]
 # ## Get data from API
 
-# + papermill={"duration": 0.030087, "end_time": "2020-03-08T15:34:43.625823", "exception": false, "start_time": "2020-03-08T15:34:43.595736", "status": "completed"} tags=[]
-def get_api_token(url, username, password):
-    """ Get authentication token to access to other API URLs
+# +
+async def get_test_patient_data():
+    """ Pull every endpoint for the test patient through a pooled API client
 
-    Parameters:
-        url (str): URL from where token is going te be pulled
-        username (str): API username
-        password (str): API password
-    
     Returns:
-        str: API Euthentication token
+        dict: JSON data pulled from API for test_patient_id
     """
-    
-    payload = {
-        "user": username,
-        "password": password,
-    }
-    
-    response = requests.post(url, data=payload)
-    response.raise_for_status()
-    
-    return response.json()['res']
 
+    async with open_api_client() as client:
+        return await client.get_complete_api_data(test_patient_id)
 
-# + papermill={"duration": 1.53881, "end_time": "2020-03-08T15:34:45.181421", "exception": false, "start_time": "2020-03-08T15:34:43.642611", "status": "completed"} tags=[]
-api_token = get_api_token(auth_url, api_username, api_password)
 
-# + papermill={"duration": 0.788874, "end_time": "2020-03-08T15:34:46.029684", "exception": false, "start_time": "2020-03-08T15:34:45.240810", "status": "completed"} tags=[]
-import urllib.parse
+_ = run_sync(get_test_patient_data())
 
 
-def get_api_data(url, token, patient_id):
-    """ Get data from an specific API URL
-    
-    Parameters:
-        url (str): API url to make a GET request to get JSON data
-        token (str): Authentication token needed for the request
-        patient_id (int): The patient ABPM test ID 
-
-    Returns:
-        dict: JSON data from the API 
-    """
-    
-    url = urllib.parse.urljoin(url, f"{patient_id}/")
-   
-    response = requests.get(
-        url,
-        headers = {
-            "authorization": f"Bearer {token}",
-        },
-    )
+# + [markdown] papermill={"duration": 0.028144, "end_time": "2020-03-08T15:34:54.746819", "exception": false, "start_time": "2020-03-08T15:34:54.718675", "status": "completed"} tags=[]
+# ## Patient data archive
 
-    response.raise_for_status()
-    
-    return response.json()
+# + papermill={"duration": 0.020464, "end_time": "2020-03-08T15:34:54.783255", "exception": false, "start_time": "2020-03-08T15:34:54.762791", "status": "completed"} tags=[]
+def save_api_error(retry_queue, patient_id, status_code):
+    """ Queue a failed patient and mark it as missing in the checkpoint
 
+    Parameters:
+        retry_queue (RetryQueue): Open failed patients queue
+        patient_id (int): Patient ABPM test ID that failed
+        status_code (int or str): HTTP status of the failed request, or the kind of failure
+    """
 
-# + papermill={"duration": 4.244094, "end_time": "2020-03-08T15:34:50.353792", "exception": false, "start_time": "2020-03-08T15:34:46.109698", "status": "completed"} tags=[]
-_ = get_api_data(map_data_url, api_token, test_patient_id)
-_ = get_api_data(map_measure_url, api_token, test_patient_id)
-_ = get_api_data(map_drug_url, api_token, test_patient_id)
-_ = get_api_data(map_meta_data_url, api_token, test_patient_id)
+    retry_queue.add(patient_id, status_code)
+    checkpoint.failed(patient_id)
 
-# + papermill={"duration": 0.289915, "end_time": "2020-03-08T15:34:50.955048", "exception": false, "start_time": "2020-03-08T15:34:50.665133", "status": "completed"} tags=[]
-import urllib.parse
 
+def save_api_patient(archive, patient_data):
+    """ Append a patient to the archive, timing the serialize and write stages
 
-def get_complete_api_data(username, password, patient_id):
-    """ Get data, measure and drugs for an specific ABPM test
-    
     Parameters:
-        username (str): API user name used to get API token
-        password (str): API password used to get API token
-        patient_id (int): Patient ABPM test ID to pull data from
-
-    Returns:
-        dict: JSON data pulled from API, id has the ABPM test ID.
-        Data contains the test meta data like start date, night 
-        time and other importante data. Measure contains the real ABPM
-        measurements. Drugs contain the drugs taken by a patient during
-        the ABPM test.
+        archive (PatientArchive): Open patient archive
+        patient_data (dict): JSON data pulled from the API
     """
-    
-    token = get_api_token(auth_url, username, password)
-    
-    map_data = get_api_data(map_data_url, token, patient_id)
-    map_measure = get_api_data(map_measure_url, token, patient_id)
-    map_drugs =  get_api_data(map_drug_url, token, patient_id)
-    map_meta_data = get_api_data(map_meta_data_url, api_token, patient_id)
-    
-    return {
-        "id": patient_id,
-        "data": map_data,
-        "meta_data": map_meta_data,
-        "measure": map_measure,
-        "drugs": map_measure,
-    }
 
+    with metrics.stage("serialize"):
+        data = archive.encode(patient_data)
 
-# + papermill={"duration": 3.259291, "end_time": "2020-03-08T15:34:54.655911", "exception": false, "start_time": "2020-03-08T15:34:51.396620", "status": "completed"} tags=[]
-_ = get_complete_api_data(api_username, api_password, test_patient_id)
+    with metrics.stage("write"):
+        archive.append_encoded(patient_data["id"], data)
+        checkpoint.saved(patient_data["id"])
 
 
-# + [markdown] papermill={"duration": 0.028144, "end_time": "2020-03-08T15:34:54.746819", "exception": false, "start_time": "2020-03-08T15:34:54.718675", "status": "completed"} tags=[]
-# ## Parallelized API data collection
+def save_known_gaps(patient_ids):
+    """ Record patient IDs confirmed missing in the known gaps bitmap
 
-# + papermill={"duration": 0.020464, "end_time": "2020-03-08T15:34:54.783255", "exception": false, "start_time": "2020-03-08T15:34:54.762791", "status": "completed"} tags=[]
-@ray.remote
-def get_complete_api_data_async(username, password, patient_id):
-    """ Wrapper for the get_complete_api_data so that it can be ran
-    in parallel and asyncrhonusly 
-    
     Parameters:
-        username (str): API user name used to get API token
-        password (str): API password used to get API token
-        patient_id (int): Patient ABPM test ID to pull data from
-
-    Returns:
-        dict: JSON data pulled from API, id has the ABPM test ID.
-        Data contains the test meta data like start date, night 
-        time and other importante data. Measure contains the real ABPM
-        measurements. Drugs contain the drugs taken by a patient during
-        the ABPM test.
+        patient_ids (list): Patient ABPM test IDs missing in the API
     """
-    
-    try:
-        user_data = get_complete_api_data(username, password, patient_id)
-    except requests.HTTPError as error:
-        with open(api_error_save_path, "a+") as file:
-            error_data = f"ERROR -- Patient ID: {patient_id} -- {error.response.status_code} \n"
-            file.write(error_data)
-            
-        return None
-    
-    return user_data
 
+    for patient_id in patient_ids:
+        known_gaps.add(patient_id)
 
-# + papermill={"duration": 4.267014, "end_time": "2020-03-08T15:34:59.062874", "exception": false, "start_time": "2020-03-08T15:34:54.795860", "status": "completed"} tags=[]
-_ = ray.get(get_complete_api_data_async.remote(api_username, api_password, test_patient_id))
+    known_gaps.save()
+    metrics.increment("pull_known_gaps_added_total", len(patient_ids))
 
 
-# + [markdown] papermill={"duration": 0.897492, "end_time": "2020-03-08T15:34:59.999325", "exception": false, "start_time": "2020-03-08T15:34:59.101833", "status": "completed"} tags=[]
-# ## Stop condition for API data pull
+def report_progress(index, patient_id, force=False):
+    """ Log the pull progress and export the metrics, at most once every
+    metrics_report_interval seconds unless forced
 
-# + papermill={"duration": 0.027734, "end_time": "2020-03-08T15:35:00.100908", "exception": false, "start_time": "2020-03-08T15:35:00.073174", "status": "completed"} tags=[]
-def list_contains_date_grater_than(patient_data_list, end_date):
-    """
-    
     Parameters:
-        patient_data_list (dict): List of ABPM request resonses
-        end_date (datetime): The newest date for the revelant data
-        we are pretending to get.
-
-    Returns:
-        bool: If the end_data is less than any of the start_dates of
-        the ABPM return True so that pulling data ends. Other way
-        return False so that data pull continues.
+        index (int): Number of patients saved so far
+        patient_id (int): Last patient ID saved
+        force (bool): Report even if the last report is recent
     """
-    
-    for map_data in patient_data_list:   
-        if map_data and map_data.get('data'):  
-            start_date = map_data['data'][0]['fecha_dt'].split(' ')[0]
-            start_date = datetime.datetime.strptime(start_date, '%Y-%m-%d')
-        else:
-            start_date = datetime.datetime.strptime("1900-1-1", '%Y-%m-%d')
-                   
-        if end_date < start_date:
-            return True
-        
-    return False
 
+    last_report_at = metrics.last_report_at
+    metrics.report_progress(index, patient_id, force=force)
+
+    if metrics.last_report_at != last_report_at:
+        metrics.write_json(api_metrics_path)
+        metrics.write_prometheus(api_metrics_prometheus_path)
+
+
+metrics = PullMetrics(api_metrics_log_path, metrics_report_interval)
+known_gaps = KnownGaps(api_known_gaps_path)
+
+
+# + [markdown] papermill={"duration": 0.897492, "end_time": "2020-03-08T15:34:59.999325", "exception": false, "start_time": "2020-03-08T15:34:59.101833", "status": "completed"} tags=[]
+# ## Stop condition for API data pull
 
 # + papermill={"duration": 0.14055, "end_time": "2020-03-08T15:35:00.254233", "exception": false, "start_time": "2020-03-08T15:35:00.113683", "status": "completed"} tags=[]
 # Test the list_contains_date_grater_than function
@@ -294,83 +315,111 @@ assert list_contains_date_grater_than(
 # + [markdown] papermill={"duration": 0.014364, "end_time": "2020-03-08T15:35:00.355063", "exception": false, "start_time": "2020-03-08T15:35:00.340699", "status": "completed"} tags=[]
 # ## Save the data from the API
 
-# + papermill={"duration": 0.104463, "end_time": "2020-03-08T15:35:00.474799", "exception": false, "start_time": "2020-03-08T15:35:00.370336", "status": "completed"} tags=[]
-def pull_api_data(start_patient_id, pull_data_end_date, concurrent_workers, max_consecutive_error):
-    """ Get data from API for all patients in the range start_patient_id to the first
-    patient_id whos start_date < pull_data_end_date.
-    
-    Parameters:
-        start_patient_id (int): The firts ABPM test ID from where to start pulling data
-        pull_data_end_date (datetime): The upper date cap for test to be pulled
-        concurrent_workers (int): The number of concurrent requests to be made at a single time
-        max_consecutive_error (int): The maximum number of continous errors before stoping the pulling process
-
-    Returns:
-        generator: Generates an API response for each of the users pulled at batches of size concurrent_workers
-    """
-    
-    error_count = 0
-    finish_pulling = False
-    start_pull_index = start_patient_id
-
-    while not finish_pulling:
-        end_pull_index = start_pull_index + concurrent_workers
-        
-        futures = [
-            get_complete_api_data_async.remote(
-                api_username,
-                api_password,
-                patient_id
-            ) for patient_id in range(start_pull_index, end_pull_index)
-        ]
-        
-        api_data = ray.get(futures)
-        
-        finish_pulling = list_contains_date_grater_than(api_data, pull_data_end_date)
-        
-        if finish_pulling: 
-            break
-        
-        for id, patient_data in enumerate(api_data):
-            if patient_data and patient_data.get("data"):
-                error_count = 0
-                yield patient_data
-            else:
-                error_count += 1
-                
-        if max_consecutive_error < error_count:
-            finish_pulling = True
-            
-        start_pull_index = end_pull_index
-
-
 # + papermill={"duration": 186.400283, "end_time": "2020-03-08T15:38:06.912773", "exception": false, "start_time": "2020-03-08T15:35:00.512490", "status": "completed"} tags=[]
-import json
-import time
-
-
-start_time = time.time()
-os.makedirs(api_data_save_path, exist_ok=True)
+async def save_api_data():
+    """ Pull the data of every new patient and append it to the patient
+    archive, queueing the patients that fail
+    """
 
-for index, patient_data in enumerate(pull_api_data(start_patient_id, pull_data_end_date, concurrent_workers, max_consecutive_error)):
-    elapsed_time = time.time() - start_time
+    # The queue is opened here because run_sync may run this coroutine in another thread
+    with RetryQueue(api_retry_queue_path) as retry_queue, PatientArchive(api_data_save_path) as archive:
+        async with open_api_client(metrics) as client:
+            patient_data_stream = pull_api_data(
+                client,
+                start_patient_id,
+                pull_data_end_date,
+                concurrent_workers,
+                max_consecutive_error,
+                on_error=lambda patient_id, status_code: save_api_error(retry_queue, patient_id, status_code),
+                known_gaps=known_gaps if skip_known_gaps else None,
+                on_gap=save_known_gaps
+            )
+
+            index = 0
+            patient_id = None
+
+            try:
+                async for patient_data in patient_data_stream:
+                    save_api_patient(archive, patient_data)
+                    index += 1
+                    patient_id = patient_data["id"]
+                    report_progress(index, patient_id)
+            finally:
+                checkpoint.save()
+                report_progress(index, patient_id, force=True)
+
+
+async def save_failed_api_data():
+    """ Pull again the data of the queued patients, removing them from the
+    queue once they are pulled. Queued patients that are known gaps are
+    removed without a request
+    """
 
-    with open(os.path.join(api_data_save_path, f"{patient_data.get('id')}.json"), "w+") as file:
-        file.write(json.dumps(patient_data))
-            
-    clear_output(wait=True)
-    print(f"Speed: {index / elapsed_time}r/s -- Elapse Time: {elapsed_time}s -- Patient Id: {patient_data.get('id')}")
+    if skip_known_gaps:
+        for patient_id in [patient_id for patient_id in checkpoint.missing_patient_ids if patient_id in known_gaps]:
+            checkpoint.resolved(patient_id)
+
+    with RetryQueue(api_retry_queue_path) as retry_queue, PatientArchive(api_data_save_path) as archive:
+        async with open_api_client(metrics) as client:
+            patient_data_stream = pull_patient_ids(
+                client,
+                retry_queue.patient_ids(max_retry_attempts),
+                concurrent_workers,
+                on_error=lambda patient_id, status_code: save_api_error(retry_queue, patient_id, status_code),
+                known_gaps=known_gaps if skip_known_gaps else None
+            )
+
+            index = 0
+            last_patient_id = None
+
+            try:
+                async for patient_id, patient_data in patient_data_stream:
+                    if patient_data is None:
+                        continue
+
+                    if patient_data is KNOWN_GAP:
+                        retry_queue.remove(patient_id)
+                        checkpoint.resolved(patient_id)
+                        continue
+
+                    # A queued patient below the newest one saved that is still missing is a gap
+                    if not patient_data.get("data") and patient_id < (checkpoint.high_water_mark or 0):
+                        save_known_gaps([patient_id])
+
+                    if patient_data.get("data"):
+                        with metrics.stage("serialize"):
+                            data = archive.encode(patient_data)
+
+                        with metrics.stage("write"):
+                            archive.append_encoded(patient_id, data)
+
+                    retry_queue.remove(patient_id)
+                    checkpoint.resolved(patient_id)
+                    index += 1
+                    last_patient_id = patient_id
+                    report_progress(index, last_patient_id)
+            finally:
+                checkpoint.save()
+                report_progress(index, last_patient_id, force=True)
+
+
+if retry_failed:
+    run_sync(save_failed_api_data())
+else:
+    run_sync(save_api_data())
 
 # + [markdown] papermill={"duration": 0.050278, "end_time": "2020-03-08T15:38:06.980527", "exception": false, "start_time": "2020-03-08T15:38:06.930249", "status": "completed"} tags=[]
-# ## API Errors
+# ## Failed patients queue
 
 # + papermill={"duration": 0.02603, "end_time": "2020-03-08T15:38:07.050131", "exception": false, "start_time": "2020-03-08T15:38:07.024101", "status": "completed"} tags=[]
-import os
+with RetryQueue(api_retry_queue_path) as retry_queue:
+    print(f"Queued patients: {len(retry_queue)} -- By status: {retry_queue.status_counts()}")
 
+    for entry in retry_queue.entries():
+        print(entry)
 
-if os.path.exists(api_error_save_path):
-    with open(api_error_save_path, "r+") as file:
-        print(file.read())
+print(f"Checkpoint: {checkpoint.high_water_mark} -- Missing patients: {sorted(checkpoint.missing_patient_ids)}")
+print(f"Known gaps: {len(known_gaps)}")
 # -
 
 
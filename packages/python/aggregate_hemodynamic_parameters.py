@@ -0,0 +1,365 @@
+"""
+Command line tool that summarizes every ABPM study of the base dataset
+built by build_base_dataset: the 24 hour, daytime and night-time means of
+the blood pressure readings and of the hemodynamic parameters, and their
+nocturnal dipping ratio, in one summary row per study.
+
+    python aggregate_hemodynamic_parameters.py sleep_dataset.parquet study_summary.csv --workers 4
+
+Readings are assigned to the night of their study, which can cross midnight,
+and reduced with segmented sums over the whole dataset in a single pass, so
+chunks can split a study without changing the result.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy
+import pandas
+
+import hemodynamic_validation
+import vectorized_hemodynamic_parameters
+from compute_hemodynamic_parameters import (
+    BIRTH_DATE_COLUMN,
+    MEASURE_DATE_COLUMN,
+    WEIGHT_COLUMN,
+    HEIGHT_COLUMN,
+    SYSTOLIC_BLOOD_PRESSURE_COLUMN,
+    DIASTOLIC_BLOOD_PRESSURE_COLUMN,
+    HEART_RATE_COLUMN,
+    INPUT_COLUMNS,
+    HEIGHT_UNITS,
+    age_in_years,
+    numeric_values,
+    dataset_format,
+    iter_dataset_chunks,
+    iter_computed_chunks,
+    CsvChunkWriter,
+    ParquetChunkWriter,
+    print_progress,
+)
+
+
+PATIENT_ID_COLUMN = "patient_id"
+START_NIGHT_COLUMN = "start_night"
+END_NIGHT_COLUMN = "end_night"
+
+STUDY_COLUMNS = [PATIENT_ID_COLUMN, START_NIGHT_COLUMN, END_NIGHT_COLUMN]
+
+# Readings summarized along with the hemodynamic parameters
+READING_COLUMNS = [
+    SYSTOLIC_BLOOD_PRESSURE_COLUMN,
+    DIASTOLIC_BLOOD_PRESSURE_COLUMN,
+    HEART_RATE_COLUMN,
+]
+
+WINDOWS = ("24h", "day", "night")
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def seconds_of_day(date_time):
+    """ Seconds elapsed since midnight of each date time
+
+    Parameters:
+        date_time (Series): Date times, as date times or date time strings
+
+    Returns:
+        numpy.ndarray: Seconds since midnight, NaN for missing date times
+    """
+
+    date_time = pandas.to_datetime(date_time, errors="coerce")
+
+    return (date_time - date_time.dt.normalize()).dt.total_seconds().to_numpy(dtype=numpy.float64)
+
+
+def seconds_of_time(time_of_day):
+    """ Seconds since midnight of night start or end times, as "HH:MM:SS"
+    strings or time deltas like the typed base dataset stores them
+
+    Parameters:
+        time_of_day (Series): Times of the day
+
+    Returns:
+        numpy.ndarray: Seconds since midnight, NaN for missing or invalid times
+    """
+
+    time_of_day = pandas.to_timedelta(time_of_day, errors="coerce")
+
+    return time_of_day.dt.total_seconds().to_numpy(dtype=numpy.float64) % SECONDS_PER_DAY
+
+
+def night_mask(measure_seconds, start_night_seconds, end_night_seconds):
+    """ Readings taken during the night of their study. A night that starts
+    later in the day than it ends crosses midnight
+
+    Parameters:
+        measure_seconds (numpy.ndarray): Seconds since midnight of each reading
+        start_night_seconds (numpy.ndarray): Seconds since midnight of the night start of each reading study
+        end_night_seconds (numpy.ndarray): Seconds since midnight of the night end of each reading study
+
+    Returns:
+        tuple: Boolean arrays of the night readings and of the readings whose window is known
+    """
+
+    known = numpy.isfinite(measure_seconds) & numpy.isfinite(start_night_seconds) & numpy.isfinite(end_night_seconds)
+
+    with numpy.errstate(invalid="ignore"):
+        after_start = measure_seconds >= start_night_seconds
+        before_end = measure_seconds < end_night_seconds
+        crosses_midnight = start_night_seconds > end_night_seconds
+
+    night = numpy.where(crosses_midnight, after_start | before_end, after_start & before_end)
+
+    return night & known, known
+
+
+def aggregate_chunk(chunk_df, parameters, height_unit="cm", left_ventricular_ejection_fraction=0.65):
+    """ Reduce a chunk of the base dataset to per study sums of the readings
+    and parameters for each window. Runs in the worker processes
+
+    Parameters:
+        chunk_df (DataFrame): Chunk with the INPUT_COLUMNS and STUDY_COLUMNS of the base dataset
+        parameters (tuple): Names of the parameters to summarize
+        height_unit (str): Unit of the height column, "cm" or "m"
+        left_ventricular_ejection_fraction (float): Ejection fraction used by the elastance parameters
+
+    Returns:
+        DataFrame: Indexed by patient ID, with the number of readings, a
+            "<window>_count" column of the valid ones and a "<name>_<window>_sum"
+            column for each reading and parameter
+    """
+
+    systolic_blood_pressure = numeric_values(chunk_df[SYSTOLIC_BLOOD_PRESSURE_COLUMN])
+    diastolic_blood_pressure = numeric_values(chunk_df[DIASTOLIC_BLOOD_PRESSURE_COLUMN])
+    heart_rate = numeric_values(chunk_df[HEART_RATE_COLUMN])
+
+    results, valid, _ = hemodynamic_validation.compute(
+        parameters,
+        age_in_years(chunk_df[BIRTH_DATE_COLUMN], chunk_df[MEASURE_DATE_COLUMN]),
+        numeric_values(chunk_df[WEIGHT_COLUMN]),
+        numeric_values(chunk_df[HEIGHT_COLUMN]) * HEIGHT_UNITS[height_unit],
+        systolic_blood_pressure,
+        diastolic_blood_pressure,
+        heart_rate,
+        left_ventricular_ejection_fraction,
+    )
+
+    values = dict(zip(READING_COLUMNS, (systolic_blood_pressure, diastolic_blood_pressure, heart_rate)))
+    values.update(results)
+
+    night, known = night_mask(
+        seconds_of_day(chunk_df[MEASURE_DATE_COLUMN]),
+        seconds_of_time(chunk_df[START_NIGHT_COLUMN]),
+        seconds_of_time(chunk_df[END_NIGHT_COLUMN]),
+    )
+    valid = numpy.broadcast_to(valid, len(chunk_df))
+    window_masks = {
+        "24h": valid,
+        "day": valid & known & ~night,
+        "night": valid & night,
+    }
+
+    # Segmented reductions: every study is a segment of the bincount
+    patient_ids, segments = numpy.unique(chunk_df[PATIENT_ID_COLUMN].to_numpy(), return_inverse=True)
+    segments = segments.reshape(-1)
+    sums = {"readings": numpy.bincount(segments, minlength=len(patient_ids))}
+
+    for window, mask in window_masks.items():
+        window_segments = segments[mask]
+        sums[f"{window}_count"] = numpy.bincount(window_segments, minlength=len(patient_ids))
+
+        for name, value in values.items():
+            sums[f"{name}_{window}_sum"] = numpy.bincount(
+                window_segments,
+                weights=numpy.broadcast_to(value, len(chunk_df))[mask],
+                minlength=len(patient_ids)
+            )
+
+    return pandas.DataFrame(sums, index=pandas.Index(patient_ids, name=PATIENT_ID_COLUMN))
+
+
+def summarize_studies(sums_df, names):
+    """ Turn the per study sums into means and nocturnal dipping ratios
+
+    Parameters:
+        sums_df (DataFrame): Per study sums, as returned by aggregate_chunk
+        names (iterable): Readings and parameters to summarize
+
+    Returns:
+        DataFrame: One row per study with the number of readings, the valid
+            readings of each window, the "<name>_<window>" means and the
+            "<name>_dipping_ratio" of the night mean over the day mean
+    """
+
+    summary = {"readings": sums_df["readings"].to_numpy(dtype=numpy.int64)}
+
+    for window in WINDOWS:
+        summary[f"{window}_count"] = sums_df[f"{window}_count"].to_numpy(dtype=numpy.int64)
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        for name in names:
+            for window in WINDOWS:
+                count = sums_df[f"{window}_count"].to_numpy(dtype=numpy.float64)
+                summary[f"{name}_{window}"] = numpy.where(
+                    count > 0, sums_df[f"{name}_{window}_sum"].to_numpy() / count, numpy.nan
+                )
+
+            day_mean = summary[f"{name}_day"]
+            summary[f"{name}_dipping_ratio"] = numpy.where(day_mean != 0, summary[f"{name}_night"] / day_mean, numpy.nan)
+
+    return pandas.DataFrame(summary, index=sums_df.index).reset_index()
+
+
+def aggregate_studies(dataset_df, parameters=vectorized_hemodynamic_parameters.PARAMETERS, **aggregate_arguments):
+    """ Summarize the studies of a base dataset already in memory
+
+    Parameters:
+        dataset_df (DataFrame): Base dataset with the INPUT_COLUMNS and STUDY_COLUMNS
+        parameters (iterable): Names of the parameters to summarize
+        aggregate_arguments: Arguments of aggregate_chunk
+
+    Returns:
+        DataFrame: One summary row per study, see summarize_studies
+    """
+
+    parameters = tuple(parameters)
+    sums_df = aggregate_chunk(dataset_df, parameters, **aggregate_arguments)
+
+    return summarize_studies(sums_df, READING_COLUMNS + list(parameters))
+
+
+def aggregate_dataset(
+    input_path,
+    output_path,
+    parameters=vectorized_hemodynamic_parameters.PARAMETERS,
+    input_format=None,
+    output_format=None,
+    chunk_size=500000,
+    workers=None,
+    height_unit="cm",
+    left_ventricular_ejection_fraction=0.65,
+    progress=None
+    ):
+    """ Summarize every study of a whole base dataset, reading it chunk by chunk
+
+    Parameters:
+        input_path (str): Path of the base dataset, a CSV file or a Parquet file or directory
+        output_path (str): Path of the CSV or Parquet summary file
+        parameters (iterable): Names of the parameters to summarize
+        input_format (str): "csv" or "parquet", guessed from input_path by default
+        output_format (str): "csv" or "parquet", guessed from output_path by default
+        chunk_size (int): Maximum number of rows per chunk
+        workers (int): Number of worker processes, every CPU core by default
+        height_unit (str): Unit of the height column, "cm" or "m"
+        left_ventricular_ejection_fraction (float): Ejection fraction used by the elastance parameters
+        progress (callable): Called after each chunk with the rows read and the elapsed seconds
+
+    Returns:
+        int: Number of studies written
+    """
+
+    parameters = tuple(parameters)
+    unknown_parameters = set(parameters) - set(vectorized_hemodynamic_parameters.PARAMETERS)
+
+    if unknown_parameters:
+        raise ValueError(f"Unknown hemodynamic parameters: {', '.join(sorted(unknown_parameters))}")
+
+    input_format = dataset_format(input_path, input_format)
+    output_format = dataset_format(output_path, output_format)
+    workers = workers or os.cpu_count()
+
+    chunks = iter_computed_chunks(
+        iter_dataset_chunks(input_path, input_format, chunk_size, list(dict.fromkeys(STUDY_COLUMNS + INPUT_COLUMNS))),
+        workers,
+        chunk_function=aggregate_chunk,
+        parameters=parameters,
+        height_unit=height_unit,
+        left_ventricular_ejection_fraction=left_ventricular_ejection_fraction,
+    )
+
+    start_time = time.time()
+    row_count = 0
+    partial_sums = []
+
+    for sums_df in chunks:
+        partial_sums.append(sums_df)
+        row_count += int(sums_df["readings"].sum())
+
+        if progress is not None:
+            progress(row_count, time.time() - start_time)
+
+    # Only the studies split across chunks appear in more than one partial sum
+    if partial_sums:
+        sums_df = pandas.concat(partial_sums).groupby(level=0, sort=True).sum()
+    else:
+        sums_df = aggregate_chunk(pandas.DataFrame(columns=STUDY_COLUMNS + INPUT_COLUMNS), parameters)
+
+    summary_df = summarize_studies(sums_df, READING_COLUMNS + list(parameters))
+
+    writer = CsvChunkWriter(output_path) if output_format == "csv" else ParquetChunkWriter(output_path)
+    try:
+        writer.write(summary_df)
+    finally:
+        writer.close()
+
+    return len(summary_df)
+
+
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(
+        description="Summarize the 24 hour, day and night hemodynamic parameters of every study of a base dataset"
+    )
+    parser.add_argument("input_path", help="base dataset, a CSV file or a Parquet file or directory")
+    parser.add_argument("output_path", help="output CSV or Parquet file, one row per study")
+    parser.add_argument(
+        "--parameters",
+        default=",".join(vectorized_hemodynamic_parameters.PARAMETERS),
+        help="comma separated parameters to summarize, all of them by default"
+    )
+    parser.add_argument("--input-format", choices=["csv", "parquet"], help="guessed from the input path by default")
+    parser.add_argument("--output-format", choices=["csv", "parquet"], help="guessed from the output path by default")
+    parser.add_argument("--chunk-size", type=int, default=500000, help="rows per chunk")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, every CPU core by default")
+    parser.add_argument("--height-unit", choices=sorted(HEIGHT_UNITS), default="cm", help="unit of the height column")
+    parser.add_argument(
+        "--left-ventricular-ejection-fraction",
+        type=float,
+        default=0.65,
+        help="ejection fraction used by the elastance parameters"
+    )
+
+    arguments = parser.parse_args(arguments)
+    arguments.parameters = [parameter.strip() for parameter in arguments.parameters.split(",") if parameter.strip()]
+
+    unknown_parameters = set(arguments.parameters) - set(vectorized_hemodynamic_parameters.PARAMETERS)
+    if unknown_parameters:
+        parser.error(f"unknown parameters: {', '.join(sorted(unknown_parameters))}")
+
+    return arguments
+
+
+def main(arguments=None):
+    arguments = parse_arguments(arguments)
+
+    study_count = aggregate_dataset(
+        arguments.input_path,
+        arguments.output_path,
+        parameters=arguments.parameters,
+        input_format=arguments.input_format,
+        output_format=arguments.output_format,
+        chunk_size=arguments.chunk_size,
+        workers=arguments.workers,
+        height_unit=arguments.height_unit,
+        left_ventricular_ejection_fraction=arguments.left_ventricular_ejection_fraction,
+        progress=print_progress,
+    )
+    print(f"Studies: {study_count}", file=sys.stderr)
+
+    return study_count
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,923 @@
+"""
+Asyncio client to pull ABPM test data from the SICOR API.
+All requests share one pooled HTTP session with keep-alive connections,
+so pulling data needs neither a new TCP/TLS connection per request nor a
+Ray cluster.
+"""
+
+import json
+import time
+import base64
+import random
+import asyncio
+import datetime
+import collections
+import urllib.parse
+import concurrent.futures
+
+import aiohttp
+
+from pull_metrics import PullMetrics
+
+
+# Keys of the patient data mapped to the API endpoint that returns them
+ENDPOINTS = {
+    "data": "tabla_mediciones/",
+    "measure": "MAPA/",
+    "drugs": "medicamentos/",
+    "meta_data": "get_mapa/",
+}
+
+
+# HTTP statuses worth retrying, the other errors will fail again
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class AuthenticationError(ValueError):
+    """ The API login answered without a token
+    """
+
+
+def error_status(error):
+    """ Describe a failed request with its HTTP status or the kind of failure
+
+    Parameters:
+        error (Exception): Error raised by the request
+
+    Returns:
+        int or str: HTTP status, "timeout", "connection", "auth" or "invalid-response"
+    """
+
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status
+
+    if isinstance(error, AuthenticationError):
+        return "auth"
+
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+
+    if isinstance(error, aiohttp.ClientError):
+        return "connection"
+
+    return "invalid-response"
+
+
+class RetryPolicy:
+    """ Retry transient request failures (timeouts, connection errors, 429
+    and 5xx responses) with exponential backoff and full jitter
+
+    Parameters:
+        attempts (int): Maximum number of attempts per request
+        base_delay (float): Seconds of the first backoff
+        max_delay (float): Maximum seconds of a single backoff
+        timeout (float): Seconds before a single request attempt times out
+    """
+
+    def __init__(self, attempts=5, base_delay=0.5, max_delay=30, timeout=60):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+
+    def is_transient(self, status):
+        return status in RETRYABLE_STATUSES or status in ("timeout", "connection")
+
+    def delay(self, attempt, error=None):
+        """ Seconds to wait before the next attempt. A Retry-After header of a
+        429 or 503 response is honoured when it is longer than the backoff
+
+        Parameters:
+            attempt (int): Number of failed attempts so far
+            error (Exception): Error of the last attempt
+
+        Returns:
+            float: Seconds to wait
+        """
+
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+        retry_after = getattr(error, "headers", None) and error.headers.get("Retry-After")
+        if retry_after:
+            try:
+                delay = max(delay, min(self.max_delay, float(retry_after)))
+            except ValueError:
+                pass
+
+        return delay
+
+
+class TokenBucket:
+    """ Rate limiter that allows rate requests per second with bursts of up
+    to capacity requests
+
+    Parameters:
+        rate (float): Requests per second
+        capacity (float): Maximum burst of requests, rate by default
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = None
+
+    async def acquire(self):
+        """ Wait until a request is allowed
+        """
+
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveConcurrency:
+    """ Limit of the requests in flight tuned at run time from the observed
+    latency and error rate. After every window of about limit requests the
+    limit is cut by backoff if the rate of transient errors is above
+    error_threshold, reduced in proportion to the latency gradient if the
+    mean latency is above latency_tolerance times the baseline latency, and
+    otherwise increased by increase, always within minimum and maximum.
+    The baseline is the lowest window mean latency, slowly drifting up so it
+    follows lasting changes of the API
+
+    Parameters:
+        initial (int): Limit at the start of the pull
+        minimum (int): Lowest limit
+        maximum (int): Highest limit
+        increase (float): Additive increase per window without congestion
+        backoff (float): Multiplicative decrease when the API returns errors
+        error_threshold (float): Rate of transient errors that triggers the backoff
+        latency_tolerance (float): Ratio of the mean latency to the baseline tolerated
+        window_size (int): Minimum number of requests per window
+    """
+
+    def __init__(
+        self,
+        initial=10,
+        minimum=1,
+        maximum=100,
+        increase=1,
+        backoff=0.5,
+        error_threshold=0.05,
+        latency_tolerance=2.0,
+        window_size=10
+        ):
+        if not 1 <= minimum <= maximum:
+            raise ValueError("Adaptive concurrency needs 1 <= minimum <= maximum")
+
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.backoff = backoff
+        self.error_threshold = error_threshold
+        self.latency_tolerance = latency_tolerance
+        self.window_size = window_size
+
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self.waiters = collections.deque()
+        self.baseline_latency = None
+
+        self.window_requests = 0
+        self.window_errors = 0
+        self.window_latency = 0.0
+        self.window_successes = 0
+
+    async def acquire(self):
+        """ Wait until there is a free slot below the current limit
+        """
+
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_event_loop().create_future()
+            self.waiters.append(waiter)
+
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # A slot given to a cancelled request goes to the next waiter
+                if waiter.done() and not waiter.cancelled():
+                    self.wake_waiters()
+                raise
+
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self.wake_waiters()
+
+    def wake_waiters(self):
+        free_slots = int(self.limit) - self.in_flight
+
+        while free_slots > 0 and self.waiters:
+            waiter = self.waiters.popleft()
+
+            if not waiter.done():
+                waiter.set_result(None)
+                free_slots -= 1
+
+    def record(self, latency, status):
+        """ Record the outcome of a request attempt, and adjust the limit at
+        the end of the window
+
+        Parameters:
+            latency (float): Seconds of the attempt
+            status (int or str): HTTP status, "timeout", "connection" or "invalid-response"
+
+        Returns:
+            str: "increase", "errors" or "latency" if the limit was adjusted, None otherwise
+        """
+
+        self.window_requests += 1
+
+        if status in RETRYABLE_STATUSES or status in ("timeout", "connection"):
+            self.window_errors += 1
+        elif status == 200:
+            self.window_latency += latency
+            self.window_successes += 1
+
+        if self.window_requests < max(self.window_size, int(self.limit)):
+            return None
+
+        return self.adjust()
+
+    def adjust(self):
+        error_rate = self.window_errors / self.window_requests
+        mean_latency = self.window_latency / self.window_successes if self.window_successes else None
+
+        if mean_latency is not None:
+            if self.baseline_latency is None or mean_latency < self.baseline_latency:
+                self.baseline_latency = mean_latency
+            else:
+                self.baseline_latency += (mean_latency - self.baseline_latency) * 0.05
+
+        if error_rate > self.error_threshold:
+            reason = "errors"
+            limit = self.limit * self.backoff
+        elif mean_latency is not None and mean_latency > self.latency_tolerance * self.baseline_latency:
+            reason = "latency"
+            limit = self.limit * max(self.backoff, self.latency_tolerance * self.baseline_latency / mean_latency)
+        else:
+            reason = "increase"
+            limit = self.limit + self.increase
+
+        self.limit = min(max(limit, self.minimum), self.maximum)
+        self.window_requests = 0
+        self.window_errors = 0
+        self.window_latency = 0.0
+        self.window_successes = 0
+
+        self.wake_waiters()
+
+        return reason
+
+
+def token_expiry(token):
+    """ Get the expiry time of a JWT token from its exp claim
+
+    Parameters:
+        token (str): API authentication token
+
+    Returns:
+        float: Expiry time as a UNIX timestamp or None if it is unknown
+    """
+
+    try:
+        payload = token.split(".")[1]
+        payload = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(payload["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenManager:
+    """ Shares one authentication token between all the requests of a client.
+    The token is refreshed only when it expires or when the API rejects it,
+    and concurrent refreshes are serialized so a burst of rejected requests
+    triggers a single login
+
+    Parameters:
+        login (callable): Coroutine function that returns a new token
+        ttl (float): Seconds a token is valid, if None the JWT exp claim is used
+        expiry_margin (float): Seconds before the expiry when the token is refreshed
+    """
+
+    def __init__(self, login, ttl=None, expiry_margin=30):
+        self.login = login
+        self.ttl = ttl
+        self.expiry_margin = expiry_margin
+
+        self.token = None
+        self.expires_at = None
+        self.login_count = 0
+        self.lock = None
+
+    def is_expired(self):
+        if self.token is None:
+            return True
+
+        return self.expires_at is not None and time.time() >= self.expires_at - self.expiry_margin
+
+    async def get_token(self):
+        """ Get a valid token, logging in only if there is none or it expired
+
+        Returns:
+            str: API authentication token
+        """
+
+        if self.is_expired():
+            return await self.refresh(self.token)
+
+        return self.token
+
+    async def refresh(self, stale_token):
+        """ Replace a rejected or expired token. If another request already
+        replaced it while waiting for the lock, that token is reused
+
+        Parameters:
+            stale_token (str): The token that was rejected or expired
+
+        Returns:
+            str: API authentication token
+        """
+
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+
+        async with self.lock:
+            if self.token != stale_token and not self.is_expired():
+                return self.token
+
+            token = await self.login()
+            self.login_count += 1
+
+            if self.ttl is not None:
+                self.expires_at = time.time() + self.ttl
+            else:
+                self.expires_at = token_expiry(token)
+
+            self.token = token
+
+        return self.token
+
+
+class ApiClient:
+    """ Client for the SICOR API that keeps a pooled session open while
+    it is used as an async context manager
+
+    Parameters:
+        api_url (str): Base URL of the API
+        username (str): API username
+        password (str): API password
+        max_in_flight (int): Maximum number of concurrent requests
+        token_ttl (float): Seconds an API token is valid, if None the JWT exp claim is used
+        retry_policy (RetryPolicy): Retries of transient failures, RetryPolicy() by default
+        rate_limit (float): Maximum requests per second to each host, None is unlimited
+        rate_burst (float): Maximum burst of requests to each host
+        metrics (PullMetrics): Collects the request and stage metrics, a new PullMetrics by default
+        adaptive_concurrency (AdaptiveConcurrency): Tunes the requests in flight at run time
+            instead of the fixed max_in_flight, its maximum also bounds the connection pool
+        probe_key (str): Key of ENDPOINTS requested first for every patient, the
+            other endpoints are only requested if it returns data. None requests all of them at once
+    """
+
+    def __init__(
+        self,
+        api_url,
+        username,
+        password,
+        max_in_flight=100,
+        token_ttl=None,
+        retry_policy=None,
+        rate_limit=None,
+        rate_burst=None,
+        metrics=None,
+        adaptive_concurrency=None,
+        probe_key=None
+        ):
+        self.api_url = api_url
+        self.username = username
+        self.password = password
+        self.max_in_flight = max_in_flight
+        self.token_manager = TokenManager(self.get_api_token, ttl=token_ttl)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+        self.rate_limiters = {}
+        self.metrics = metrics if metrics is not None else PullMetrics()
+        self.adaptive_concurrency = adaptive_concurrency
+        self.probe_key = probe_key
+        self.in_flight_requests = 0
+        self.waiting_requests = 0
+
+        self.auth_url = urllib.parse.urljoin(api_url, "login")
+        self.endpoint_urls = {
+            key: urllib.parse.urljoin(api_url, endpoint) for key, endpoint in ENDPOINTS.items()
+        }
+
+        if probe_key is not None and probe_key not in self.endpoint_urls:
+            raise ValueError(f"Unknown probe endpoint key: {probe_key}")
+
+        self.session = None
+        self.semaphore = None
+
+    async def __aenter__(self):
+        connection_limit = self.max_in_flight
+
+        if self.adaptive_concurrency is None:
+            self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        else:
+            self.semaphore = self.adaptive_concurrency
+            connection_limit = self.adaptive_concurrency.maximum
+
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=connection_limit, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=self.retry_policy.timeout),
+            raise_for_status=True,
+        )
+
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def get_api_token(self):
+        """ Get authentication token to access to other API URLs
+
+        Returns:
+            str: API authentication token
+
+        Raises:
+            AuthenticationError: If the login response has no token
+        """
+
+        payload = {
+            "user": self.username,
+            "password": self.password,
+        }
+
+        with self.metrics.stage("auth"):
+            response = await self.request_json("POST", self.auth_url, data=payload)
+
+        if not isinstance(response, dict) or not response.get('res'):
+            raise AuthenticationError(f"Login to {self.auth_url} answered without a token")
+
+        return response['res']
+
+    async def get_api_data(self, url, patient_id):
+        """ Get data from an specific API URL using the shared token. If the
+        API rejects the token it is refreshed and the request is made again
+
+        Parameters:
+            url (str): API url to make a GET request to get JSON data
+            patient_id (int): The patient ABPM test ID
+
+        Returns:
+            dict: JSON data from the API
+        """
+
+        url = urllib.parse.urljoin(url, f"{patient_id}/")
+        token = await self.token_manager.get_token()
+
+        try:
+            return await self.get_json(url, token)
+        except aiohttp.ClientResponseError as error:
+            if error.status != 401:
+                raise
+
+        token = await self.token_manager.refresh(token)
+
+        return await self.get_json(url, token)
+
+    async def get_json(self, url, token):
+        return await self.request_json("GET", url, headers={"authorization": f"Bearer {token}"})
+
+    def endpoint_name(self, url):
+        """ Name of the endpoint of a request URL, used as the metrics label
+
+        Parameters:
+            url (str): Request URL
+
+        Returns:
+            str: First path segment below the API URL, such as "login" or "MAPA"
+        """
+
+        path = urllib.parse.urlsplit(url).path
+        base_path = urllib.parse.urlsplit(self.api_url).path.rstrip("/")
+
+        if path.startswith(base_path):
+            path = path[len(base_path):]
+
+        return path.strip("/").split("/")[0]
+
+    async def request_json(self, method, url, **kwargs):
+        """ Make a request through the per host rate limiter and retry it
+        while it fails with a transient error. Every attempt is counted by
+        status and timed in the metrics
+
+        Parameters:
+            method (str): HTTP method
+            url (str): Request URL
+            kwargs: Other aiohttp request arguments
+
+        Returns:
+            dict: JSON data from the API
+        """
+
+        attempt = 0
+        endpoint = self.endpoint_name(url)
+
+        while True:
+            try:
+                await self.wait_rate_limit(url)
+
+                self.waiting_requests += 1
+                self.metrics.set_gauge("api_requests_waiting", self.waiting_requests)
+                waiting_since = time.monotonic()
+
+                try:
+                    await self.semaphore.acquire()
+                finally:
+                    self.waiting_requests -= 1
+                    self.metrics.set_gauge("api_requests_waiting", self.waiting_requests)
+
+                self.metrics.observe("api_queue_wait_seconds", time.monotonic() - waiting_since)
+                self.in_flight_requests += 1
+                self.metrics.set_gauge("api_requests_in_flight", self.in_flight_requests)
+
+                # Cancelled attempts say nothing about the API and are not recorded
+                status = None
+                request_started_at = time.monotonic()
+
+                try:
+                    with self.metrics.timer("api_request_seconds", endpoint=endpoint):
+                        async with self.session.request(method, url, **kwargs) as response:
+                            body = await response.read()
+                            status = response.status
+                except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                    status = error_status(error)
+                    raise
+                finally:
+                    self.semaphore.release()
+                    self.in_flight_requests -= 1
+                    self.metrics.set_gauge("api_requests_in_flight", self.in_flight_requests)
+
+                    if status is not None:
+                        self.record_concurrency(time.monotonic() - request_started_at, status)
+
+                self.metrics.increment("api_requests_total", endpoint=endpoint, status=status)
+                self.metrics.increment("api_response_bytes_total", len(body), endpoint=endpoint)
+
+                return json.loads(body) if body.strip() else None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                status = error_status(error)
+                self.metrics.increment("api_requests_total", endpoint=endpoint, status=status)
+                attempt += 1
+
+                if attempt >= self.retry_policy.attempts or not self.retry_policy.is_transient(status):
+                    raise
+
+                self.metrics.increment("api_retries_total", endpoint=endpoint, status=status)
+                await asyncio.sleep(self.retry_policy.delay(attempt, error))
+
+    def record_concurrency(self, latency, status):
+        """ Feed the outcome of a request attempt to the adaptive concurrency
+        limit, if there is one
+
+        Parameters:
+            latency (float): Seconds of the attempt
+            status (int or str): HTTP status or the kind of failure
+        """
+
+        if self.adaptive_concurrency is None:
+            return
+
+        adjustment = self.adaptive_concurrency.record(latency, status)
+
+        if adjustment is not None:
+            self.metrics.increment("api_concurrency_adjustments_total", reason=adjustment)
+            self.metrics.set_gauge("api_concurrency_limit", int(self.adaptive_concurrency.limit))
+
+    async def wait_rate_limit(self, url):
+        if self.rate_limit is None:
+            return
+
+        host = urllib.parse.urlsplit(url).netloc
+
+        if host not in self.rate_limiters:
+            self.rate_limiters[host] = TokenBucket(self.rate_limit, self.rate_burst)
+
+        with self.metrics.timer("api_rate_limit_wait_seconds"):
+            await self.rate_limiters[host].acquire()
+
+    async def get_complete_api_data(self, patient_id):
+        """ Get data, meta data, measure and drugs for an specific ABPM test.
+        The endpoints are requested concurrently. With a probe_key its
+        endpoint is requested first, and if it is empty the patient does not
+        exist and the other endpoints are not requested
+
+        Parameters:
+            patient_id (int): Patient ABPM test ID to pull data from
+
+        Returns:
+            dict: JSON data pulled from API, id has the ABPM test ID.
+            Data contains the test meta data like start date, night
+            time and other importante data. Measure contains the real ABPM
+            measurements. Drugs contain the drugs taken by a patient during
+            the ABPM test. Endpoints that were not requested are empty lists.
+        """
+
+        patient_data = {"id": patient_id}
+        keys = list(self.endpoint_urls)
+
+        if self.probe_key is not None:
+            with self.metrics.stage("probe"):
+                patient_data[self.probe_key] = await self.get_api_data(self.endpoint_urls[self.probe_key], patient_id)
+
+            keys.remove(self.probe_key)
+
+            if not patient_data[self.probe_key]:
+                patient_data.update((key, []) for key in keys)
+                return patient_data
+
+        with self.metrics.stage("fetch"):
+            responses = await asyncio.gather(*[
+                self.get_api_data(self.endpoint_urls[key], patient_id) for key in keys
+            ])
+
+        patient_data.update(zip(keys, responses))
+
+        return {key: patient_data[key] for key in ["id"] + list(self.endpoint_urls)}
+
+
+async def get_complete_api_data_safe(client, patient_id, on_error=None):
+    """ Wrapper for ApiClient.get_complete_api_data that reports request
+    errors instead of raising them
+
+    Parameters:
+        client (ApiClient): Open API client
+        patient_id (int): Patient ABPM test ID to pull data from
+        on_error (callable): Called with the patient ID and the error status on errors
+
+    Returns:
+        dict: JSON data pulled from API or None if the request failed
+    """
+
+    try:
+        patient_data = await client.get_complete_api_data(patient_id)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as error:
+        client.metrics.increment("pull_patients_total", result="error")
+
+        if on_error is not None:
+            on_error(patient_id, error_status(error))
+
+        return None
+
+    client.metrics.increment("pull_patients_total", result="found" if patient_data.get("data") else "empty")
+
+    return patient_data
+
+
+def list_contains_date_grater_than(patient_data_list, end_date):
+    """
+
+    Parameters:
+        patient_data_list (dict): List of ABPM request resonses
+        end_date (datetime): The newest date for the revelant data
+        we are pretending to get.
+
+    Returns:
+        bool: If the end_data is less than any of the start_dates of
+        the ABPM return True so that pulling data ends. Other way
+        return False so that data pull continues.
+    """
+
+    for map_data in patient_data_list:
+        if map_data and map_data.get('data'):
+            start_date = map_data['data'][0]['fecha_dt'].split(' ')[0]
+            start_date = datetime.datetime.strptime(start_date, '%Y-%m-%d')
+        else:
+            start_date = datetime.datetime.strptime("1900-1-1", '%Y-%m-%d')
+
+        if end_date < start_date:
+            return True
+
+    return False
+
+
+# Result of the patient IDs skipped because they are known gaps
+KNOWN_GAP = object()
+
+
+async def pull_api_data(
+    client,
+    start_patient_id,
+    pull_data_end_date,
+    concurrent_workers,
+    max_consecutive_error,
+    on_error=None,
+    reorder_window=None,
+    known_gaps=None,
+    on_gap=None
+    ):
+    """ Get data from API for all patients in the range start_patient_id to the first
+    patient_id whos start_date < pull_data_end_date.
+
+    Patients are pulled with a sliding window that always keeps
+    concurrent_workers patients in flight, so one slow patient does not
+    stall the others. Results are released in patient ID order, which keeps
+    the stop condition and the consecutive error count of a sequential pull.
+
+    Patient IDs in known_gaps are skipped without any request and do not
+    count as errors. Failed patients are only reported to on_error, and IDs
+    that the API confirms missing to on_gap, once a later patient is found
+    and released. The failed IDs after the last patient yielded are pulled
+    again by the next pull, which starts after it, and the missing IDs at
+    the end of the pull are the patients that do not exist yet. Results
+    fetched ahead of the stop are discarded. The patient past the end date
+    that stops the pull exists, so the missing IDs before it are gaps.
+
+    Parameters:
+        client (ApiClient): Open API client
+        start_patient_id (int): The firts ABPM test ID from where to start pulling data
+        pull_data_end_date (datetime): The upper date cap for test to be pulled
+        concurrent_workers (int): The number of patients in flight at any time
+        max_consecutive_error (int): The maximum number of continous errors before stoping the pulling process
+        on_error (callable): Called with the patient ID and the error status
+        of the failed patients below a patient that was found
+        reorder_window (int): Maximum distance between the oldest unreleased
+        patient and the newest requested one, 4 * concurrent_workers by default
+        known_gaps (container): Patient IDs known to be missing, skipped by the pull
+        on_gap (callable): Called with the list of patient IDs confirmed missing
+        below a patient that was found, including the patient that stops the pull
+
+    Returns:
+        async generator: Generates an API response for each of the users pulled in patient ID order
+    """
+
+    reorder_window = reorder_window or 4 * concurrent_workers
+
+    tasks = {}
+    results = {}
+    error_statuses = {}
+    error_count = 0
+    failed_patients = []
+    missing_patient_ids = []
+    next_patient_id = start_patient_id
+    release_patient_id = start_patient_id
+
+    try:
+        while True:
+            while len(tasks) < concurrent_workers and next_patient_id - release_patient_id < reorder_window:
+                if known_gaps is not None and next_patient_id in known_gaps:
+                    results[next_patient_id] = KNOWN_GAP
+                    client.metrics.increment("pull_patients_total", result="known-gap")
+                else:
+                    task = asyncio.ensure_future(
+                        get_complete_api_data_safe(client, next_patient_id, error_statuses.__setitem__)
+                    )
+                    tasks[task] = next_patient_id
+
+                next_patient_id += 1
+
+            client.metrics.set_gauge("pull_patients_in_flight", len(tasks))
+
+            if tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    results[tasks.pop(task)] = task.result()
+
+            client.metrics.set_gauge("pull_reorder_buffer_patients", len(results))
+
+            while release_patient_id in results:
+                patient_id = release_patient_id
+                patient_data = results.pop(patient_id)
+                release_patient_id += 1
+
+                if patient_data is KNOWN_GAP:
+                    continue
+
+                if list_contains_date_grater_than([patient_data], pull_data_end_date):
+                    # The stop patient exists, so the IDs missing before it are gaps too
+                    if missing_patient_ids and on_gap is not None:
+                        on_gap(missing_patient_ids)
+
+                    return
+
+                if patient_data and patient_data.get("data"):
+                    error_count = 0
+
+                    if failed_patients and on_error is not None:
+                        for failed_patient_id, status in failed_patients:
+                            on_error(failed_patient_id, status)
+                    failed_patients = []
+
+                    if missing_patient_ids and on_gap is not None:
+                        on_gap(missing_patient_ids)
+                    missing_patient_ids = []
+
+                    yield patient_data
+                else:
+                    error_count += 1
+
+                    # Failed requests are retried later, they are not gaps
+                    if patient_data is None:
+                        failed_patients.append((patient_id, error_statuses.pop(patient_id)))
+                    else:
+                        missing_patient_ids.append(patient_id)
+
+                if max_consecutive_error < error_count:
+                    return
+    finally:
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+        client.metrics.set_gauge("pull_patients_in_flight", 0)
+
+
+async def pull_patient_ids(client, patient_ids, concurrent_workers, on_error=None, known_gaps=None):
+    """ Get data from API for a given list of patients, such as the ones whose
+    previous pull failed
+
+    Parameters:
+        client (ApiClient): Open API client
+        patient_ids (iterable): Patient ABPM test IDs to pull
+        concurrent_workers (int): The number of patients in flight at any time
+        on_error (callable): Called with the patient ID and the error status on errors
+        known_gaps (container): Patient IDs known to be missing, not requested
+
+    Returns:
+        async generator: Generates a (patient_id, API response) tuple for each
+        patient as soon as it completes, the response is None if the request
+        failed and KNOWN_GAP for the known gaps, which come first
+    """
+
+    patient_ids = list(patient_ids)
+    tasks = {}
+
+    if known_gaps is not None:
+        for patient_id in patient_ids:
+            if patient_id in known_gaps:
+                client.metrics.increment("pull_patients_total", result="known-gap")
+                yield patient_id, KNOWN_GAP
+
+        patient_ids = [patient_id for patient_id in patient_ids if patient_id not in known_gaps]
+
+    patient_ids = iter(patient_ids)
+
+    try:
+        while True:
+            for patient_id in patient_ids:
+                tasks[asyncio.ensure_future(get_complete_api_data_safe(client, patient_id, on_error))] = patient_id
+
+                if len(tasks) >= concurrent_workers:
+                    break
+
+            if not tasks:
+                return
+
+            client.metrics.set_gauge("pull_patients_in_flight", len(tasks))
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                yield tasks.pop(task), task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+        client.metrics.set_gauge("pull_patients_in_flight", 0)
+
+
+def run_sync(coroutine):
+    """ Run a coroutine until it completes, also from inside a running event
+    loop such as the one of a Jupyter kernel
+
+    Parameters:
+        coroutine (coroutine): Coroutine to run
+
+    Returns:
+        The value returned by the coroutine
+    """
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
@@ -0,0 +1,259 @@
+'''
+Module with a compiled backend of the hemodynamic parameters. The whole
+panel of a reading is evaluated in a single fused loop over the rows, with
+no intermediate arrays, compiled with Numba and parallel across cores.
+Numba is optional: without it compute and compute_all fall back to
+vectorized_hemodynamic_parameters, and BACKEND tells which one is used.
+Formulas are the ones that Dr. Dagnovar Aristizabal Ocampo uses.
+'''
+
+import math
+import inspect
+
+import numpy
+
+import hemodynamic_parameters
+import vectorized_hemodynamic_parameters
+from vectorized_hemodynamic_parameters import ELASTANCE_COEFFICIENTS, INPUTS, PARAMETERS
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+BACKEND = "numpy" if numba is None else "numba"
+
+if numba is None:
+    prange = range
+else:
+    prange = numba.prange
+
+# The NumPy error model gives inf and NaN on invalid rows, like the
+# vectorized module, instead of raising ZeroDivisionError
+def _jit(function):
+    if numba is None:
+        return function
+    return numba.njit(parallel=True, cache=True, error_model="numpy")(function)
+
+def _maximum_elastance(stroke_volume_, elastance_nd_mean, systolic_blood_pressure, diastolic_blood_pressure, left_ventricular_ejection_fraction):
+    elastance_nd_est = (
+        (0.0275 - (0.165 * left_ventricular_ejection_fraction))
+        + (0.3656 * (diastolic_blood_pressure / systolic_blood_pressure))
+        + (0.515 * elastance_nd_mean)
+    )
+    elastance_es_sb = (
+        (diastolic_blood_pressure - (elastance_nd_est * 0.9 * systolic_blood_pressure))
+        / (stroke_volume_ * elastance_nd_est)
+    )
+    return 0.78 * elastance_es_sb + 0.55
+
+if numba is not None:
+    _maximum_elastance = numba.njit(cache=True, error_model="numpy")(_maximum_elastance)
+
+@_jit
+def _compute_rows(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate, left_ventricular_ejection_fraction, output):
+    '''
+    Calculates the whole panel of every row into output, a (len(PARAMETERS), rows)
+    array with one row per parameter in PARAMETERS order. Follows the same
+    steps as hemodynamic_parameters.PatientContext.compute_reading
+    '''
+    for row in prange(age.shape[0]):
+        sbp = systolic_blood_pressure[row]
+        dbp = diastolic_blood_pressure[row]
+        hr = heart_rate[row]
+        lvef = left_ventricular_ejection_fraction[row]
+
+        body_mass_index_ = weight[row] / (height[row] ** 2)
+        body_surface_area_ = math.sqrt((weight[row] * height[row] * 100) / 3600)
+        age_pressure_offset = 76 - 0.89 * age[row]
+        age_pressure_width = 57 - 0.44 * age[row]
+
+        pulse_pressure_ = sbp - dbp
+        mean_arterial_pressure_ = dbp + pulse_pressure_ * 0.35
+
+        normalized_pressure = (mean_arterial_pressure_ - age_pressure_offset) / age_pressure_width
+        compliance = 5.62 / (math.pi * age_pressure_width) / (1 + (normalized_pressure ** 2))
+        compliance = (height[row] * 100 / 2) * compliance
+        compliance = compliance * (body_mass_index_ / 27.5)
+        arctan_normalized_pressure = math.atan(normalized_pressure)
+        impedance = math.sqrt(1.06 / ((5.62 * (0.5 + (1 / math.pi * arctan_normalized_pressure))) * compliance))
+
+        ejection_time = (((413 - 1.7 * hr) / math.sqrt(mean_arterial_pressure_ / 95)) / 1000)
+        end_diastolic_blood_pressure_tau = mean_arterial_pressure_ * (math.e ** ((- ejection_time / (hr / 60)) - 0.25))
+        stroke_volume_ = (mean_arterial_pressure_ - end_diastolic_blood_pressure_tau) / impedance
+        cardiac_output_ = (stroke_volume_ / 1000) * hr
+
+        sympathetic_nervous_system_activation_ = math.e ** (((60 / hr) + 0.12) / impedance)
+        baroreflex_heart_rate_ = 0.66 + ((0.66 - 1.2) / (1 + 67000000000000 * math.e ** (-31 * mean_arterial_pressure_ / 89)))
+        baroreflex_intermediary = (sympathetic_nervous_system_activation_ * 0.75) - (baroreflex_heart_rate_ * 0.25)
+
+        pep = ((131 - 0.4 * hr) * math.sqrt(mean_arterial_pressure_ / 100)) / 1000
+        ratio_pep_sistolic_time = pep / ejection_time
+        elastance_nd_mean = 0.0
+        for coefficient in ELASTANCE_COEFFICIENTS:
+            elastance_nd_mean += (ratio_pep_sistolic_time * coefficient)
+
+        maximum_elastance_ = _maximum_elastance(stroke_volume_, elastance_nd_mean, sbp, dbp, lvef)
+        # arterial_ventricular_elastance always uses the default ejection fraction
+        default_maximum_elastance = _maximum_elastance(stroke_volume_, elastance_nd_mean, sbp, dbp, 0.65)
+        arterial_elastance_ = mean_arterial_pressure_ / stroke_volume_
+
+        output[0, row] = body_mass_index_
+        output[1, row] = body_surface_area_
+        output[2, row] = pulse_pressure_
+        output[3, row] = mean_arterial_pressure_
+        output[4, row] = compliance
+        output[5, row] = impedance
+        output[6, row] = (mean_arterial_pressure_ / pulse_pressure_) * (60 / hr)
+        output[7, row] = ((60 / hr) - ejection_time) / math.log((mean_arterial_pressure_ / dbp))
+        output[8, row] = stroke_volume_
+        output[9, row] = cardiac_output_
+        output[10, row] = cardiac_output_ / body_surface_area_
+        output[11, row] = 0.357 * math.sqrt(
+            (math.pi * age_pressure_width)
+            * (1 + (normalized_pressure ** 2))
+            * (0.5 + ((1 / math.pi) * arctan_normalized_pressure))
+        )
+        output[12, row] = ((1 - (1 / sympathetic_nervous_system_activation_)) * (mean_arterial_pressure_ / cardiac_output_)) * 80
+        output[13, row] = (1 / sympathetic_nervous_system_activation_) * 100
+        output[14, row] = 0.0 if baroreflex_intermediary < 0 else math.sqrt(baroreflex_intermediary / 7.7)
+        output[15, row] = maximum_elastance_
+        output[16, row] = arterial_elastance_
+        output[17, row] = arterial_elastance_ / default_maximum_elastance
+        output[18, row] = pulse_pressure_ / stroke_volume_
+        output[19, row] = (cardiac_output_ * mean_arterial_pressure_) / 450
+        output[20, row] = sympathetic_nervous_system_activation_
+        output[21, row] = baroreflex_heart_rate_
+
+def _compute_fused(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate, left_ventricular_ejection_fraction):
+    inputs = numpy.broadcast_arrays(
+        *[
+            numpy.asarray(value, dtype=numpy.float64)
+            for value in (age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate, left_ventricular_ejection_fraction)
+        ]
+    )
+    shape = inputs[0].shape
+    rows = [numpy.ascontiguousarray(value).reshape(-1) for value in inputs]
+    output = numpy.empty((len(PARAMETERS), rows[0].shape[0]), dtype=numpy.float64)
+
+    _compute_rows(*rows, output)
+
+    return {parameter: output[index].reshape(shape) for index, parameter in enumerate(PARAMETERS)}
+
+def compute_all(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate, left_ventricular_ejection_fraction=0.65):
+    '''
+    Calculates every hemodynamic parameter with the compiled kernel, or with
+    vectorized_hemodynamic_parameters when Numba is not installed. Returns a
+    dict keyed by the parameter function names
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    left_ventricular_ejection_fraction : given as a the fraction of stroke volume over end diastolic volume
+    '''
+    if numba is None:
+        return vectorized_hemodynamic_parameters.compute_all(
+            age,
+            weight,
+            height,
+            systolic_blood_pressure,
+            diastolic_blood_pressure,
+            heart_rate,
+            left_ventricular_ejection_fraction
+        )
+    return _compute_fused(
+        age,
+        weight,
+        height,
+        systolic_blood_pressure,
+        diastolic_blood_pressure,
+        heart_rate,
+        left_ventricular_ejection_fraction
+    )
+
+def compute(parameters, age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate, left_ventricular_ejection_fraction=0.65):
+    '''
+    Calculates the given parameters with the compiled kernel, or only the
+    graph nodes they need with vectorized_hemodynamic_parameters when Numba
+    is not installed. Returns a dict keyed by the requested parameter names
+    Parameters
+    ----------
+    parameters : iterable with the names of the parameters to calculate, see PARAMETERS
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    left_ventricular_ejection_fraction : given as a the fraction of stroke volume over end diastolic volume
+    '''
+    parameters = tuple(parameters)
+    if numba is None:
+        return vectorized_hemodynamic_parameters.compute(
+            parameters,
+            age,
+            weight,
+            height,
+            systolic_blood_pressure,
+            diastolic_blood_pressure,
+            heart_rate,
+            left_ventricular_ejection_fraction
+        )
+    unknown_parameters = set(parameters) - set(PARAMETERS)
+    if unknown_parameters:
+        raise ValueError(f"Unknown hemodynamic parameters: {', '.join(sorted(unknown_parameters))}")
+    results = _compute_fused(
+        age,
+        weight,
+        height,
+        systolic_blood_pressure,
+        diastolic_blood_pressure,
+        heart_rate,
+        left_ventricular_ejection_fraction
+    )
+    return {parameter: results[parameter] for parameter in parameters}
+
+def check_equivalence(row_count=1000, seed=0, rtol=1e-12):
+    '''
+    Checks the fused kernel against each scalar function of
+    hemodynamic_parameters on random readings, also when Numba is not
+    installed, in which case the kernel runs as plain Python. Returns the
+    maximum relative difference of each parameter and raises AssertionError
+    if any is above rtol
+    Parameters
+    ----------
+    row_count : number of random readings
+    seed : seed of the random readings
+    rtol : maximum relative difference allowed
+    '''
+    generator = numpy.random.default_rng(seed)
+    inputs = (
+        generator.uniform(18, 90, row_count),
+        generator.uniform(40, 150, row_count),
+        generator.uniform(1.4, 2.1, row_count),
+        generator.uniform(100, 190, row_count),
+        generator.uniform(50, 100, row_count),
+        generator.uniform(40, 140, row_count),
+        generator.uniform(0.3, 0.8, row_count),
+    )
+    results = _compute_fused(*inputs)
+
+    differences = {}
+    for parameter in PARAMETERS:
+        function = getattr(hemodynamic_parameters, parameter)
+        arguments = [INPUTS.index(argument) for argument in inspect.signature(function).parameters if argument in INPUTS]
+        expected = numpy.array([
+            function(*[float(inputs[argument][row]) for argument in arguments])
+            for row in range(row_count)
+        ])
+        difference = numpy.abs(results[parameter] - expected) / numpy.maximum(numpy.abs(expected), numpy.finfo(numpy.float64).tiny)
+        differences[parameter] = float(numpy.max(difference)) if row_count else 0.0
+
+    failed = {parameter: difference for parameter, difference in differences.items() if difference > rtol}
+    if failed:
+        raise AssertionError(f"Compiled kernel differs from hemodynamic_parameters: {failed}")
+    return differences
@@ -0,0 +1,411 @@
+"""
+Command line tool that computes the hemodynamic parameters for every
+measurement of the base dataset built by build_base_dataset, reading and
+writing CSV or Parquet in chunks so memory does not grow with the dataset.
+
+    python compute_hemodynamic_parameters.py sleep_dataset.csv parameters.parquet \\
+        --parameters cardiac_output,pulse_wave_velocity --workers 4
+"""
+
+import os
+import sys
+import time
+import argparse
+import collections
+import concurrent.futures
+
+import numpy
+import pandas
+import pyarrow
+import pyarrow.dataset
+import pyarrow.parquet
+
+import hemodynamic_validation
+import vectorized_hemodynamic_parameters
+
+
+# Base dataset column of each input of the hemodynamic parameters
+BIRTH_DATE_COLUMN = "birth_date"
+MEASURE_DATE_COLUMN = "measure_date_time"
+WEIGHT_COLUMN = "weight"
+HEIGHT_COLUMN = "height"
+SYSTOLIC_BLOOD_PRESSURE_COLUMN = "sistolic"
+DIASTOLIC_BLOOD_PRESSURE_COLUMN = "diastolic"
+HEART_RATE_COLUMN = "heart_reate"
+
+INPUT_COLUMNS = [
+    BIRTH_DATE_COLUMN,
+    MEASURE_DATE_COLUMN,
+    WEIGHT_COLUMN,
+    HEIGHT_COLUMN,
+    SYSTOLIC_BLOOD_PRESSURE_COLUMN,
+    DIASTOLIC_BLOOD_PRESSURE_COLUMN,
+    HEART_RATE_COLUMN,
+]
+
+SECONDS_PER_YEAR = 365.25 * 24 * 60 * 60
+
+HEIGHT_UNITS = {"cm": 0.01, "m": 1}
+
+
+def dataset_format(path, data_format=None):
+    """ Get the format of a dataset from its path, directories are Parquet datasets
+
+    Parameters:
+        path (str): Path of the dataset file or directory
+        data_format (str): Explicit "csv" or "parquet" format, it wins over the path
+
+    Returns:
+        str: "csv" or "parquet"
+    """
+
+    if data_format:
+        return data_format
+
+    if os.path.isdir(path) or path.endswith((".parquet", ".pq")):
+        return "parquet"
+
+    return "csv"
+
+
+def iter_dataset_chunks(path, data_format, chunk_size, columns=None):
+    """ Read a CSV or Parquet dataset in chunks
+
+    Parameters:
+        path (str): Path of the dataset file, or directory of a Parquet dataset
+        data_format (str): "csv" or "parquet"
+        chunk_size (int): Maximum number of rows per chunk
+        columns (list): Columns to read, None reads all of them
+
+    Returns:
+        generator: Generates a data frame for each chunk
+    """
+
+    if data_format == "csv":
+        for chunk_df in pandas.read_csv(path, chunksize=chunk_size, usecols=columns):
+            yield chunk_df
+
+        return
+
+    dataset = pyarrow.dataset.dataset(path, format="parquet", partitioning="hive")
+
+    for batch in dataset.to_batches(columns=columns, batch_size=chunk_size):
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def age_in_years(birth_date, measure_date):
+    """ Age of the patient at the time of each measurement
+
+    Parameters:
+        birth_date (Series): Birth dates, as dates or date strings
+        measure_date (Series): Measurement date times, as date times or date time strings
+
+    Returns:
+        numpy.ndarray: Age given in years, NaN where a date can not be parsed
+    """
+
+    age = pandas.to_datetime(measure_date, errors="coerce") - pandas.to_datetime(birth_date, errors="coerce")
+
+    return age.dt.total_seconds().to_numpy(dtype=numpy.float64) / SECONDS_PER_YEAR
+
+
+def numeric_values(values):
+    """ Numbers of a column, which may hold strings in CSV datasets
+
+    Parameters:
+        values (Series): Numbers or number strings
+
+    Returns:
+        numpy.ndarray: Float values, NaN where a value is not a number
+    """
+
+    return pandas.to_numeric(values, errors="coerce").to_numpy(dtype=numpy.float64)
+
+
+def compute_chunk(chunk_df, parameters, height_unit="cm", left_ventricular_ejection_fraction=0.65, keep_columns=None, validity_column=None):
+    """ Compute the hemodynamic parameters of a chunk of the base dataset.
+    Rows with invalid inputs get NaN parameters instead of failing the chunk.
+    Runs in the worker processes
+
+    Parameters:
+        chunk_df (DataFrame): Chunk with the INPUT_COLUMNS of the base dataset
+        parameters (tuple): Names of the parameters to compute, see vectorized_hemodynamic_parameters.PARAMETERS
+        height_unit (str): Unit of the height column, "cm" or "m"
+        left_ventricular_ejection_fraction (float): Ejection fraction used by the elastance parameters
+        keep_columns (list): Columns of the chunk copied to the result, None keeps all of them
+        validity_column (str): Name of a boolean column flagging the valid rows, None leaves it out
+
+    Returns:
+        tuple: The data frame with the kept columns followed by one column per
+            parameter, and the dict with the number of invalid rows by reason
+    """
+
+    results, valid, reason_counts = hemodynamic_validation.compute(
+        parameters,
+        age_in_years(chunk_df[BIRTH_DATE_COLUMN], chunk_df[MEASURE_DATE_COLUMN]),
+        numeric_values(chunk_df[WEIGHT_COLUMN]),
+        numeric_values(chunk_df[HEIGHT_COLUMN]) * HEIGHT_UNITS[height_unit],
+        numeric_values(chunk_df[SYSTOLIC_BLOOD_PRESSURE_COLUMN]),
+        numeric_values(chunk_df[DIASTOLIC_BLOOD_PRESSURE_COLUMN]),
+        numeric_values(chunk_df[HEART_RATE_COLUMN]),
+        left_ventricular_ejection_fraction,
+    )
+
+    result_df = chunk_df if keep_columns is None else chunk_df[keep_columns]
+    result_df = result_df.reset_index(drop=True)
+
+    for parameter in parameters:
+        result_df[parameter] = numpy.broadcast_to(results[parameter], len(result_df))
+
+    if validity_column is not None:
+        result_df[validity_column] = numpy.broadcast_to(valid, len(result_df))
+
+    return result_df, reason_counts
+
+
+def iter_computed_chunks(chunks, workers, chunk_function=compute_chunk, **compute_arguments):
+    """ Compute the chunks across a pool of worker processes. Results are
+    generated in input order and at most two chunks per worker are in
+    flight, so memory stays bounded
+
+    Parameters:
+        chunks (iterable): Data frames of the base dataset
+        workers (int): Number of worker processes, 1 computes in this process
+        chunk_function (callable): Module level function called with each chunk and the compute_arguments
+        compute_arguments: Arguments of chunk_function
+
+    Returns:
+        generator: Generates the result of chunk_function for each chunk
+    """
+
+    if workers == 1:
+        for chunk_df in chunks:
+            yield chunk_function(chunk_df, **compute_arguments)
+
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+
+        for chunk_df in chunks:
+            pending.append(executor.submit(chunk_function, chunk_df, **compute_arguments))
+
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+class CsvChunkWriter:
+    """ Append data frame chunks to a CSV file, writing the header once
+
+    Parameters:
+        path (str): Path of the CSV file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.header = True
+
+    def write(self, chunk_df):
+        chunk_df.to_csv(self.path, mode="w" if self.header else "a", header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        pass
+
+
+class ParquetChunkWriter:
+    """ Append data frame chunks as row groups of a Parquet file
+
+    Parameters:
+        path (str): Path of the Parquet file
+        compression (str): Parquet compression codec
+    """
+
+    def __init__(self, path, compression="zstd"):
+        self.path = path
+        self.compression = compression
+        self.writer = None
+
+    def write(self, chunk_df):
+        table = pyarrow.Table.from_pandas(chunk_df, preserve_index=False)
+
+        if self.writer is None:
+            self.writer = pyarrow.parquet.ParquetWriter(self.path, table.schema, compression=self.compression)
+        else:
+            table = table.cast(self.writer.schema)
+
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def compute_dataset(
+    input_path,
+    output_path,
+    parameters=vectorized_hemodynamic_parameters.PARAMETERS,
+    input_format=None,
+    output_format=None,
+    chunk_size=500000,
+    workers=None,
+    height_unit="cm",
+    left_ventricular_ejection_fraction=0.65,
+    keep_columns=None,
+    validity_column=None,
+    progress=None
+    ):
+    """ Compute the hemodynamic parameters of a whole base dataset chunk by chunk
+
+    Parameters:
+        input_path (str): Path of the base dataset, a CSV file or a Parquet file or directory
+        output_path (str): Path of the CSV or Parquet output file
+        parameters (iterable): Names of the parameters to compute
+        input_format (str): "csv" or "parquet", guessed from input_path by default
+        output_format (str): "csv" or "parquet", guessed from output_path by default
+        chunk_size (int): Maximum number of rows per chunk
+        workers (int): Number of worker processes, every CPU core by default
+        height_unit (str): Unit of the height column, "cm" or "m"
+        left_ventricular_ejection_fraction (float): Ejection fraction used by the elastance parameters
+        keep_columns (list): Input columns copied to the output, None keeps all of them
+        validity_column (str): Name of a boolean output column flagging the valid rows, None leaves it out
+        progress (callable): Called after each chunk with the rows written and the elapsed seconds
+
+    Returns:
+        tuple: Number of rows written, and dict with the number of invalid rows by reason
+    """
+
+    parameters = tuple(parameters)
+    unknown_parameters = set(parameters) - set(vectorized_hemodynamic_parameters.PARAMETERS)
+
+    if unknown_parameters:
+        raise ValueError(f"Unknown hemodynamic parameters: {', '.join(sorted(unknown_parameters))}")
+
+    input_format = dataset_format(input_path, input_format)
+    output_format = dataset_format(output_path, output_format)
+    workers = workers or os.cpu_count()
+
+    # Only the needed columns are read when the other ones are dropped
+    columns = None if keep_columns is None else list(dict.fromkeys(list(keep_columns) + INPUT_COLUMNS))
+
+    writer = CsvChunkWriter(output_path) if output_format == "csv" else ParquetChunkWriter(output_path)
+    chunks = iter_computed_chunks(
+        iter_dataset_chunks(input_path, input_format, chunk_size, columns),
+        workers,
+        parameters=parameters,
+        height_unit=height_unit,
+        left_ventricular_ejection_fraction=left_ventricular_ejection_fraction,
+        keep_columns=keep_columns,
+        validity_column=validity_column,
+    )
+
+    start_time = time.time()
+    row_count = 0
+    reason_counts = collections.Counter()
+
+    try:
+        for result_df, chunk_reason_counts in chunks:
+            writer.write(result_df)
+            row_count += len(result_df)
+            reason_counts.update(chunk_reason_counts)
+
+            if progress is not None:
+                progress(row_count, time.time() - start_time)
+    finally:
+        writer.close()
+
+    return row_count, dict(reason_counts)
+
+
+def print_progress(row_count, elapsed_time):
+    print(
+        f"Rows: {row_count} -- Speed: {row_count / max(elapsed_time, 1e-9):.0f}r/s -- Elapse Time: {elapsed_time:.2f}s",
+        file=sys.stderr
+    )
+
+
+def print_invalid_rows(row_count, reason_counts):
+    invalid_counts = {reason: count for reason, count in reason_counts.items() if count}
+
+    if not invalid_counts:
+        return
+
+    print(f"Rows with invalid inputs, their parameters are NaN (of {row_count} rows):", file=sys.stderr)
+    for reason, count in sorted(invalid_counts.items(), key=lambda item: -item[1]):
+        print(f"    {reason}: {count}", file=sys.stderr)
+
+
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(
+        description="Compute hemodynamic parameters for every measurement of a base dataset"
+    )
+    parser.add_argument("input_path", help="base dataset, a CSV file or a Parquet file or directory")
+    parser.add_argument("output_path", help="output CSV or Parquet file")
+    parser.add_argument(
+        "--parameters",
+        default=",".join(vectorized_hemodynamic_parameters.PARAMETERS),
+        help="comma separated parameters to compute, all of them by default"
+    )
+    parser.add_argument("--input-format", choices=["csv", "parquet"], help="guessed from the input path by default")
+    parser.add_argument("--output-format", choices=["csv", "parquet"], help="guessed from the output path by default")
+    parser.add_argument("--chunk-size", type=int, default=500000, help="rows per chunk")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, every CPU core by default")
+    parser.add_argument("--height-unit", choices=sorted(HEIGHT_UNITS), default="cm", help="unit of the height column")
+    parser.add_argument(
+        "--left-ventricular-ejection-fraction",
+        type=float,
+        default=0.65,
+        help="ejection fraction used by the elastance parameters"
+    )
+    parser.add_argument(
+        "--keep-columns",
+        default=None,
+        help="comma separated input columns copied to the output, all of them by default"
+    )
+    parser.add_argument(
+        "--validity-column",
+        default=None,
+        help="name of a boolean output column flagging the rows with valid inputs"
+    )
+
+    arguments = parser.parse_args(arguments)
+    arguments.parameters = [parameter.strip() for parameter in arguments.parameters.split(",") if parameter.strip()]
+
+    unknown_parameters = set(arguments.parameters) - set(vectorized_hemodynamic_parameters.PARAMETERS)
+    if unknown_parameters:
+        parser.error(f"unknown parameters: {', '.join(sorted(unknown_parameters))}")
+
+    if arguments.keep_columns is not None:
+        arguments.keep_columns = [column.strip() for column in arguments.keep_columns.split(",") if column.strip()]
+
+    return arguments
+
+
+def main(arguments=None):
+    arguments = parse_arguments(arguments)
+
+    row_count, reason_counts = compute_dataset(
+        arguments.input_path,
+        arguments.output_path,
+        parameters=arguments.parameters,
+        input_format=arguments.input_format,
+        output_format=arguments.output_format,
+        chunk_size=arguments.chunk_size,
+        workers=arguments.workers,
+        height_unit=arguments.height_unit,
+        left_ventricular_ejection_fraction=arguments.left_ventricular_ejection_fraction,
+        keep_columns=arguments.keep_columns,
+        validity_column=arguments.validity_column,
+        progress=print_progress,
+    )
+    print_invalid_rows(row_count, reason_counts)
+
+    return row_count
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,9 @@ Formulas are the ones that Dr. Dagnovar Aristizabal Ocampo uses.
 '''
 
 import math
+import numbers
+import functools
+import collections
 
 def body_mass_index(weight, height):
     '''
@@ -398,3 +401,402 @@ def baroreflex_heart_rate(systolic_blood_pressure, diastolic_blood_pressure):
     '''
     mean_arterial_pressure_ = mean_arterial_pressure(systolic_blood_pressure, diastolic_blood_pressure)
     return 0.66 + ((0.66 - 1.2) / (1 + 67000000000000 * math.e ** (-31 * mean_arterial_pressure_ / 89)))
+
+class PatientContext:
+    '''
+    Terms of the hemodynamic parameters that only depend on the patient,
+    computed once: body mass index, body surface area, the age dependent
+    pressure constants 76 - 0.89 * age and 57 - 0.44 * age and the height and
+    body mass index factors of the arterial compliance. Evaluating the
+    readings of a study through the context only costs the pressure
+    dependent work
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    '''
+    __slots__ = (
+        "age",
+        "weight",
+        "height",
+        "body_mass_index",
+        "body_surface_area",
+        "age_pressure_offset",
+        "age_pressure_width",
+        "half_height",
+        "body_mass_index_ratio",
+        "compliance_scale",
+        "pulse_wave_velocity_scale",
+    )
+
+    def __init__(self, age, weight, height):
+        self.age = age
+        self.weight = weight
+        self.height = height
+        self.body_mass_index = weight / (height ** 2)
+        self.body_surface_area = math.sqrt((weight * height * 100) / 3600)
+        self.age_pressure_offset = 76 - 0.89 * age
+        self.age_pressure_width = 57 - 0.44 * age
+        self.half_height = height * 100 / 2
+        self.body_mass_index_ratio = self.body_mass_index / 27.5
+        self.compliance_scale = 5.62 / (math.pi * self.age_pressure_width)
+        self.pulse_wave_velocity_scale = math.pi * self.age_pressure_width
+
+    def __repr__(self):
+        return f"PatientContext(age={self.age!r}, weight={self.weight!r}, height={self.height!r})"
+
+    def compute(self, systolic_blood_pressure, diastolic_blood_pressure, heart_rate, left_ventricular_ejection_fraction=0.65):
+        '''
+        Calculates every hemodynamic parameter for the readings of the patient.
+        Returns a dict keyed by the parameter function names, with numbers for
+        a single reading or NumPy arrays for arrays of readings
+        Parameters
+        ----------
+        systolic_blood_pressure : given in mmHg, a number or an array
+        diastolic_blood_pressure : given in mmHg, a number or an array
+        heart_rate : given in beats per minute, a number or an array
+        left_ventricular_ejection_fraction : given as a the fraction of stroke volume over end diastolic volume
+        '''
+        readings = (systolic_blood_pressure, diastolic_blood_pressure, heart_rate, left_ventricular_ejection_fraction)
+        for reading in readings:
+            # Checking the builtin types first avoids the slower abstract type check
+            if not isinstance(reading, (int, float)) and not isinstance(reading, numbers.Real):
+                return self.compute_readings(*readings)
+        return self.compute_reading(*readings)
+
+    def compute_readings(self, systolic_blood_pressure, diastolic_blood_pressure, heart_rate, left_ventricular_ejection_fraction=0.65):
+        '''
+        Calculates every hemodynamic parameter for arrays of readings with
+        vectorized_hemodynamic_parameters, reusing the patient terms. Needs NumPy
+        Parameters
+        ----------
+        systolic_blood_pressure : array given in mmHg
+        diastolic_blood_pressure : array given in mmHg
+        heart_rate : array given in beats per minute
+        left_ventricular_ejection_fraction : given as a the fraction of stroke volume over end diastolic volume
+        '''
+        import vectorized_hemodynamic_parameters
+
+        return vectorized_hemodynamic_parameters.compute_for_patient(
+            self,
+            vectorized_hemodynamic_parameters.PARAMETERS,
+            systolic_blood_pressure,
+            diastolic_blood_pressure,
+            heart_rate,
+            left_ventricular_ejection_fraction,
+        )
+
+    def compute_reading(self, systolic_blood_pressure, diastolic_blood_pressure, heart_rate, left_ventricular_ejection_fraction=0.65):
+        '''
+        Calculates every hemodynamic parameter for a single reading, with the
+        same numbers as compute_all
+        Parameters
+        ----------
+        systolic_blood_pressure : given in mmHg
+        diastolic_blood_pressure : given in mmHg
+        heart_rate : given in beats per minute
+        left_ventricular_ejection_fraction : given as a the fraction of stroke volume over end diastolic volume
+        '''
+        pulse_pressure_ = systolic_blood_pressure - diastolic_blood_pressure
+        mean_arterial_pressure_ = diastolic_blood_pressure + pulse_pressure_ * 0.35
+
+        normalized_pressure = (mean_arterial_pressure_ - self.age_pressure_offset) / self.age_pressure_width
+        compliance = self.compliance_scale / (1 + (normalized_pressure ** 2))
+        compliance = self.half_height * compliance
+        compliance = compliance * self.body_mass_index_ratio
+        arctan_normalized_pressure = math.atan(normalized_pressure)
+        impedance = math.sqrt(1.06 / ((5.62 * (0.5 + (1 / math.pi * arctan_normalized_pressure))) * compliance))
+
+        ejection_time = (((413 - 1.7 * heart_rate) / math.sqrt(mean_arterial_pressure_ / 95)) / 1000)
+        end_diastolic_blood_pressure_tau = mean_arterial_pressure_ * (math.e ** ((- ejection_time / (heart_rate / 60)) - 0.25))
+        stroke_volume_ = (mean_arterial_pressure_ - end_diastolic_blood_pressure_tau) / impedance
+        cardiac_output_ = (stroke_volume_ / 1000) * heart_rate
+
+        sympathetic_nervous_system_activation_ = math.e**(((60 / heart_rate) + 0.12) / impedance)
+        baroreflex_heart_rate_ = 0.66 + ((0.66 - 1.2) / (1 + 67000000000000 * math.e ** (-31 * mean_arterial_pressure_ / 89)))
+        baroreflex_intermediary = (sympathetic_nervous_system_activation_ * 0.75) - (baroreflex_heart_rate_ * 0.25)
+
+        pep = ((131 - 0.4 * heart_rate) * math.sqrt(mean_arterial_pressure_ / 100)) / 1000
+        ratio_pep_sistolic_time = pep / ejection_time
+        elastance_nd_mean = 0
+        for i in [0.35695, (-7.2266), 74.249, (-307.39), 684.54, (-856.92), 571.95, (-159.1)]:
+            elastance_nd_mean += (ratio_pep_sistolic_time * i)
+
+        def elastance_for(left_ventricular_ejection_fraction):
+            elastance_nd_est = (
+                (0.0275 - (0.165 * left_ventricular_ejection_fraction))
+                + (0.3656 * (diastolic_blood_pressure / systolic_blood_pressure))
+                + (0.515 * elastance_nd_mean)
+            )
+            elastance_es_sb = (
+                (diastolic_blood_pressure - (elastance_nd_est * 0.9 * systolic_blood_pressure))
+                / (stroke_volume_ * elastance_nd_est)
+            )
+            return 0.78 * elastance_es_sb + 0.55
+
+        maximum_elastance_value = elastance_for(left_ventricular_ejection_fraction)
+        arterial_elastance_ = mean_arterial_pressure_ / stroke_volume_
+
+        # arterial_ventricular_elastance always uses the default ejection fraction
+        if left_ventricular_ejection_fraction == 0.65:
+            default_maximum_elastance = maximum_elastance_value
+        else:
+            default_maximum_elastance = elastance_for(0.65)
+
+        return {
+            "body_mass_index": self.body_mass_index,
+            "body_surface_area": self.body_surface_area,
+            "pulse_pressure": pulse_pressure_,
+            "mean_arterial_pressure": mean_arterial_pressure_,
+            "pressure_dependent_arterial_compliance": compliance,
+            "characteristic_impedance": impedance,
+            "tau_rc": (mean_arterial_pressure_ / pulse_pressure_) * (60 / heart_rate),
+            "tau_wk": ((60 / heart_rate) - ejection_time) / math.log((mean_arterial_pressure_ / diastolic_blood_pressure)),
+            "stroke_volume": stroke_volume_,
+            "cardiac_output": cardiac_output_,
+            "cardiac_index": cardiac_output_ / self.body_surface_area,
+            "pulse_wave_velocity": (
+                0.357 * math.sqrt(
+                    self.pulse_wave_velocity_scale
+                    * (1 + (normalized_pressure ** 2))
+                    * (0.5 + ((1 / math.pi) * arctan_normalized_pressure))
+                )
+            ),
+            "systemic_vascular_resistance": (
+                ((1 - (1 / sympathetic_nervous_system_activation_)) * (mean_arterial_pressure_ / cardiac_output_)) * 80
+            ),
+            "sympathetic_activity_index": (1 / sympathetic_nervous_system_activation_) * 100,
+            "baroreflex_activity": 0 if baroreflex_intermediary < 0 else math.sqrt(baroreflex_intermediary / 7.7),
+            "maximum_elastance": maximum_elastance_value,
+            "arterial_elastance": arterial_elastance_,
+            "arterial_ventricular_elastance": arterial_elastance_ / default_maximum_elastance,
+            "pulsatile_load": pulse_pressure_ / stroke_volume_,
+            "cardiac_potency": (cardiac_output_ * mean_arterial_pressure_) / 450,
+            "sympathetic_nervous_system_activation": sympathetic_nervous_system_activation_,
+            "baroreflex_heart_rate": baroreflex_heart_rate_,
+        }
+
+def anthropometric_terms(age, weight, height):
+    '''
+    Returns the PatientContext with the terms of a reading that only depend
+    on the patient. Contexts are cached per patient while the cache is
+    enabled, since they repeat across all the readings of a study
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    '''
+    cache = _caches.get("terms")
+    if cache is None:
+        return PatientContext(age, weight, height)
+    context = cache.get((age, weight, height), _MISSING)
+    if context is _MISSING:
+        context = PatientContext(age, weight, height)
+        cache.put((age, weight, height), context)
+    return context
+
+def _pressure_dependent_arterial_compliance_from_terms(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure):
+    '''
+    pressure_dependent_arterial_compliance with the patient terms of
+    anthropometric_terms, used while the cache is enabled
+    '''
+    terms = anthropometric_terms(age, weight, height)
+    normalized_pressure = (
+        (mean_arterial_pressure(systolic_blood_pressure, diastolic_blood_pressure) - terms.age_pressure_offset)
+        / terms.age_pressure_width
+    )
+    output = terms.half_height * (terms.compliance_scale / (1 + (normalized_pressure ** 2)))
+    return output * terms.body_mass_index_ratio
+
+def _characteristic_impedance_from_terms(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure):
+    '''
+    characteristic_impedance with the patient terms of anthropometric_terms,
+    used while the cache is enabled
+    '''
+    terms = anthropometric_terms(age, weight, height)
+    normalized_pressure = (
+        (mean_arterial_pressure(systolic_blood_pressure, diastolic_blood_pressure) - terms.age_pressure_offset)
+        / terms.age_pressure_width
+    )
+    compliance = terms.half_height * (terms.compliance_scale / (1 + (normalized_pressure ** 2)))
+    compliance = compliance * terms.body_mass_index_ratio
+    intermediary = 5.62 * (0.5 + (1 / math.pi * math.atan(normalized_pressure)))
+    return math.sqrt(1.06 / (intermediary * compliance))
+
+def compute_all(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate, left_ventricular_ejection_fraction=0.65):
+    '''
+    Calculates every hemodynamic parameter for a single reading in one pass.
+    Every intermediate value is evaluated once and shared by the parameters
+    that depend on it. Returns a dict keyed by the parameter function names,
+    a new one on every call even when it comes from the cache
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    left_ventricular_ejection_fraction : given as a the fraction of stroke volume over end diastolic volume
+    '''
+    return dict(_compute_all(
+        age,
+        weight,
+        height,
+        systolic_blood_pressure,
+        diastolic_blood_pressure,
+        heart_rate,
+        left_ventricular_ejection_fraction
+    ))
+
+def _compute_all(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate, left_ventricular_ejection_fraction):
+    return anthropometric_terms(age, weight, height).compute_reading(
+        systolic_blood_pressure,
+        diastolic_blood_pressure,
+        heart_rate,
+        left_ventricular_ejection_fraction
+    )
+
+# Caches are only created by enable_cache, by default every call computes from scratch
+_caches = {}
+_MISSING = object()
+
+class LRUCache:
+    '''
+    Bounded mapping that evicts the least recently used entry and counts
+    lookup hits and misses
+    Parameters
+    ----------
+    maxsize : maximum number of entries
+    '''
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "maxsize": self.maxsize}
+
+def enable_cache(maxsize=4096, terms_maxsize=1024):
+    '''
+    Enables the memoization of the parameter functions. Results are cached
+    keyed on the input values, and the terms that only depend on the patient
+    (see anthropometric_terms and PatientContext) in a separate cache, which
+    compute_all and the compliance and impedance formulas, and through them
+    every formula that depends on the impedance, take their patient terms
+    from. Previously cached values are dropped. The module functions are
+    replaced by cached versions, so only calls made through the module, like
+    hemodynamic_parameters.stroke_volume, use the cache. The caches are not
+    thread safe
+    Parameters
+    ----------
+    maxsize : maximum number of cached results
+    terms_maxsize : maximum number of cached patients
+    '''
+    _caches["results"] = LRUCache(maxsize)
+    _caches["terms"] = LRUCache(terms_maxsize)
+    for name, function in _UNCACHED_FUNCTIONS.items():
+        implementation = _PATIENT_TERMS_FUNCTIONS.get(name, function)
+        globals()[name] = functools.wraps(function)(memoized(implementation))
+
+def disable_cache():
+    '''
+    Disables the memoization, restoring the uncached functions, and drops every cached value
+    '''
+    _caches.clear()
+    globals().update(_UNCACHED_FUNCTIONS)
+
+def clear_cache():
+    '''
+    Drops every cached value and resets the statistics, keeping the cache enabled
+    '''
+    for cache in _caches.values():
+        cache.clear()
+
+def cache_info():
+    '''
+    Returns the hits, misses, size and maxsize of each cache, empty if the cache is disabled
+    '''
+    return {name: cache.info() for name, cache in _caches.items()}
+
+def memoized(function):
+    '''
+    Caches the results of a parameter function in the results cache. Calls
+    with unhashable arguments are computed without the cache
+    '''
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        cache = _caches.get("results")
+        if cache is None:
+            return function(*args, **kwargs)
+        key = (function.__name__, args, tuple(sorted(kwargs.items())) if kwargs else ())
+        try:
+            value = cache.get(key, _MISSING)
+        except TypeError:
+            return function(*args, **kwargs)
+        if value is _MISSING:
+            value = function(*args, **kwargs)
+            cache.put(key, value)
+        return value
+    return wrapper
+
+_UNCACHED_FUNCTIONS = {
+    function.__name__: function for function in (
+        body_mass_index,
+        body_surface_area,
+        pulse_pressure,
+        mean_arterial_pressure,
+        pressure_dependent_arterial_compliance,
+        characteristic_impedance,
+        tau_rc,
+        tau_wk,
+        stroke_volume,
+        cardiac_output,
+        cardiac_index,
+        pulse_wave_velocity,
+        systemic_vascular_resistance,
+        sympathetic_activity_index,
+        baroreflex_activity,
+        maximum_elastance,
+        arterial_elastance,
+        arterial_ventricular_elastance,
+        pulsatile_load,
+        cardiac_potency,
+        sympathetic_nervous_system_activation,
+        baroreflex_heart_rate,
+        _compute_all,
+    )
+}
+
+# Versions of the formulas that take the patient terms from
+# anthropometric_terms, so a new reading of a cached patient only costs the
+# pressure dependent work. Without the cache, building the terms would cost
+# more than the few operations they save
+_PATIENT_TERMS_FUNCTIONS = {
+    "pressure_dependent_arterial_compliance": _pressure_dependent_arterial_compliance_from_terms,
+    "characteristic_impedance": _characteristic_impedance_from_terms,
+}
@@ -0,0 +1,380 @@
+'''
+Module with an online version of the hemodynamic parameters for studies
+that are still recording. Readings are added one at a time, or in small
+batches, to the stream of their patient, which keeps constant memory
+running statistics of every parameter: count, mean, variance, minimum,
+maximum and the mean of the last readings. Nothing is recomputed over the
+history when a reading arrives.
+'''
+
+import math
+import collections
+
+import numpy
+
+import hemodynamic_parameters
+import hemodynamic_validation
+from vectorized_hemodynamic_parameters import PARAMETERS
+from hemodynamic_validation import PHYSIOLOGICAL_RANGES
+
+
+class RunningStatistics:
+    '''
+    Count, mean, variance, minimum and maximum of a stream of values, updated
+    with the Welford algorithm and merged with the Chan et al. formulas for
+    batches
+    '''
+    __slots__ = ("count", "mean", "sum_of_squares", "minimum", "maximum")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.sum_of_squares = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def __repr__(self):
+        return f"RunningStatistics(count={self.count}, mean={self.mean!r}, variance={self.variance!r})"
+
+    def update(self, value):
+        '''
+        Adds a single value
+        Parameters
+        ----------
+        value : number to add
+        '''
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.sum_of_squares += delta * (value - self.mean)
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+
+    def update_batch(self, values):
+        '''
+        Adds a batch of values at once
+        Parameters
+        ----------
+        values : NumPy array of the numbers to add
+        '''
+        count = len(values)
+        if not count:
+            return
+        mean = float(numpy.mean(values))
+        sum_of_squares = float(numpy.sum((values - mean) ** 2))
+
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.sum_of_squares += sum_of_squares + delta ** 2 * self.count * count / total
+        self.count = total
+        self.minimum = min(self.minimum, float(numpy.min(values)))
+        self.maximum = max(self.maximum, float(numpy.max(values)))
+
+    @property
+    def variance(self):
+        '''
+        Sample variance, NaN with less than two values
+        '''
+        if self.count < 2:
+            return math.nan
+        return self.sum_of_squares / (self.count - 1)
+
+    @property
+    def standard_deviation(self):
+        return math.sqrt(self.variance)
+
+    def as_dict(self):
+        empty = self.count == 0
+        return {
+            "count": self.count,
+            "mean": math.nan if empty else self.mean,
+            "variance": self.variance,
+            "standard_deviation": self.standard_deviation,
+            "minimum": math.nan if empty else self.minimum,
+            "maximum": math.nan if empty else self.maximum,
+        }
+
+
+class RollingWindow:
+    '''
+    Mean, minimum and maximum of the last values of a stream
+    Parameters
+    ----------
+    size : number of last values kept
+    '''
+    __slots__ = ("values", "total")
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError("Rolling window size must be at least 1")
+        self.values = collections.deque(maxlen=size)
+        self.total = 0.0
+
+    def __repr__(self):
+        return f"RollingWindow(size={self.values.maxlen}, values={list(self.values)!r})"
+
+    def __len__(self):
+        return len(self.values)
+
+    def update(self, value):
+        '''
+        Adds a value, dropping the oldest one when the window is full
+        Parameters
+        ----------
+        value : number to add
+        '''
+        if len(self.values) == self.values.maxlen:
+            self.total -= self.values[0]
+        self.values.append(value)
+        self.total += value
+
+    def update_batch(self, values):
+        '''
+        Adds a batch of values, only the last ones of the batch can stay in
+        the window
+        Parameters
+        ----------
+        values : iterable of the numbers to add
+        '''
+        for value in values[-self.values.maxlen:]:
+            self.update(float(value))
+        # Sums over long streams drift, the window is small enough to re-add
+        self.total = math.fsum(self.values)
+
+    @property
+    def mean(self):
+        if not self.values:
+            return math.nan
+        return self.total / len(self.values)
+
+    def as_dict(self):
+        return {
+            "rolling_count": len(self.values),
+            "rolling_mean": self.mean,
+            "rolling_minimum": min(self.values, default=math.nan),
+            "rolling_maximum": max(self.values, default=math.nan),
+        }
+
+
+class PatientStream:
+    '''
+    Running statistics of the hemodynamic parameters of a single patient.
+    The terms that only depend on the patient are computed once, see
+    hemodynamic_parameters.PatientContext. Readings outside the
+    physiological ranges, or that give a non finite parameter, are counted
+    as rejected and do not change the statistics
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    parameters : iterable with the names of the parameters to track, see PARAMETERS
+    window_size : number of last readings of the rolling statistics
+    left_ventricular_ejection_fraction : given as a the fraction of stroke volume over end diastolic volume
+    ranges : dict with the inclusive (minimum, maximum) of each input, see PHYSIOLOGICAL_RANGES
+    '''
+
+    def __init__(self, age, weight, height, parameters=PARAMETERS, window_size=8, left_ventricular_ejection_fraction=0.65, ranges=PHYSIOLOGICAL_RANGES):
+        for name, value in (("age", age), ("weight", weight), ("height", height), ("left_ventricular_ejection_fraction", left_ventricular_ejection_fraction)):
+            if not _in_range(value, ranges.get(name)):
+                raise ValueError(f"Invalid {name}: {value!r}")
+
+        self.context = hemodynamic_parameters.PatientContext(age, weight, height)
+        self.parameters = tuple(parameters)
+        self.left_ventricular_ejection_fraction = left_ventricular_ejection_fraction
+        self.ranges = ranges
+        self.statistics = {parameter: RunningStatistics() for parameter in self.parameters}
+        self.windows = {parameter: RollingWindow(window_size) for parameter in self.parameters}
+        self.reading_count = 0
+        self.rejected_count = 0
+
+    def __repr__(self):
+        return f"PatientStream({self.context!r}, readings={self.reading_count}, rejected={self.rejected_count})"
+
+    def add_reading(self, systolic_blood_pressure, diastolic_blood_pressure, heart_rate):
+        '''
+        Adds a single reading. Returns the dict with the parameters of the
+        reading, or None if it was rejected
+        Parameters
+        ----------
+        systolic_blood_pressure : given in mmHg
+        diastolic_blood_pressure : given in mmHg
+        heart_rate : given in beats per minute
+        '''
+        self.reading_count += 1
+
+        values = None
+        if (
+            _in_range(systolic_blood_pressure, self.ranges.get("systolic_blood_pressure"))
+            and _in_range(diastolic_blood_pressure, self.ranges.get("diastolic_blood_pressure"))
+            and _in_range(heart_rate, self.ranges.get("heart_rate"))
+            and systolic_blood_pressure > diastolic_blood_pressure
+        ):
+            try:
+                results = self.context.compute_reading(
+                    systolic_blood_pressure,
+                    diastolic_blood_pressure,
+                    heart_rate,
+                    self.left_ventricular_ejection_fraction
+                )
+                values = {parameter: results[parameter] for parameter in self.parameters}
+            except (ValueError, ZeroDivisionError, OverflowError):
+                values = None
+
+        if values is None or not all(math.isfinite(value) for value in values.values()):
+            self.rejected_count += 1
+            return None
+
+        for parameter, value in values.items():
+            self.statistics[parameter].update(value)
+            self.windows[parameter].update(value)
+
+        return values
+
+    def add_readings(self, systolic_blood_pressure, diastolic_blood_pressure, heart_rate):
+        '''
+        Adds a batch of readings in time order with vectorized operations.
+        Returns the number of readings accepted
+        Parameters
+        ----------
+        systolic_blood_pressure : array given in mmHg
+        diastolic_blood_pressure : array given in mmHg
+        heart_rate : array given in beats per minute
+        '''
+        context = self.context
+        validation = hemodynamic_validation.validate(
+            context.age,
+            context.weight,
+            context.height,
+            systolic_blood_pressure,
+            diastolic_blood_pressure,
+            heart_rate,
+            self.left_ventricular_ejection_fraction,
+            self.ranges
+        )
+        with numpy.errstate(all="ignore"):
+            results = context.compute_readings(
+                systolic_blood_pressure,
+                diastolic_blood_pressure,
+                heart_rate,
+                self.left_ventricular_ejection_fraction
+            )
+
+        valid = numpy.atleast_1d(validation.valid)
+        values = {}
+        for parameter in self.parameters:
+            values[parameter] = numpy.broadcast_to(results[parameter], valid.shape)
+            valid = valid & numpy.isfinite(values[parameter])
+
+        accepted = int(numpy.count_nonzero(valid))
+        self.reading_count += len(valid)
+        self.rejected_count += len(valid) - accepted
+
+        for parameter, value in values.items():
+            value = value[valid]
+            self.statistics[parameter].update_batch(value)
+            self.windows[parameter].update_batch(value)
+
+        return accepted
+
+    def summary(self):
+        '''
+        Returns a dict with the running and rolling statistics of each parameter
+        '''
+        return {
+            parameter: dict(self.statistics[parameter].as_dict(), **self.windows[parameter].as_dict())
+            for parameter in self.parameters
+        }
+
+
+class ParameterStream:
+    '''
+    Streams of many patients recording at the same time, keyed by patient
+    ID. Adding a reading only costs a dict lookup on top of the patient
+    stream. Not thread safe, every update must come from the same thread or
+    event loop
+    Parameters
+    ----------
+    parameters : iterable with the names of the parameters to track, see PARAMETERS
+    window_size : number of last readings of the rolling statistics
+    ranges : dict with the inclusive (minimum, maximum) of each input, see PHYSIOLOGICAL_RANGES
+    '''
+
+    def __init__(self, parameters=PARAMETERS, window_size=8, ranges=PHYSIOLOGICAL_RANGES):
+        self.parameters = tuple(parameters)
+        self.window_size = window_size
+        self.ranges = ranges
+        self.patients = {}
+
+    def __repr__(self):
+        return f"ParameterStream(patients={len(self.patients)})"
+
+    def __len__(self):
+        return len(self.patients)
+
+    def __contains__(self, patient_id):
+        return patient_id in self.patients
+
+    def __getitem__(self, patient_id):
+        return self.patients[patient_id]
+
+    def add_patient(self, patient_id, age, weight, height, left_ventricular_ejection_fraction=0.65):
+        '''
+        Starts the stream of a patient, replacing any previous stream of the
+        same ID. Returns the PatientStream
+        Parameters
+        ----------
+        patient_id : ID of the patient study
+        age : given in years
+        weight : given in kg
+        height : given in meters
+        left_ventricular_ejection_fraction : given as a the fraction of stroke volume over end diastolic volume
+        '''
+        stream = PatientStream(
+            age,
+            weight,
+            height,
+            self.parameters,
+            self.window_size,
+            left_ventricular_ejection_fraction,
+            self.ranges
+        )
+        self.patients[patient_id] = stream
+        return stream
+
+    def remove_patient(self, patient_id):
+        '''
+        Ends the stream of a patient, when the study finishes. Returns its
+        PatientStream
+        '''
+        return self.patients.pop(patient_id)
+
+    def add_reading(self, patient_id, systolic_blood_pressure, diastolic_blood_pressure, heart_rate):
+        '''
+        Adds a single reading to the stream of a patient, see PatientStream.add_reading
+        '''
+        return self.patients[patient_id].add_reading(systolic_blood_pressure, diastolic_blood_pressure, heart_rate)
+
+    def add_readings(self, patient_id, systolic_blood_pressure, diastolic_blood_pressure, heart_rate):
+        '''
+        Adds a batch of readings to the stream of a patient, see PatientStream.add_readings
+        '''
+        return self.patients[patient_id].add_readings(systolic_blood_pressure, diastolic_blood_pressure, heart_rate)
+
+    def summary(self, patient_id):
+        '''
+        Returns the statistics of a patient, see PatientStream.summary
+        '''
+        return self.patients[patient_id].summary()
+
+
+def _in_range(value, value_range):
+    if value is None or not math.isfinite(value):
+        return False
+    if value_range is None:
+        return True
+    minimum, maximum = value_range
+    return minimum <= value <= maximum
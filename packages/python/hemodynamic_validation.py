@@ -0,0 +1,162 @@
+'''
+Module with the batch mode of the hemodynamic parameters. Inputs are
+validated against physiological ranges in a single vectorized pass and the
+parameters of invalid rows are NaN instead of raising, together with a
+validity mask and the number of rows rejected for each reason.
+'''
+
+import collections
+
+import numpy
+
+import compiled_hemodynamic_parameters
+from vectorized_hemodynamic_parameters import INPUTS, PARAMETERS
+
+
+# Inclusive (minimum, maximum) of each input. The age is bounded so that
+# the age dependent compliance width stays positive, and the heart rate so
+# that the ejection time does
+PHYSIOLOGICAL_RANGES = {
+    "age": (0, 120),
+    "weight": (2, 350),
+    "height": (0.4, 2.5),
+    "systolic_blood_pressure": (50, 300),
+    "diastolic_blood_pressure": (20, 200),
+    "heart_rate": (20, 240),
+    "left_ventricular_ejection_fraction": (0.05, 0.95),
+}
+
+# Reason of the rows whose inputs are in range but still give a non finite parameter
+NON_FINITE_REASON = "non_finite_result"
+
+Validation = collections.namedtuple("Validation", ["valid", "reasons"])
+
+BatchResult = collections.namedtuple("BatchResult", ["values", "valid", "reason_counts"])
+
+def validate(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate, left_ventricular_ejection_fraction=0.65, ranges=PHYSIOLOGICAL_RANGES):
+    '''
+    Validates the inputs of the hemodynamic parameters. Returns a Validation
+    with the boolean mask of the valid rows and a dict with the boolean mask
+    of the rows failing each reason, keyed by "missing_<input>",
+    "<input>_out_of_range" and "systolic_not_above_diastolic"
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    left_ventricular_ejection_fraction : given as a the fraction of stroke volume over end diastolic volume
+    ranges : dict with the inclusive (minimum, maximum) of each input, see PHYSIOLOGICAL_RANGES
+    '''
+    inputs = numpy.broadcast_arrays(
+        *[
+            numpy.asarray(value, dtype=float)
+            for value in (age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate, left_ventricular_ejection_fraction)
+        ]
+    )
+    values = dict(zip(INPUTS, inputs))
+
+    reasons = {}
+    for name, value in values.items():
+        missing = ~numpy.isfinite(value)
+        reasons[f"missing_{name}"] = missing
+        if name in ranges:
+            minimum, maximum = ranges[name]
+            reasons[f"{name}_out_of_range"] = ~missing & ((value < minimum) | (value > maximum))
+
+    # Equal pressures divide by zero in tau_rc and give log(1) in tau_wk
+    reasons["systolic_not_above_diastolic"] = values["systolic_blood_pressure"] <= values["diastolic_blood_pressure"]
+
+    invalid = numpy.zeros(inputs[0].shape, dtype=bool)
+    for reason in reasons.values():
+        invalid |= reason
+
+    return Validation(~invalid, reasons)
+
+def compute(parameters, age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate, left_ventricular_ejection_fraction=0.65, ranges=PHYSIOLOGICAL_RANGES):
+    '''
+    Calculates the given parameters of every row without raising. Rows with
+    invalid inputs, or with any non finite parameter, are NaN in every
+    parameter. Returns a BatchResult with the dict of parameter arrays, the
+    boolean mask of the valid rows and a dict with the number of rows that
+    failed each reason; a row failing several reasons counts in each of them
+    Parameters
+    ----------
+    parameters : iterable with the names of the parameters to calculate, see PARAMETERS
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    left_ventricular_ejection_fraction : given as a the fraction of stroke volume over end diastolic volume
+    ranges : dict with the inclusive (minimum, maximum) of each input, see PHYSIOLOGICAL_RANGES
+    '''
+    parameters = tuple(parameters)
+    validation = validate(
+        age,
+        weight,
+        height,
+        systolic_blood_pressure,
+        diastolic_blood_pressure,
+        heart_rate,
+        left_ventricular_ejection_fraction,
+        ranges
+    )
+
+    # Invalid rows are computed along with the valid ones and masked
+    # afterwards, which is cheaper than compacting the arrays
+    with numpy.errstate(all="ignore"):
+        results = compiled_hemodynamic_parameters.compute(
+            parameters,
+            age,
+            weight,
+            height,
+            systolic_blood_pressure,
+            diastolic_blood_pressure,
+            heart_rate,
+            left_ventricular_ejection_fraction
+        )
+
+    valid = validation.valid
+    values = {}
+    for parameter in parameters:
+        values[parameter] = numpy.array(numpy.broadcast_to(results[parameter], valid.shape), dtype=float)
+        valid = valid & numpy.isfinite(values[parameter])
+
+    reason_counts = {reason: int(numpy.count_nonzero(mask)) for reason, mask in validation.reasons.items()}
+    reason_counts[NON_FINITE_REASON] = int(numpy.count_nonzero(validation.valid & ~valid))
+
+    for parameter in parameters:
+        values[parameter][~valid] = numpy.nan
+
+    return BatchResult(values, valid, reason_counts)
+
+def compute_all(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate, left_ventricular_ejection_fraction=0.65, ranges=PHYSIOLOGICAL_RANGES):
+    '''
+    Calculates every hemodynamic parameter of every row without raising,
+    see compute
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    left_ventricular_ejection_fraction : given as a the fraction of stroke volume over end diastolic volume
+    ranges : dict with the inclusive (minimum, maximum) of each input, see PHYSIOLOGICAL_RANGES
+    '''
+    return compute(
+        PARAMETERS,
+        age,
+        weight,
+        height,
+        systolic_blood_pressure,
+        diastolic_blood_pressure,
+        heart_rate,
+        left_ventricular_ejection_fraction,
+        ranges
+    )
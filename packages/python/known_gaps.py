@@ -0,0 +1,72 @@
+import os
+import zlib
+
+
+class KnownGaps:
+    """ Patient IDs confirmed missing in the API, below patients that exist,
+    so later pulls can skip them without a request. Stored as a bitmap with
+    one bit per patient ID, compressed with zlib
+
+    Parameters:
+        path (str): Path of the bitmap file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.bits = bytearray()
+
+        if os.path.exists(path):
+            with open(path, "rb") as bitmap_file:
+                self.bits = bytearray(zlib.decompress(bitmap_file.read()))
+
+    def __contains__(self, patient_id):
+        index, bit = divmod(patient_id, 8)
+
+        return index < len(self.bits) and bool(self.bits[index] & (1 << bit))
+
+    def __len__(self):
+        return sum(bin(byte).count("1") for byte in self.bits if byte)
+
+    def __iter__(self):
+        for index, byte in enumerate(self.bits):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield index * 8 + bit
+
+    def add(self, patient_id):
+        """ Record a patient ID confirmed missing
+
+        Parameters:
+            patient_id (int): Patient ABPM test ID
+        """
+
+        index, bit = divmod(patient_id, 8)
+
+        if index >= len(self.bits):
+            self.bits.extend(bytes(index + 1 - len(self.bits)))
+
+        self.bits[index] |= 1 << bit
+
+    def discard(self, patient_id):
+        """ Forget a patient ID, such as one that was found after all
+
+        Parameters:
+            patient_id (int): Patient ABPM test ID
+        """
+
+        index, bit = divmod(patient_id, 8)
+
+        if index < len(self.bits):
+            self.bits[index] &= ~(1 << bit) & 0xFF
+
+    def save(self):
+        """ Atomically replace the bitmap file
+        """
+
+        temporary_path = f"{self.path}.tmp"
+
+        with open(temporary_path, "wb") as bitmap_file:
+            bitmap_file.write(zlib.compress(bytes(self.bits), 9))
+
+        os.replace(temporary_path, self.path)
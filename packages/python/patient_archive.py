@@ -0,0 +1,186 @@
+"""
+Append only archive of the patient data pulled from the API, in gzip JSON
+lines shards with a text index of each patient position, so a single
+patient can be read without decompressing the rest of its shard.
+"""
+
+import os
+import glob
+import gzip
+import json
+import datetime
+import collections
+
+
+# Position of the compressed data of a patient inside an archive shard
+PatientLocation = collections.namedtuple("PatientLocation", ["patient_id", "shard", "offset", "length"])
+
+
+def read_patient(location):
+    """ Read the data of a single patient from its archive shard
+
+    Parameters:
+        location (PatientLocation): Position of the patient in the archive
+
+    Returns:
+        dict: JSON data pulled from the API for the patient
+    """
+
+    with open(location.shard, "rb") as shard_file:
+        shard_file.seek(location.offset)
+        return json.loads(gzip.decompress(shard_file.read(location.length)))
+
+
+def read_shard_index(index_path):
+    """ Read the index of a shard, skipping the last entry if the shard was
+    not completely written
+
+    Parameters:
+        index_path (str): Path of the shard index file
+
+    Returns:
+        list: PatientLocation of every patient in the shard, in append order
+    """
+
+    shard_path = index_path[:-len(".idx")] + ".jsonl.gz"
+    shard_size = os.path.getsize(shard_path) if os.path.exists(shard_path) else 0
+    locations = []
+
+    with open(index_path, "r") as index_file:
+        for line in index_file:
+            fields = line.split()
+
+            if len(fields) != 3:
+                continue
+
+            location = PatientLocation(int(fields[0]), shard_path, int(fields[1]), int(fields[2]))
+
+            if location.offset + location.length <= shard_size:
+                locations.append(location)
+
+    return locations
+
+
+class PatientArchive:
+    """ Append only archive of the patients pulled from the API. Every writing
+    session appends to its own gzip JSONL shard, with one gzip member per
+    patient, so a shard is never modified once its session is closed. A text
+    index next to each shard keeps the offset and length of every patient for
+    random access. Patients appended again override the previous shards
+
+    Parameters:
+        path (str): Directory of the archive
+        compression_level (int): gzip compression level of new patients
+    """
+
+    def __init__(self, path, compression_level=6):
+        self.path = path
+        self.compression_level = compression_level
+        self.shard_file = None
+        self.index_file = None
+        self._locations = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def locations(self):
+        """ Latest location of every archived patient
+
+        Returns:
+            dict: PatientLocation keyed by patient ID
+        """
+
+        if self._locations is None:
+            self._locations = {}
+
+            for index_path in sorted(glob.glob(os.path.join(self.path, "shard-*.idx"))):
+                for location in read_shard_index(index_path):
+                    self._locations[location.patient_id] = location
+
+        return self._locations
+
+    def __contains__(self, patient_id):
+        return patient_id in self.locations
+
+    def __len__(self):
+        return len(self.locations)
+
+    def max_patient_id(self):
+        return max(self.locations, default=0)
+
+    def read(self, patient_id):
+        """ Read the latest data of a patient
+
+        Parameters:
+            patient_id (int): Patient ABPM test ID
+
+        Returns:
+            dict: JSON data pulled from the API for the patient
+        """
+
+        return read_patient(self.locations[patient_id])
+
+    def append(self, patient_data):
+        """ Append the data of a patient to the shard of this session, creating
+        the shard on the first patient
+
+        Parameters:
+            patient_data (dict): JSON data pulled from the API, with the patient ID in "id"
+        """
+
+        self.append_encoded(patient_data["id"], self.encode(patient_data))
+
+    def encode(self, patient_data):
+        """ Serialize and compress the data of a patient as a shard member
+
+        Parameters:
+            patient_data (dict): JSON data pulled from the API
+
+        Returns:
+            bytes: Gzip member with the patient JSON line
+        """
+
+        return gzip.compress(
+            (json.dumps(patient_data) + "\n").encode("utf-8"),
+            compresslevel=self.compression_level
+        )
+
+    def append_encoded(self, patient_id, data):
+        """ Append a patient already encoded by encode to the shard of this
+        session, creating the shard on the first patient
+
+        Parameters:
+            patient_id (int): Patient ABPM test ID
+            data (bytes): Encoded patient data
+        """
+
+        if self.shard_file is None:
+            os.makedirs(self.path, exist_ok=True)
+            shard_name = f"shard-{datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+
+            self.shard_file = open(os.path.join(self.path, f"{shard_name}.jsonl.gz"), "ab")
+            self.index_file = open(os.path.join(self.path, f"{shard_name}.idx"), "a")
+
+        offset = self.shard_file.tell()
+
+        # The index entry is written after its data, so a crash can only lose the last patient
+        self.shard_file.write(data)
+        self.shard_file.flush()
+        self.index_file.write(f"{patient_id}\t{offset}\t{len(data)}\n")
+        self.index_file.flush()
+
+        if self._locations is not None:
+            self._locations[patient_id] = PatientLocation(
+                patient_id, self.shard_file.name, offset, len(data)
+            )
+
+    def close(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+            self.index_file.close()
+            self.shard_file = None
+            self.index_file = None
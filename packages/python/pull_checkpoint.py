@@ -0,0 +1,78 @@
+import os
+import json
+
+
+class PullCheckpoint:
+    """ Resume point of the API pull, stored as a small JSON file with the
+    highest patient ID saved and the IDs below it that failed and are missing
+
+    Parameters:
+        path (str): Path of the checkpoint file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.high_water_mark = None
+        self.missing_patient_ids = set()
+
+        if os.path.exists(path):
+            with open(path, "r") as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+
+            self.high_water_mark = checkpoint["high_water_mark"]
+            self.missing_patient_ids = set(checkpoint["missing_patient_ids"])
+
+    @property
+    def exists(self):
+        return self.high_water_mark is not None
+
+    @property
+    def start_patient_id(self):
+        """ First patient ID not pulled yet
+        """
+
+        return (self.high_water_mark or 0) + 1
+
+    def saved(self, patient_id):
+        """ Record a patient whose data was written, and persist the checkpoint
+
+        Parameters:
+            patient_id (int): Patient ABPM test ID saved
+        """
+
+        self.missing_patient_ids.discard(patient_id)
+        self.high_water_mark = max(self.high_water_mark or 0, patient_id)
+        self.save()
+
+    def failed(self, patient_id):
+        """ Record a patient whose pull failed. It is persisted with the next
+        saved patient, or by save at the end of the pull
+
+        Parameters:
+            patient_id (int): Patient ABPM test ID that failed
+        """
+
+        self.missing_patient_ids.add(patient_id)
+
+    def resolved(self, patient_id):
+        """ Record a missing patient that was pulled again, with or without data
+
+        Parameters:
+            patient_id (int): Patient ABPM test ID pulled
+        """
+
+        self.missing_patient_ids.discard(patient_id)
+
+    def save(self):
+        """ Atomically replace the checkpoint file
+        """
+
+        temporary_path = f"{self.path}.tmp"
+
+        with open(temporary_path, "w") as checkpoint_file:
+            json.dump({
+                "high_water_mark": self.high_water_mark,
+                "missing_patient_ids": sorted(self.missing_patient_ids),
+            }, checkpoint_file)
+
+        os.replace(temporary_path, self.path)
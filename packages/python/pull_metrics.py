@@ -0,0 +1,334 @@
+"""
+Metrics of the API pull: counters, gauges and latency histograms labelled
+by endpoint, status or pipeline stage (auth, fetch, serialize, write).
+They are exported as a JSON snapshot, as a Prometheus text file and as a
+structured log of JSON lines.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import bisect
+import datetime
+import contextlib
+
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    """ Distribution of observed values in cumulative buckets, like a
+    Prometheus histogram, with the exact count, sum, minimum and maximum
+
+    Parameters:
+        buckets (tuple): Sorted upper bounds of the buckets, +Inf is implicit
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def quantile(self, quantile):
+        """ Estimate a quantile by linear interpolation inside its bucket
+
+        Parameters:
+            quantile (float): Quantile between 0 and 1
+
+        Returns:
+            float: Estimated value, None without observations
+        """
+
+        if not self.count:
+            return None
+
+        rank = quantile * self.count
+        cumulative = 0
+
+        for index, bucket_count in enumerate(self.bucket_counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                lower = self.buckets[index - 1] if index else self.minimum
+                upper = self.buckets[index] if index < len(self.buckets) else self.maximum
+                lower, upper = max(lower, self.minimum), min(upper, self.maximum)
+
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+
+            cumulative += bucket_count
+
+        return self.maximum
+
+    def as_dict(self):
+        empty = self.count == 0
+
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": None if empty else self.sum / self.count,
+            "min": None if empty else self.minimum,
+            "max": None if empty else self.maximum,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([str(bucket) for bucket in self.buckets] + ["+Inf"], self.cumulative_counts())),
+        }
+
+    def cumulative_counts(self):
+        counts = []
+        total = 0
+
+        for bucket_count in self.bucket_counts:
+            total += bucket_count
+            counts.append(total)
+
+        return counts
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+
+    values = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+
+    return "{" + values + "}"
+
+
+def write_atomically(path, text):
+    """ Replace a file with the given text, never leaving it half written
+
+    Parameters:
+        path (str): Path of the file
+        text (str): New content of the file
+    """
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    temporary_path = f"{path}.tmp"
+
+    with open(temporary_path, "w") as metrics_file:
+        metrics_file.write(text)
+
+    os.replace(temporary_path, path)
+
+
+class PullMetrics:
+    """ Collect the metrics of a pull. Metrics are identified by a name and
+    keyword labels, and are created the first time they are updated. Not
+    thread safe, they must be updated from the event loop of the pull
+
+    Parameters:
+        log_path (str): File where log appends JSON lines, None only prints them
+        report_interval (float): Minimum seconds between two progress log lines
+    """
+
+    def __init__(self, log_path=None, report_interval=30):
+        self.log_path = log_path
+        self.report_interval = report_interval
+
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.started_at = time.time()
+        self.last_report_at = None
+
+    def increment(self, name, value=1, **labels):
+        key = (name, label_key(labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        self.gauges[(name, label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, label_key(labels))
+
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+
+        self.histograms[key].observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """ Observe the seconds spent in a with block, also when it raises
+
+        Parameters:
+            name (str): Histogram name
+            labels: Labels of the histogram
+        """
+
+        start_time = time.monotonic()
+
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start_time, **labels)
+
+    def stage(self, stage):
+        """ Time a stage of the pull in the pull_stage_seconds histogram
+
+        Parameters:
+            stage (str): "auth", "fetch", "serialize", "write" or another stage name
+        """
+
+        return self.timer("pull_stage_seconds", stage=stage)
+
+    def counter_total(self, name, **labels):
+        """ Sum of a counter over every label set that includes the given labels
+        """
+
+        labels = set(labels.items())
+
+        return sum(
+            value for (counter_name, counter_labels), value in self.counters.items()
+            if counter_name == name and labels <= set(counter_labels)
+        )
+
+    def snapshot(self):
+        """ Current value of every metric
+
+        Returns:
+            dict: JSON serializable metrics
+        """
+
+        return {
+            "started_at": datetime.datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+            "elapsed_seconds": time.time() - self.started_at,
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.counters.items(), key=sort_key)
+            ],
+            "gauges": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.gauges.items(), key=sort_key)
+            ],
+            "histograms": [
+                dict({"name": name, "labels": dict(labels)}, **histogram.as_dict())
+                for (name, labels), histogram in sorted(self.histograms.items(), key=sort_key)
+            ],
+        }
+
+    def prometheus_text(self):
+        """ Metrics in the Prometheus text exposition format
+
+        Returns:
+            str: Text of the metrics
+        """
+
+        lines = []
+
+        for metric_type, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+            for name in sorted({name for name, _ in metrics}):
+                lines.append(f"# TYPE {name} {metric_type}")
+
+                for (metric_name, labels), value in sorted(metrics.items(), key=sort_key):
+                    if metric_name == name:
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+
+        for name in sorted({name for name, _ in self.histograms}):
+            lines.append(f"# TYPE {name} histogram")
+
+            for (metric_name, labels), histogram in sorted(self.histograms.items(), key=sort_key):
+                if metric_name != name:
+                    continue
+
+                bounds = [str(bucket) for bucket in histogram.buckets] + ["+Inf"]
+                for bound, count in zip(bounds, histogram.cumulative_counts()):
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {count}")
+
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path):
+        write_atomically(path, json.dumps(self.snapshot(), indent=2) + "\n")
+
+    def write_prometheus(self, path):
+        write_atomically(path, self.prometheus_text())
+
+    def log(self, event, **fields):
+        """ Print a structured log line, and append it to log_path if set
+
+        Parameters:
+            event (str): Name of the event
+            fields: JSON serializable values of the event
+        """
+
+        line = json.dumps(dict({
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "event": event,
+        }, **fields), default=str)
+
+        print(line)
+        sys.stdout.flush()
+
+        if self.log_path is not None:
+            if os.path.dirname(self.log_path):
+                os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+
+            with open(self.log_path, "a") as log_file:
+                log_file.write(line + "\n")
+
+    def report_progress(self, patients, patient_id, force=False):
+        """ Log a progress line with the throughput, request and error
+        counts, at most once every report_interval seconds
+
+        Parameters:
+            patients (int): Number of patients saved so far
+            patient_id (int): Last patient ID saved
+            force (bool): Log even if the last line is recent
+        """
+
+        now = time.time()
+
+        if not force and self.last_report_at is not None and now - self.last_report_at < self.report_interval:
+            return
+
+        self.last_report_at = now
+        elapsed_time = now - self.started_at
+
+        errors = {}
+        for (name, labels), value in self.counters.items():
+            status = dict(labels).get("status")
+            if name == "api_requests_total" and status is not None and str(status) != "200":
+                errors[str(status)] = errors.get(str(status), 0) + value
+
+        self.log(
+            "progress",
+            patients=patients,
+            patient_id=patient_id,
+            elapsed_seconds=round(elapsed_time, 3),
+            patients_per_second=round(patients / max(elapsed_time, 1e-9), 3),
+            requests=self.counter_total("api_requests_total"),
+            retries=self.counter_total("api_retries_total"),
+            errors_by_status=errors,
+            response_bytes=self.counter_total("api_response_bytes_total"),
+            patients_in_flight=self.gauges.get(("pull_patients_in_flight", ()), 0),
+            concurrency_limit=self.gauges.get(("api_concurrency_limit", ())),
+        )
+
+
+def sort_key(item):
+    name, labels = item[0]
+
+    return name, [(label, str(value)) for label, value in labels]
@@ -0,0 +1,114 @@
+import sqlite3
+import datetime
+
+
+class RetryQueue:
+    """ Durable queue of the patients whose API pull failed, stored in SQLite
+    with the number of failed attempts and the last error status of each one
+
+    Parameters:
+        path (str): Path of the SQLite database, created if it does not exist
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS failed_patients (
+                patient_id INTEGER PRIMARY KEY,
+                attempts INTEGER NOT NULL,
+                last_status TEXT NOT NULL,
+                first_failed_at TEXT NOT NULL,
+                last_failed_at TEXT NOT NULL
+            )
+            """
+        )
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def add(self, patient_id, status):
+        """ Record a failed attempt to pull a patient
+
+        Parameters:
+            patient_id (int): Patient ABPM test ID that failed
+            status (int or str): HTTP status of the failed request, or the kind of failure
+        """
+
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+
+        with self.connection:
+            self.connection.execute(
+                """
+                INSERT INTO failed_patients (patient_id, attempts, last_status, first_failed_at, last_failed_at)
+                VALUES (?, 1, ?, ?, ?)
+                ON CONFLICT (patient_id) DO UPDATE SET
+                    attempts = attempts + 1,
+                    last_status = excluded.last_status,
+                    last_failed_at = excluded.last_failed_at
+                """,
+                (patient_id, str(status), now, now)
+            )
+
+    def remove(self, patient_id):
+        """ Remove a patient from the queue once it was pulled
+
+        Parameters:
+            patient_id (int): Patient ABPM test ID pulled
+        """
+
+        with self.connection:
+            self.connection.execute("DELETE FROM failed_patients WHERE patient_id = ?", (patient_id,))
+
+    def patient_ids(self, max_attempts=None):
+        """ Patients waiting to be pulled again
+
+        Parameters:
+            max_attempts (int): Skip patients that already failed this many times, None keeps all
+
+        Returns:
+            list: Patient ABPM test IDs in ascending order
+        """
+
+        query = "SELECT patient_id FROM failed_patients"
+        parameters = ()
+
+        if max_attempts is not None:
+            query += " WHERE attempts < ?"
+            parameters = (max_attempts,)
+
+        return [row[0] for row in self.connection.execute(query + " ORDER BY patient_id", parameters)]
+
+    def entries(self):
+        """ Every queued patient
+
+        Returns:
+            list: Dicts with patient_id, attempts, last_status, first_failed_at and last_failed_at
+        """
+
+        cursor = self.connection.execute("SELECT * FROM failed_patients ORDER BY patient_id")
+        columns = [column[0] for column in cursor.description]
+
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def status_counts(self):
+        """ Number of queued patients by last error status
+
+        Returns:
+            dict: Last status to number of patients
+        """
+
+        return dict(self.connection.execute(
+            "SELECT last_status, COUNT(*) FROM failed_patients GROUP BY last_status ORDER BY last_status"
+        ))
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM failed_patients").fetchone()[0]
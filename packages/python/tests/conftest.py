@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules of packages/python are imported by name, like the notebooks do
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.pardir))
+
+# The client tests run against the stub API server of the benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.pardir, os.path.pardir, "benchmarks"))
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from api_client import AdaptiveConcurrency
+
+
+def record_window(concurrency, status=200, latency=0.01, errors=0):
+    """ Record a full window of requests, the first errors of them with status
+    """
+
+    requests = max(concurrency.window_size, int(concurrency.limit))
+    adjustments = [
+        concurrency.record(latency, status if index < errors else 200)
+        for index in range(requests)
+    ]
+
+    assert adjustments[:-1] == [None] * (requests - 1)
+
+    return adjustments[-1]
+
+
+@pytest.mark.parametrize("status", [429, 500, 503, "timeout"])
+def test_transient_errors_cut_the_limit(status):
+    concurrency = AdaptiveConcurrency(initial=40, backoff=0.5)
+
+    assert record_window(concurrency, status, errors=4) == "errors"
+    assert concurrency.limit == 20
+
+
+def test_other_errors_do_not_cut_the_limit():
+    concurrency = AdaptiveConcurrency(initial=20)
+
+    assert record_window(concurrency, 404, errors=20) == "increase"
+    assert concurrency.limit == 21
+
+
+def test_windows_without_congestion_increase_the_limit_additively():
+    concurrency = AdaptiveConcurrency(initial=10, increase=2)
+
+    for limit in (12, 14, 16):
+        assert record_window(concurrency) == "increase"
+        assert concurrency.limit == limit
+
+
+def test_slower_responses_reduce_the_limit_with_the_latency_gradient():
+    concurrency = AdaptiveConcurrency(initial=40, backoff=0.5, latency_tolerance=2.0)
+    record_window(concurrency, latency=0.01)
+    limit = concurrency.limit
+
+    assert record_window(concurrency, latency=0.03) == "latency"
+    assert limit * 0.5 <= concurrency.limit < limit
+
+
+def test_limit_stays_within_minimum_and_maximum():
+    concurrency = AdaptiveConcurrency(initial=3, minimum=2, maximum=4)
+
+    for _ in range(3):
+        record_window(concurrency)
+
+    assert concurrency.limit == 4
+
+    for _ in range(3):
+        record_window(concurrency, 503, errors=10)
+
+    assert concurrency.limit == 2
+
+
+def test_initial_limit_is_clamped_and_bounds_are_checked():
+    assert AdaptiveConcurrency(initial=500, maximum=50).limit == 50
+    assert AdaptiveConcurrency(initial=0, minimum=5).limit == 5
+
+    with pytest.raises(ValueError):
+        AdaptiveConcurrency(minimum=10, maximum=5)
+
+
+def test_acquire_waits_for_a_free_slot():
+    async def acquire_over_the_limit():
+        concurrency = AdaptiveConcurrency(initial=2, minimum=1)
+        await concurrency.acquire()
+        await concurrency.acquire()
+
+        waiting = asyncio.ensure_future(concurrency.acquire())
+        await asyncio.sleep(0)
+        blocked = not waiting.done()
+
+        concurrency.release()
+        await asyncio.wait_for(waiting, 1)
+
+        return blocked, concurrency.in_flight
+
+    assert asyncio.run(acquire_over_the_limit()) == (True, 2)
@@ -0,0 +1,104 @@
+import math
+
+import numpy
+import pandas
+
+from aggregate_hemodynamic_parameters import aggregate_dataset, aggregate_studies, night_mask
+
+
+def hours(*values):
+    return numpy.array(values, dtype=float) * 3600
+
+
+def study(patient_id, readings, start_night="22:00:00", end_night="06:00:00"):
+    """ Base dataset rows of a study, readings are (time, systolic) pairs
+    """
+
+    return pandas.DataFrame({
+        "patient_id": patient_id,
+        "birth_date": "1960-05-01",
+        "measure_date_time": [f"2019-06-01 {time}" for time, _ in readings],
+        "weight": 80,
+        "height": 175,
+        "sistolic": [systolic for _, systolic in readings],
+        "diastolic": 70,
+        "heart_reate": 65,
+        "start_night": start_night,
+        "end_night": end_night,
+    })
+
+
+def test_night_crossing_midnight():
+    night, known = night_mask(hours(21.5, 22, 23, 0, 5.9, 6, 12), hours(22), hours(6))
+
+    assert night.tolist() == [False, True, True, True, True, False, False]
+    assert known.all()
+
+
+def test_night_after_midnight():
+    night, _ = night_mask(hours(23, 0.5, 1, 6.9, 7, 12), hours(1), hours(7))
+
+    assert night.tolist() == [False, False, True, True, False, False]
+
+
+def test_unknown_night_window():
+    night, known = night_mask(hours(23, numpy.nan), numpy.array([numpy.nan, 3600.0]), hours(6, 6))
+
+    assert night.tolist() == [False, False]
+    assert known.tolist() == [False, False]
+
+
+def test_day_and_night_means_and_dipping_ratio():
+    dataset_df = pandas.concat([
+        study(1, [("10:00:00", 140), ("14:00:00", 160), ("23:00:00", 120), ("03:00:00", 110)]),
+        study(2, [("00:30:00", 150), ("02:00:00", 100), ("08:00:00", 130)], "01:00:00", "07:00:00"),
+    ])
+
+    summary_df = aggregate_studies(dataset_df, ["cardiac_output"]).set_index("patient_id")
+
+    assert summary_df.loc[1, "sistolic_day"] == 150
+    assert summary_df.loc[1, "sistolic_night"] == 115
+    assert math.isclose(summary_df.loc[1, "sistolic_dipping_ratio"], 115 / 150)
+    assert summary_df.loc[2, ["day_count", "night_count", "24h_count"]].tolist() == [2, 1, 3]
+    assert summary_df.loc[2, "sistolic_day"] == 140
+    assert summary_df.loc[2, "sistolic_night"] == 100
+
+
+def test_readings_with_unknown_night_only_count_in_24h():
+    dataset_df = study(1, [("10:00:00", 140), ("23:00:00", 120)], start_night=None)
+
+    summary_df = aggregate_studies(dataset_df, ["cardiac_output"])
+
+    assert summary_df.loc[0, ["24h_count", "day_count", "night_count"]].tolist() == [2, 0, 0]
+    assert summary_df.loc[0, "sistolic_24h"] == 130
+    assert numpy.isnan(summary_df.loc[0, "sistolic_dipping_ratio"])
+
+
+def test_malformed_cells_are_left_out():
+    dataset_df = study(1, [("10:00:00", 140), ("11:00:00", "Err"), ("23:00:00", 120)])
+    dataset_df.loc[2, "birth_date"] = "not-a-date"
+
+    summary_df = aggregate_studies(dataset_df, ["cardiac_output"])
+
+    assert summary_df.loc[0, ["readings", "24h_count", "night_count"]].tolist() == [3, 1, 0]
+    assert summary_df.loc[0, "sistolic_24h"] == 140
+
+
+def test_studies_split_across_chunks_are_merged(tmp_path):
+    dataset_df = pandas.concat([
+        study(1, [("10:00:00", 140), ("14:00:00", 160), ("23:00:00", 120)]),
+        study(2, [("09:00:00", 130), ("12:00:00", 125), ("01:00:00", 105), ("04:00:00", 100)]),
+        study(3, [("13:00:00", 120)]),
+    ])
+    input_path = str(tmp_path / "base.csv")
+    output_path = str(tmp_path / "summary.csv")
+    dataset_df.to_csv(input_path, index=False)
+
+    study_count = aggregate_dataset(input_path, output_path, ["cardiac_output"], chunk_size=2, workers=1)
+
+    summary_df = pandas.read_csv(output_path)
+    expected_df = aggregate_studies(dataset_df, ["cardiac_output"])
+
+    assert study_count == 3
+    assert summary_df["readings"].tolist() == [3, 4, 1]
+    pandas.testing.assert_frame_equal(summary_df, expected_df, check_dtype=False)
@@ -0,0 +1,293 @@
+import json
+import time
+import asyncio
+import datetime
+
+import aiohttp
+import pytest
+
+from api_client import (
+    KNOWN_GAP,
+    ApiClient,
+    AuthenticationError,
+    RetryPolicy,
+    TokenBucket,
+    get_complete_api_data_safe,
+    pull_api_data,
+    pull_patient_ids,
+)
+from known_gaps import KnownGaps
+from pull_metrics import PullMetrics
+from stub_api_server import StubApiServer
+from synthetic_patients import generate_patient
+
+
+class ResponseError(Exception):
+    def __init__(self, headers):
+        self.headers = headers
+
+
+@pytest.mark.parametrize("status", [408, 429, 500, 502, 503, 504, "timeout", "connection"])
+def test_transient_failures_are_retried(status):
+    assert RetryPolicy().is_transient(status)
+
+
+@pytest.mark.parametrize("status", [400, 401, 404, "invalid-response"])
+def test_other_failures_are_not_retried(status):
+    assert not RetryPolicy().is_transient(status)
+
+
+def test_backoff_grows_up_to_the_maximum_delay():
+    retry_policy = RetryPolicy(base_delay=0.5, max_delay=4)
+
+    for attempt, maximum in [(1, 0.5), (2, 1), (3, 2), (4, 4), (10, 4)]:
+        delays = [retry_policy.delay(attempt) for _ in range(200)]
+
+        assert all(0 <= delay <= maximum for delay in delays)
+        assert max(delays) > maximum / 2
+
+
+def test_retry_after_is_honoured_up_to_the_maximum_delay():
+    retry_policy = RetryPolicy(base_delay=0.01, max_delay=5)
+
+    assert retry_policy.delay(1, ResponseError({"Retry-After": "3"})) == 3
+    assert retry_policy.delay(1, ResponseError({"Retry-After": "120"})) == 5
+    assert retry_policy.delay(1, ResponseError({"Retry-After": "soon"})) <= 0.01
+
+
+def test_token_bucket_allows_a_burst_then_the_rate():
+    async def acquire(bucket, count):
+        start_time = time.monotonic()
+
+        for _ in range(count):
+            await bucket.acquire()
+
+        return time.monotonic() - start_time
+
+    async def burst_then_rate():
+        bucket = TokenBucket(rate=50, capacity=10)
+
+        return await acquire(bucket, 10), await acquire(bucket, 10)
+
+    burst_seconds, rate_seconds = asyncio.run(burst_then_rate())
+
+    assert burst_seconds < 0.05
+    # The next 10 requests wait for new tokens at 50 per second
+    assert 0.15 < rate_seconds < 0.5
+
+
+class FakeClient:
+    """ Client of a fake API where the given patients exist with a start date,
+    the failing patients answer 503 and every other ID is empty
+    """
+
+    def __init__(self, start_dates, failing_patient_ids=()):
+        self.start_dates = start_dates
+        self.failing_patient_ids = set(failing_patient_ids)
+        self.requests = []
+        self.metrics = PullMetrics()
+
+    async def get_complete_api_data(self, patient_id):
+        self.requests.append(patient_id)
+
+        # Later IDs often complete first, like concurrent requests do
+        await asyncio.sleep(0.001 * (3 - patient_id % 3))
+
+        if patient_id in self.failing_patient_ids:
+            raise aiohttp.ClientResponseError(None, (), status=503)
+
+        if patient_id not in self.start_dates:
+            return {"id": patient_id, "data": [], "measure": [], "drugs": [], "meta_data": []}
+
+        return {
+            "id": patient_id,
+            "data": [{"fecha_dt": f"{self.start_dates[patient_id]} 08:00:00"}],
+            "measure": [],
+            "drugs": [],
+            "meta_data": [],
+        }
+
+
+def pull(client, start_patient_id=1, max_consecutive_error=3, **arguments):
+    errors = []
+    gaps = []
+
+    async def collect():
+        patient_data_stream = pull_api_data(
+            client,
+            start_patient_id,
+            datetime.datetime(2020, 1, 1),
+            concurrent_workers=4,
+            max_consecutive_error=max_consecutive_error,
+            on_error=lambda patient_id, status: errors.append((patient_id, status)),
+            on_gap=gaps.extend,
+            **arguments
+        )
+
+        return [patient_data["id"] async for patient_data in patient_data_stream]
+
+    return asyncio.run(collect()), errors, gaps
+
+
+def test_pull_yields_in_patient_id_order():
+    client = FakeClient({patient_id: "2019-06-01" for patient_id in range(1, 30)})
+
+    patient_ids, errors, gaps = pull(client)
+
+    assert patient_ids == list(range(1, 30))
+    assert errors == gaps == []
+
+
+def test_pull_only_reports_errors_below_a_found_patient():
+    client = FakeClient(
+        {patient_id: "2019-06-01" for patient_id in [1, 2, 4, 5]},
+        failing_patient_ids=[3, 7]
+    )
+
+    patient_ids, errors, gaps = pull(client)
+
+    assert patient_ids == [1, 2, 4, 5]
+    # 7 is after the last patient found, the next pull starts there again
+    assert errors == [(3, 503)]
+    assert gaps == []
+
+
+def test_pull_discards_the_results_past_the_stop():
+    start_dates = {patient_id: "2019-06-01" for patient_id in [1, 2, 3, 4]}
+    start_dates.update({6: "2020-02-01", 9: "2020-02-02"})
+    client = FakeClient(start_dates, failing_patient_ids=[5, 7, 8])
+
+    patient_ids, errors, gaps = pull(client, max_consecutive_error=10)
+
+    assert patient_ids == [1, 2, 3, 4]
+    assert errors == []
+
+
+def test_a_second_pull_skips_the_known_gaps(tmp_path):
+    start_dates = {patient_id: "2019-06-01" for patient_id in [1, 4, 7, 10]}
+    start_dates[13] = "2020-02-01"
+    client = FakeClient(start_dates)
+
+    patient_ids, errors, gaps = pull(client)
+
+    # The gaps before the patient that stops the pull are recorded too
+    assert patient_ids == [1, 4, 7, 10]
+    assert gaps == [2, 3, 5, 6, 8, 9, 11, 12]
+
+    known_gaps = KnownGaps(str(tmp_path / "known-gaps.bitmap"))
+    for patient_id in gaps:
+        known_gaps.add(patient_id)
+
+    first_requests = client.requests
+    client.requests = []
+
+    patient_ids, errors, gaps = pull(client, known_gaps=known_gaps)
+
+    assert patient_ids == [1, 4, 7, 10]
+    assert gaps == []
+    # Requests fetched ahead of the stop, past 13, are the same in both pulls
+    assert sorted(patient_id for patient_id in client.requests if patient_id <= 13) == [1, 4, 7, 10, 13]
+    assert len(client.requests) < len(first_requests)
+
+
+def test_pull_patient_ids_skips_the_known_gaps(tmp_path):
+    client = FakeClient({patient_id: "2019-06-01" for patient_id in [2, 5]})
+    known_gaps = KnownGaps(str(tmp_path / "known-gaps.bitmap"))
+    known_gaps.add(3)
+
+    async def collect():
+        return dict([result async for result in pull_patient_ids(client, [2, 3, 5], 2, known_gaps=known_gaps)])
+
+    results = asyncio.run(collect())
+
+    assert results[3] is KNOWN_GAP
+    assert results[2]["id"] == 2 and results[5]["id"] == 5
+    assert sorted(client.requests) == [2, 5]
+    assert client.metrics.counter_total("pull_patients_total", result="known-gap") == 1
+
+
+@pytest.fixture(scope="module")
+def stub_api():
+    with StubApiServer(patient_count=20) as server:
+        yield server
+
+
+def test_a_burst_of_rejected_tokens_logs_in_once(stub_api):
+    async def burst():
+        async with ApiClient(stub_api.url, "user", "password", max_in_flight=50) as client:
+            await client.get_api_data(client.endpoint_urls["data"], 1)
+            logins, requests = stub_api.stats["login"], stub_api.stats["requests"]
+
+            # Every request of the burst is rejected with the token issued before
+            stub_api.app["auth"]["token"] = "rotated-token"
+            responses = await asyncio.gather(*[
+                client.get_api_data(client.endpoint_urls["data"], patient_id) for patient_id in range(1, 21)
+            ])
+
+            return logins, stub_api.stats["requests"] - requests, responses, client.token_manager.login_count
+
+    logins, requests, responses, login_count = asyncio.run(burst())
+
+    assert logins == 1
+    assert requests == 2 * 20
+    assert stub_api.stats["login"] == login_count == 2
+    assert all(response for response in responses)
+
+
+def test_a_login_without_token_is_an_auth_error(monkeypatch):
+    async def empty_response(*arguments, **keyword_arguments):
+        return None
+
+    async def login():
+        async with ApiClient("http://127.0.0.1:9/", "user", "password") as client:
+            monkeypatch.setattr(client, "request_json", empty_response)
+            errors = []
+
+            with pytest.raises(AuthenticationError):
+                await client.get_api_token()
+
+            patient_data = await get_complete_api_data_safe(client, 1, lambda patient_id, status: errors.append(status))
+
+            return patient_data, errors
+
+    patient_data, errors = asyncio.run(login())
+
+    assert patient_data is None
+    assert errors == ["auth"]
+
+
+def test_pooled_client_pulls_every_patient_in_order(stub_api):
+    async def pull_stub():
+        async with ApiClient(stub_api.url, "user", "password", max_in_flight=8) as client:
+            connection_limit = client.session.connector.limit
+            patient_data_stream = pull_api_data(
+                client,
+                1,
+                datetime.datetime(2100, 1, 1),
+                concurrent_workers=4,
+                max_consecutive_error=5
+            )
+
+            return [patient_data async for patient_data in patient_data_stream], client, connection_limit
+
+    logins = stub_api.stats["login"]
+    patients, client, connection_limit = asyncio.run(pull_stub())
+
+    assert [patient_data["id"] for patient_data in patients] == list(range(1, 21))
+    assert patients[6] == json.loads(json.dumps(generate_patient(7)))
+    assert stub_api.stats["login"] == logins + 1
+    assert connection_limit == 8
+    assert client.metrics.counter_total("api_requests_total", status=200) >= 4 * 20
+    assert client.metrics.counter_total("api_requests_total", endpoint="MAPA") >= 20
+
+
+def test_probe_endpoint_skips_the_other_endpoints_of_missing_patients(stub_api):
+    async def pull_missing():
+        async with ApiClient(stub_api.url, "user", "password", probe_key="data") as client:
+            return await client.get_complete_api_data(500)
+
+    requests = stub_api.stats["requests"]
+    patient_data = asyncio.run(pull_missing())
+
+    assert patient_data == {"id": 500, "data": [], "measure": [], "drugs": [], "meta_data": []}
+    assert stub_api.stats["requests"] == requests + 1
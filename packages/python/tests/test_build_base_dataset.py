@@ -0,0 +1,83 @@
+import os
+import glob
+import json
+
+import pandas
+import pytest
+
+from patient_archive import PatientArchive
+from run_benchmarks import run_notebook
+from synthetic_patients import generate_archive, generate_patient
+
+# The notebook imports seaborn to plot the dataset
+pytest.importorskip("seaborn")
+
+
+def build(api_data_path, base_dataset_path, **parameters):
+    run_notebook("build_base_dataset.py", dict(
+        parameters,
+        api_data_path=api_data_path,
+        base_dataset_path=base_dataset_path,
+        max_patients_in_memory=parameters.get("max_patients_in_memory", 4),
+    ))
+
+
+def read_dataset(path):
+    dataset_df = pandas.read_parquet(path) if os.path.isdir(path) or path.endswith(".parquet") else pandas.read_csv(path)
+
+    return dataset_df.sort_values(["patient_id", "measure_date_time"]).reset_index(drop=True)
+
+
+def test_streaming_build_matches_the_in_memory_build(tmp_path):
+    api_data_path = str(tmp_path / "api-data")
+    generate_archive(api_data_path, 11, measure_count=5)
+
+    build(api_data_path, str(tmp_path / "dataset.csv"))
+    build(api_data_path, str(tmp_path / "streaming.csv"), streaming=True, ingestion_workers=2)
+    build(api_data_path, str(tmp_path / "streaming.parquet"), streaming=True, output_format="parquet")
+
+    dataset_df = read_dataset(str(tmp_path / "dataset.csv"))
+    streaming_df = read_dataset(str(tmp_path / "streaming.csv"))
+    parquet_df = read_dataset(str(tmp_path / "streaming.parquet"))
+
+    assert len(dataset_df) == 11 * 5
+    pandas.testing.assert_frame_equal(streaming_df, dataset_df)
+    assert parquet_df["patient_id"].tolist() == dataset_df["patient_id"].tolist()
+    assert parquet_df["sistolic"].tolist() == dataset_df["sistolic"].astype(float).tolist()
+
+
+def test_incremental_build_only_rebuilds_the_changed_patients(tmp_path):
+    api_data_path = str(tmp_path / "api-data")
+    dataset_path = str(tmp_path / "dataset")
+    generate_archive(api_data_path, 10, measure_count=5)
+
+    build(api_data_path, dataset_path, incremental=True, output_format="parquet")
+    parts = set(glob.glob(os.path.join(dataset_path, "part-*.parquet")))
+
+    # Patient 3 is pulled again with other readings and patient 11 is new
+    with PatientArchive(api_data_path) as archive:
+        changed_patient = generate_patient(3, 7, seed=1)
+        archive.append(changed_patient)
+        archive.append(generate_patient(11, 5))
+
+    build(api_data_path, dataset_path, incremental=True, output_format="parquet")
+    build(api_data_path, dataset_path, incremental=True, output_format="parquet")
+
+    dataset_df = read_dataset(dataset_path)
+    with open(os.path.join(dataset_path, "_manifest.json")) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    referenced_parts = {entry["partition"] for entry in manifest.values()}
+    current_parts = {os.path.basename(part) for part in glob.glob(os.path.join(dataset_path, "part-*.parquet"))}
+
+    row_counts = {patient_id: 5 for patient_id in range(1, 12)}
+    row_counts[3] = 7
+
+    assert dataset_df.groupby("patient_id").size().to_dict() == row_counts
+    assert dataset_df[dataset_df["patient_id"] == 3]["sistolic"].tolist() == [
+        measure["sistolica"] for measure in changed_patient["data"]
+    ]
+    assert sorted(manifest, key=int) == [str(patient_id) for patient_id in range(1, 12)]
+    assert current_parts == referenced_parts
+    # The parts of the unchanged patients are kept
+    assert parts <= {os.path.join(dataset_path, part) for part in current_parts}
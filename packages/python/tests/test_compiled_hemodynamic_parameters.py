@@ -0,0 +1,57 @@
+import numpy
+import pytest
+
+import compiled_hemodynamic_parameters
+import vectorized_hemodynamic_parameters
+from vectorized_hemodynamic_parameters import PARAMETERS
+
+
+def readings(row_count=100, seed=3):
+    generator = numpy.random.default_rng(seed)
+
+    return (
+        generator.uniform(18, 90, row_count),
+        generator.uniform(40, 150, row_count),
+        generator.uniform(1.4, 2.1, row_count),
+        generator.uniform(100, 190, row_count),
+        generator.uniform(50, 95, row_count),
+        generator.uniform(40, 140, row_count),
+        0.65,
+    )
+
+
+def test_kernel_formulas_match_the_scalar_functions():
+    # Without Numba the kernel runs as plain Python
+    differences = compiled_hemodynamic_parameters.check_equivalence(row_count=200)
+
+    assert set(differences) == set(PARAMETERS)
+
+
+def test_compiled_kernel_matches_the_scalar_functions():
+    pytest.importorskip("numba")
+
+    assert compiled_hemodynamic_parameters.BACKEND == "numba"
+    compiled_hemodynamic_parameters.check_equivalence(row_count=2000, seed=1)
+
+
+def test_fallback_uses_the_vectorized_module(monkeypatch):
+    monkeypatch.setattr(compiled_hemodynamic_parameters, "numba", None)
+
+    results = compiled_hemodynamic_parameters.compute_all(*readings())
+    expected = vectorized_hemodynamic_parameters.compute_all(*readings())
+
+    for parameter in PARAMETERS:
+        numpy.testing.assert_array_equal(results[parameter], expected[parameter])
+
+    subset = compiled_hemodynamic_parameters.compute(["cardiac_output"], *readings())
+
+    assert list(subset) == ["cardiac_output"]
+    numpy.testing.assert_array_equal(subset["cardiac_output"], expected["cardiac_output"])
+
+    with pytest.raises(ValueError):
+        compiled_hemodynamic_parameters.compute(["heart_rate_variability"], *readings())
+
+
+@pytest.mark.skipif(compiled_hemodynamic_parameters.BACKEND == "numba", reason="Numba is installed")
+def test_backend_without_numba():
+    assert compiled_hemodynamic_parameters.BACKEND == "numpy"
@@ -0,0 +1,60 @@
+import math
+
+import numpy
+import pandas
+
+import hemodynamic_parameters
+import compute_hemodynamic_parameters
+from compute_hemodynamic_parameters import compute_chunk
+
+
+def chunk(**columns):
+    rows = {
+        "patient_id": [1, 2, 3],
+        "birth_date": ["1960-05-01", "1970-01-01", "1980-07-15"],
+        "measure_date_time": ["2019-06-01 08:00:00", "2019-06-01 09:00:00", "2019-06-01 10:00:00"],
+        "weight": [80, 70, 60],
+        "height": [175, 165, 160],
+        "sistolic": [130, 120, 110],
+        "diastolic": [80, 75, 70],
+        "heart_reate": [70, 65, 80],
+    }
+    rows.update(columns)
+
+    return pandas.DataFrame(rows)
+
+
+def test_malformed_rows_get_nan_parameters():
+    chunk_df = chunk(
+        birth_date=["not-a-date", "1970-01-01", "1980-07-15"],
+        sistolic=[130, "Err", 110],
+    )
+
+    result_df, reason_counts = compute_chunk(chunk_df, ("cardiac_output", "body_mass_index"), validity_column="valid")
+
+    assert result_df["valid"].tolist() == [False, False, True]
+    assert result_df["cardiac_output"].isna().tolist() == [True, True, False]
+    assert reason_counts["missing_age"] == 1
+    assert reason_counts["missing_systolic_blood_pressure"] == 1
+    assert math.isclose(
+        result_df["body_mass_index"][2],
+        hemodynamic_parameters.body_mass_index(60, 1.6),
+        rel_tol=1e-12
+    )
+
+
+def test_command_line_counts_the_malformed_rows(tmp_path, capsys):
+    input_path = str(tmp_path / "base.csv")
+    output_path = str(tmp_path / "parameters.csv")
+    chunk(heart_reate=[70, "", "n/a"]).to_csv(input_path, index=False)
+
+    row_count = compute_hemodynamic_parameters.main([
+        input_path, output_path, "--parameters", "cardiac_output", "--workers", "1", "--chunk-size", "2",
+    ])
+
+    result_df = pandas.read_csv(output_path)
+
+    assert row_count == 3
+    assert result_df["cardiac_output"].notna().tolist() == [True, False, False]
+    assert "missing_heart_rate: 2" in capsys.readouterr().err
+    assert numpy.isfinite(result_df["cardiac_output"][0])
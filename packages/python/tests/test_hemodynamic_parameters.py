@@ -0,0 +1,105 @@
+import inspect
+import itertools
+
+import pytest
+
+import hemodynamic_parameters
+from vectorized_hemodynamic_parameters import PARAMETERS
+
+
+READINGS = [(128, 82, 71), (141, 90, 64), (117, 75, 88), (128, 82, 71)]
+
+# Patients (age, weight, height) and readings (systolic, diastolic, heart rate, ejection fraction)
+PATIENT_GRID = list(itertools.product([20, 45, 80], [50, 90], [1.5, 1.9]))
+READING_GRID = list(itertools.product([(110, 70), (150, 95), (190, 60), (101, 99)], [45, 75, 130], [0.65, 0.4]))
+
+
+@pytest.fixture
+def cache():
+    hemodynamic_parameters.enable_cache()
+    yield
+    hemodynamic_parameters.disable_cache()
+
+
+def panel(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate, left_ventricular_ejection_fraction=0.65):
+    """ Every parameter computed with its own scalar function
+    """
+
+    values = dict(
+        age=age,
+        weight=weight,
+        height=height,
+        systolic_blood_pressure=systolic_blood_pressure,
+        diastolic_blood_pressure=diastolic_blood_pressure,
+        heart_rate=heart_rate,
+        left_ventricular_ejection_fraction=left_ventricular_ejection_fraction,
+    )
+    results = {}
+
+    for name in PARAMETERS:
+        function = getattr(hemodynamic_parameters, name)
+        results[name] = function(*[values[argument] for argument in inspect.signature(function).parameters if argument in values])
+
+    return results
+
+
+@pytest.mark.parametrize("age, weight, height", PATIENT_GRID)
+def test_compute_reading_matches_the_scalar_functions(age, weight, height):
+    context = hemodynamic_parameters.PatientContext(age, weight, height)
+
+    for (systolic_blood_pressure, diastolic_blood_pressure), heart_rate, ejection_fraction in READING_GRID:
+        reading = (systolic_blood_pressure, diastolic_blood_pressure, heart_rate, ejection_fraction)
+
+        assert context.compute_reading(*reading) == panel(age, weight, height, *reading), reading
+
+
+def test_cached_formulas_give_the_same_numbers():
+    expected = [panel(54, 72.5, 1.68, *reading) for reading in READINGS]
+
+    hemodynamic_parameters.enable_cache()
+    try:
+        assert [panel(54, 72.5, 1.68, *reading) for reading in READINGS] == expected
+    finally:
+        hemodynamic_parameters.disable_cache()
+
+
+def test_new_readings_reuse_the_patient_terms(cache):
+    for reading in READINGS[:3]:
+        hemodynamic_parameters.stroke_volume(54, 72.5, 1.68, *reading)
+
+    terms = hemodynamic_parameters.cache_info()["terms"]
+
+    assert terms["misses"] == 1
+    assert terms["hits"] == 2
+
+
+def test_repeated_inputs_are_answered_from_the_results_cache(cache):
+    hemodynamic_parameters.compute_all(54, 72.5, 1.68, 128, 82, 71)
+    hits = hemodynamic_parameters.cache_info()["results"]["hits"]
+    hemodynamic_parameters.compute_all(54, 72.5, 1.68, 128, 82, 71)
+
+    assert hemodynamic_parameters.cache_info()["results"]["hits"] == hits + 1
+
+
+def test_disable_cache_restores_the_uncached_functions(cache):
+    hemodynamic_parameters.disable_cache()
+
+    assert hemodynamic_parameters.cache_info() == {}
+    assert hemodynamic_parameters.characteristic_impedance is hemodynamic_parameters._UNCACHED_FUNCTIONS["characteristic_impedance"]
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_compute_all_matches_the_scalar_functions(cached):
+    expected = {
+        (patient, reading): panel(*patient, *reading[0], *reading[1:])
+        for patient in PATIENT_GRID
+        for reading in READING_GRID
+    }
+
+    if cached:
+        hemodynamic_parameters.enable_cache()
+    try:
+        for (patient, reading), parameters in expected.items():
+            assert hemodynamic_parameters.compute_all(*patient, *reading[0], *reading[1:]) == parameters, (patient, reading)
+    finally:
+        hemodynamic_parameters.disable_cache()
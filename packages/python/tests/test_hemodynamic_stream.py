@@ -0,0 +1,95 @@
+import math
+
+import numpy
+import pytest
+
+import vectorized_hemodynamic_parameters
+from hemodynamic_stream import ParameterStream, PatientStream, RollingWindow, RunningStatistics
+
+
+def test_single_updates_match_numpy():
+    values = numpy.random.default_rng(0).normal(100, 15, 500)
+    statistics = RunningStatistics()
+
+    for value in values:
+        statistics.update(value)
+
+    assert statistics.count == 500
+    assert math.isclose(statistics.mean, numpy.mean(values), rel_tol=1e-12)
+    assert math.isclose(statistics.variance, numpy.var(values, ddof=1), rel_tol=1e-10)
+    assert statistics.minimum == numpy.min(values)
+    assert statistics.maximum == numpy.max(values)
+
+
+def test_merged_batches_match_a_batch_computation():
+    values = numpy.random.default_rng(1).normal(1e6, 3, 1000)
+    statistics = RunningStatistics()
+
+    statistics.update(float(values[0]))
+    for batch in numpy.split(values[1:], [10, 11, 400, 999]):
+        statistics.update_batch(batch)
+
+    assert statistics.count == 1000
+    assert math.isclose(statistics.mean, numpy.mean(values), rel_tol=1e-12)
+    assert math.isclose(statistics.variance, numpy.var(values, ddof=1), rel_tol=1e-8)
+    assert statistics.minimum == numpy.min(values)
+    assert statistics.maximum == numpy.max(values)
+
+
+def test_variance_needs_two_values():
+    statistics = RunningStatistics()
+    statistics.update(3.0)
+
+    assert math.isnan(statistics.variance)
+
+
+def test_rolling_window_keeps_the_last_values():
+    window = RollingWindow(3)
+
+    for value in [1.0, 2.0, 3.0, 4.0]:
+        window.update(value)
+    assert window.mean == 3.0
+
+    window.update_batch(numpy.array([10.0, 20.0, 30.0, 40.0]))
+    assert list(window.values) == [20.0, 30.0, 40.0]
+    assert window.mean == 30.0
+
+    with pytest.raises(ValueError):
+        RollingWindow(0)
+
+
+def test_patient_stream_matches_the_vectorized_panel():
+    generator = numpy.random.default_rng(2)
+    systolic_blood_pressure = generator.uniform(100, 170, 60).round()
+    diastolic_blood_pressure = (systolic_blood_pressure * generator.uniform(0.55, 0.7, 60)).round()
+    heart_rate = generator.uniform(50, 100, 60).round()
+    expected = vectorized_hemodynamic_parameters.compute_all(54, 72.5, 1.68, systolic_blood_pressure, diastolic_blood_pressure, heart_rate)
+
+    single = PatientStream(54, 72.5, 1.68, window_size=5)
+    for reading in zip(systolic_blood_pressure[:25], diastolic_blood_pressure[:25], heart_rate[:25]):
+        single.add_reading(*[float(value) for value in reading])
+    single.add_readings(systolic_blood_pressure[25:], diastolic_blood_pressure[25:], heart_rate[25:])
+
+    batch = PatientStream(54, 72.5, 1.68, window_size=5)
+    batch.add_readings(systolic_blood_pressure, diastolic_blood_pressure, heart_rate)
+
+    for stream in (single, batch):
+        assert stream.reading_count == 60 and stream.rejected_count == 0
+
+        for parameter, summary in stream.summary().items():
+            values = numpy.broadcast_to(expected[parameter], (60,))
+
+            assert math.isclose(summary["mean"], numpy.mean(values), rel_tol=1e-9)
+            assert math.isclose(summary["variance"], numpy.var(values, ddof=1), abs_tol=1e-12)
+            assert math.isclose(summary["rolling_mean"], numpy.mean(values[-5:]), rel_tol=1e-9)
+
+
+def test_invalid_readings_are_rejected():
+    streams = ParameterStream(parameters=["stroke_volume"])
+    streams.add_patient(7, 54, 72.5, 1.68)
+
+    assert streams.add_reading(7, 80, 120, 70) is None
+    assert streams.add_readings(7, numpy.array([128.0, 400.0]), numpy.array([82.0, 80.0]), numpy.array([71.0, 70.0])) == 1
+    assert streams[7].reading_count == 3
+    assert streams[7].rejected_count == 2
+    assert streams.summary(7)["stroke_volume"]["count"] == 1
@@ -0,0 +1,70 @@
+import numpy
+
+import hemodynamic_validation
+
+
+def validate(**inputs):
+    arguments = dict(
+        age=50, weight=70, height=1.7, systolic_blood_pressure=120, diastolic_blood_pressure=80, heart_rate=60
+    )
+    arguments.update(inputs)
+
+    return hemodynamic_validation.validate(**arguments)
+
+
+def failed_reasons(validation, row=0):
+    return sorted(reason for reason, mask in validation.reasons.items() if numpy.atleast_1d(mask)[row])
+
+
+def test_valid_inputs():
+    validation = validate()
+
+    assert validation.valid
+    assert failed_reasons(validation) == []
+
+
+def test_zero_heart_rate_is_out_of_range():
+    validation = validate(heart_rate=0)
+
+    assert not validation.valid
+    assert failed_reasons(validation) == ["heart_rate_out_of_range"]
+
+
+def test_systolic_must_be_above_diastolic():
+    validation = validate(systolic_blood_pressure=numpy.array([80, 79, 81]))
+
+    assert validation.valid.tolist() == [False, False, True]
+    assert validation.reasons["systolic_not_above_diastolic"].tolist() == [True, True, False]
+
+
+def test_zero_height_is_out_of_range():
+    assert failed_reasons(validate(height=0)) == ["height_out_of_range"]
+
+
+def test_nan_is_missing_and_not_out_of_range():
+    assert failed_reasons(validate(weight=numpy.nan)) == ["missing_weight"]
+    assert failed_reasons(validate(age=numpy.inf)) == ["missing_age"]
+
+
+def test_range_bounds_are_inclusive():
+    validation = validate(age=numpy.array([0, 120, 121, -1]))
+
+    assert validation.valid.tolist() == [True, True, False, False]
+
+
+def test_compute_counts_every_reason_of_a_row():
+    result = hemodynamic_validation.compute(
+        ["cardiac_output"],
+        numpy.array([50, 50]),
+        numpy.array([70, 1000]),
+        1.7,
+        numpy.array([120, 70]),
+        80,
+        60
+    )
+
+    assert result.valid.tolist() == [True, False]
+    assert numpy.isnan(result.values["cardiac_output"][1])
+    assert result.reason_counts["weight_out_of_range"] == 1
+    assert result.reason_counts["systolic_not_above_diastolic"] == 1
+    assert result.reason_counts["non_finite_result"] == 0
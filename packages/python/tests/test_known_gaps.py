@@ -0,0 +1,30 @@
+from known_gaps import KnownGaps
+
+
+def test_gaps_survive_saving_and_reopening(tmp_path):
+    path = str(tmp_path / "known-gaps.bitmap")
+
+    known_gaps = KnownGaps(path)
+    for patient_id in [0, 7, 8, 1000, 7]:
+        known_gaps.add(patient_id)
+    known_gaps.save()
+
+    known_gaps = KnownGaps(path)
+
+    assert len(known_gaps) == 4
+    assert list(known_gaps) == [0, 7, 8, 1000]
+    assert 1000 in known_gaps
+    assert 9 not in known_gaps
+    assert 100000 not in known_gaps
+
+
+def test_discard_forgets_a_gap(tmp_path):
+    known_gaps = KnownGaps(str(tmp_path / "known-gaps.bitmap"))
+    known_gaps.add(12)
+    known_gaps.add(13)
+
+    known_gaps.discard(12)
+    known_gaps.discard(99)
+
+    assert list(known_gaps) == [13]
+    assert 12 not in known_gaps
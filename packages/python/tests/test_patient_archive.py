@@ -0,0 +1,63 @@
+import os
+import glob
+
+from patient_archive import PatientArchive, read_shard_index
+
+
+def patient(patient_id, systolic=120):
+    return {"id": patient_id, "data": [{"sistolica": systolic}], "measure": [], "drugs": [], "meta_data": []}
+
+
+def test_patients_round_trip(tmp_path):
+    path = str(tmp_path / "archive")
+
+    with PatientArchive(path) as archive:
+        for patient_id in (3, 1, 2):
+            archive.append(patient(patient_id))
+
+        assert archive.read(1) == patient(1)
+
+    archive = PatientArchive(path)
+
+    assert len(archive) == 3
+    assert 2 in archive and 4 not in archive
+    assert archive.max_patient_id() == 3
+    assert [archive.read(patient_id) for patient_id in (1, 2, 3)] == [patient(1), patient(2), patient(3)]
+
+
+def test_later_shards_override_earlier_ones(tmp_path):
+    path = str(tmp_path / "archive")
+
+    with PatientArchive(path) as archive:
+        archive.append(patient(1, 120))
+        archive.append(patient(2, 130))
+
+    with PatientArchive(path) as archive:
+        archive.append(patient(1, 140))
+
+    archive = PatientArchive(path)
+
+    assert len(glob.glob(os.path.join(path, "shard-*.idx"))) == 2
+    assert archive.read(1) == patient(1, 140)
+    assert archive.read(2) == patient(2, 130)
+
+
+def test_half_written_last_entry_is_dropped(tmp_path):
+    path = str(tmp_path / "archive")
+
+    with PatientArchive(path) as archive:
+        archive.append(patient(1))
+        archive.append(patient(2))
+
+    index_path, = glob.glob(os.path.join(path, "shard-*.idx"))
+    shard_path = index_path[:-len(".idx")] + ".jsonl.gz"
+
+    # A crash after writing part of the data of patient 2, and part of the index of patient 3
+    with open(shard_path, "r+b") as shard_file:
+        shard_file.truncate(os.path.getsize(shard_path) - 5)
+
+    with open(index_path, "a") as index_file:
+        index_file.write("3\t10")
+
+    assert [location.patient_id for location in read_shard_index(index_path)] == [1]
+    assert PatientArchive(path).read(1) == patient(1)
@@ -0,0 +1,69 @@
+import os
+import json
+
+import pytest
+
+import pull_checkpoint
+from pull_checkpoint import PullCheckpoint
+
+
+def test_new_checkpoint_starts_at_the_first_patient(tmp_path):
+    checkpoint = PullCheckpoint(str(tmp_path / "pull.checkpoint"))
+
+    assert not checkpoint.exists
+    assert checkpoint.start_patient_id == 1
+
+
+def test_pull_resumes_after_the_highest_patient_saved(tmp_path):
+    path = str(tmp_path / "pull.checkpoint")
+    checkpoint = PullCheckpoint(path)
+    checkpoint.saved(10)
+    checkpoint.failed(11)
+    checkpoint.saved(13)
+    checkpoint.saved(12)
+
+    resumed = PullCheckpoint(path)
+
+    assert resumed.exists
+    assert resumed.high_water_mark == 13
+    assert resumed.start_patient_id == 14
+    assert resumed.missing_patient_ids == {11}
+
+
+def test_missing_patients_are_resolved(tmp_path):
+    path = str(tmp_path / "pull.checkpoint")
+    checkpoint = PullCheckpoint(path)
+    checkpoint.failed(4)
+    checkpoint.failed(6)
+    checkpoint.saved(8)
+    checkpoint.resolved(4)
+    checkpoint.saved(6)
+
+    assert PullCheckpoint(path).missing_patient_ids == set()
+
+
+def test_failed_save_keeps_the_previous_checkpoint(tmp_path, monkeypatch):
+    path = str(tmp_path / "pull.checkpoint")
+    checkpoint = PullCheckpoint(path)
+    checkpoint.saved(20)
+
+    def interrupted_dump(*arguments, **keyword_arguments):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(pull_checkpoint.json, "dump", interrupted_dump)
+
+    with pytest.raises(KeyboardInterrupt):
+        checkpoint.saved(21)
+
+    monkeypatch.undo()
+
+    with open(path) as checkpoint_file:
+        assert json.load(checkpoint_file)["high_water_mark"] == 20
+    assert PullCheckpoint(path).start_patient_id == 21
+
+
+def test_save_leaves_no_temporary_file(tmp_path):
+    checkpoint = PullCheckpoint(str(tmp_path / "pull.checkpoint"))
+    checkpoint.saved(1)
+
+    assert os.listdir(str(tmp_path)) == ["pull.checkpoint"]
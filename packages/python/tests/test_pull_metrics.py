@@ -0,0 +1,86 @@
+import json
+import math
+
+import pull_metrics
+from pull_metrics import Histogram, PullMetrics
+
+
+def test_empty_histogram_has_no_quantiles():
+    histogram = Histogram()
+
+    assert histogram.quantile(0.5) is None
+    assert histogram.as_dict()["mean"] is None
+    assert histogram.as_dict()["buckets"]["+Inf"] == 0
+
+
+def test_quantile_interpolates_inside_a_bucket():
+    histogram = Histogram(buckets=(1, 2, 4))
+    for value in (0.5, 1.5, 2.2, 2.5, 3, 4):
+        histogram.observe(value)
+
+    # The median is the first of the 4 values of the (2, 4] bucket
+    assert math.isclose(histogram.quantile(0.5), 2 + (4 - 2) * 1 / 4)
+    assert histogram.cumulative_counts() == [1, 2, 6, 6]
+
+
+def test_quantiles_of_the_edge_buckets_stay_within_the_observed_values():
+    histogram = Histogram(buckets=(1, 2))
+    for value in (0.2, 0.4, 5, 9):
+        histogram.observe(value)
+
+    # The first bucket starts at the minimum and the +Inf bucket ends at the maximum
+    assert histogram.quantile(0) == 0.2
+    assert 0.2 <= histogram.quantile(0.25) <= 1
+    assert 2 <= histogram.quantile(0.9) <= 9
+    assert histogram.quantile(1) == 9
+
+
+def test_prometheus_text_format():
+    metrics = PullMetrics()
+    metrics.increment("api_requests_total", endpoint="MAPA", status=200)
+    metrics.increment("api_requests_total", 2, endpoint="MAPA", status=503)
+    metrics.set_gauge("api_concurrency_limit", 12)
+    metrics.observe("api_request_seconds", 0.003, endpoint="MAPA")
+
+    lines = metrics.prometheus_text().splitlines()
+
+    assert lines[:3] == [
+        "# TYPE api_requests_total counter",
+        'api_requests_total{endpoint="MAPA",status="200"} 1',
+        'api_requests_total{endpoint="MAPA",status="503"} 2',
+    ]
+    assert "# TYPE api_concurrency_limit gauge" in lines
+    assert "api_concurrency_limit 12" in lines
+    assert "# TYPE api_request_seconds histogram" in lines
+    assert 'api_request_seconds_bucket{endpoint="MAPA",le="0.0025"} 0' in lines
+    assert 'api_request_seconds_bucket{endpoint="MAPA",le="0.005"} 1' in lines
+    assert 'api_request_seconds_bucket{endpoint="MAPA",le="+Inf"} 1' in lines
+    assert 'api_request_seconds_count{endpoint="MAPA"} 1' in lines
+
+
+def test_label_values_are_escaped():
+    metrics = PullMetrics()
+    metrics.increment("errors_total", reason='bad "quote"\\path\nline')
+
+    assert 'errors_total{reason="bad \\"quote\\"\\\\path\\nline"} 1' in metrics.prometheus_text().splitlines()
+
+
+def test_progress_is_logged_at_most_once_per_interval(tmp_path, monkeypatch, capsys):
+    now = [1000.0]
+    monkeypatch.setattr(pull_metrics.time, "time", lambda: now[0])
+    metrics = PullMetrics(str(tmp_path / "pull.log"), report_interval=30)
+    metrics.increment("api_requests_total", endpoint="MAPA", status=429)
+
+    metrics.report_progress(1, 1)
+    now[0] += 10
+    metrics.report_progress(2, 2)
+    metrics.report_progress(3, 3, force=True)
+    now[0] += 31
+    metrics.report_progress(4, 4)
+
+    with open(tmp_path / "pull.log") as log_file:
+        lines = [json.loads(line) for line in log_file]
+
+    assert [line["patients"] for line in lines] == [1, 3, 4]
+    assert lines[0]["errors_by_status"] == {"429": 1}
+    assert capsys.readouterr().out.count('"progress"') == 3
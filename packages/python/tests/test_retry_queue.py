@@ -0,0 +1,41 @@
+from retry_queue import RetryQueue
+
+
+def test_failures_of_a_patient_are_merged(tmp_path):
+    with RetryQueue(str(tmp_path / "failed.sqlite")) as retry_queue:
+        retry_queue.add(12, 503)
+        retry_queue.add(12, "timeout")
+        retry_queue.add(5, 500)
+
+        entries = {entry["patient_id"]: entry for entry in retry_queue.entries()}
+
+        assert len(retry_queue) == 2
+        assert entries[12]["attempts"] == 2
+        assert entries[12]["last_status"] == "timeout"
+        assert entries[12]["first_failed_at"] <= entries[12]["last_failed_at"]
+        assert retry_queue.status_counts() == {"500": 1, "timeout": 1}
+
+
+def test_patient_ids_skip_the_ones_over_max_attempts(tmp_path):
+    with RetryQueue(str(tmp_path / "failed.sqlite")) as retry_queue:
+        for _ in range(3):
+            retry_queue.add(7, 503)
+        retry_queue.add(9, 503)
+        retry_queue.add(2, 429)
+
+        assert retry_queue.patient_ids() == [2, 7, 9]
+        assert retry_queue.patient_ids(max_attempts=3) == [2, 9]
+
+
+def test_queue_survives_reopening_and_removes_patients(tmp_path):
+    path = str(tmp_path / "failed.sqlite")
+
+    with RetryQueue(path) as retry_queue:
+        retry_queue.add(3, 503)
+        retry_queue.add(4, 503)
+
+    with RetryQueue(path) as retry_queue:
+        retry_queue.remove(3)
+        retry_queue.remove(100)
+
+        assert retry_queue.patient_ids() == [4]
@@ -0,0 +1,170 @@
+import math
+
+import numpy
+import pytest
+
+import hemodynamic_parameters
+import vectorized_hemodynamic_parameters
+from vectorized_hemodynamic_parameters import INPUTS, PARAMETER_GRAPH, PARAMETERS
+
+
+READING = {
+    "age": 54,
+    "weight": 72.5,
+    "height": 1.68,
+    "systolic_blood_pressure": 128,
+    "diastolic_blood_pressure": 82,
+    "heart_rate": 71,
+    "left_ventricular_ejection_fraction": 0.65,
+}
+
+
+def random_readings(row_count, seed=0):
+    generator = numpy.random.default_rng(seed)
+
+    return {
+        "age": generator.uniform(18, 90, row_count),
+        "weight": generator.uniform(40, 150, row_count),
+        "height": generator.uniform(1.4, 2.1, row_count),
+        "systolic_blood_pressure": generator.uniform(100, 190, row_count),
+        "diastolic_blood_pressure": generator.uniform(50, 95, row_count),
+        "heart_rate": generator.uniform(40, 140, row_count),
+        "left_ventricular_ejection_fraction": generator.uniform(0.3, 0.8, row_count),
+    }
+
+
+def test_plan_only_includes_the_dependencies():
+    plan = vectorized_hemodynamic_parameters.evaluation_plan(["pulse_wave_velocity"])
+
+    assert plan == [
+        "age_pressure_width",
+        "pulse_wave_velocity_scale",
+        "pulse_pressure",
+        "mean_arterial_pressure",
+        "age_pressure_offset",
+        "normalized_pressure",
+        "pulse_wave_velocity",
+    ]
+
+
+def test_plan_puts_every_node_after_its_dependencies():
+    plan = vectorized_hemodynamic_parameters.evaluation_plan(PARAMETERS)
+
+    assert len(plan) == len(set(plan)) == len(PARAMETER_GRAPH)
+
+    for index, node in enumerate(plan):
+        for dependency in PARAMETER_GRAPH[node][0]:
+            assert dependency in INPUTS or plan.index(dependency) < index
+
+
+def test_plan_rejects_unknown_parameters():
+    with pytest.raises(ValueError):
+        vectorized_hemodynamic_parameters.evaluation_plan(["heart_rate_variability"])
+
+
+def test_compute_matches_the_scalar_functions():
+    results = vectorized_hemodynamic_parameters.compute(["stroke_volume", "pulse_wave_velocity"], **READING)
+
+    assert set(results) == {"stroke_volume", "pulse_wave_velocity"}
+    assert math.isclose(
+        results["stroke_volume"],
+        hemodynamic_parameters.stroke_volume(54, 72.5, 1.68, 128, 82, 71),
+        rel_tol=1e-12
+    )
+    assert math.isclose(
+        results["pulse_wave_velocity"],
+        hemodynamic_parameters.pulse_wave_velocity(54, 128, 82),
+        rel_tol=1e-12
+    )
+
+
+def test_compute_all_matches_the_scalar_compute_all():
+    readings = random_readings(50)
+    results = vectorized_hemodynamic_parameters.compute_all(**readings)
+
+    for row in range(50):
+        expected = hemodynamic_parameters.compute_all(*[float(readings[name][row]) for name in INPUTS])
+
+        for parameter in PARAMETERS:
+            assert math.isclose(results[parameter][row], expected[parameter], rel_tol=1e-12)
+
+
+def test_patient_readings_only_evaluate_the_pressure_dependent_nodes(monkeypatch):
+    context = hemodynamic_parameters.PatientContext(54, 72.5, 1.68)
+    readings = random_readings(20)
+    evaluated = []
+
+    for node, (dependencies, function) in list(PARAMETER_GRAPH.items()):
+        def recorded(*values, node=node, function=function):
+            evaluated.append(node)
+            return function(*values)
+
+        monkeypatch.setitem(PARAMETER_GRAPH, node, (dependencies, recorded))
+
+    results = vectorized_hemodynamic_parameters.compute_for_patient(
+        context,
+        PARAMETERS,
+        readings["systolic_blood_pressure"],
+        readings["diastolic_blood_pressure"],
+        readings["heart_rate"]
+    )
+    patient_nodes = {
+        "body_mass_index",
+        "body_surface_area",
+        "age_pressure_offset",
+        "age_pressure_width",
+        "half_height",
+        "body_mass_index_ratio",
+        "compliance_scale",
+        "pulse_wave_velocity_scale",
+    }
+
+    assert evaluated and not patient_nodes & set(evaluated)
+
+    expected = vectorized_hemodynamic_parameters.compute_all(
+        54,
+        72.5,
+        1.68,
+        readings["systolic_blood_pressure"],
+        readings["diastolic_blood_pressure"],
+        readings["heart_rate"]
+    )
+
+    for parameter in PARAMETERS:
+        numpy.testing.assert_array_equal(numpy.broadcast_to(results[parameter], (20,)), expected[parameter])
+
+
+def test_blocks_give_the_same_results(monkeypatch):
+    readings = random_readings(1000)
+    expected = vectorized_hemodynamic_parameters.compute_all(**readings)
+    expected_stroke_volume = vectorized_hemodynamic_parameters.stroke_volume(
+        *[readings[name] for name in INPUTS[:6]]
+    )
+
+    monkeypatch.setattr(vectorized_hemodynamic_parameters, "BLOCK_SIZE", 64)
+    results = vectorized_hemodynamic_parameters.compute_all(**readings)
+
+    for parameter in PARAMETERS:
+        numpy.testing.assert_array_equal(results[parameter], expected[parameter])
+
+    numpy.testing.assert_array_equal(
+        vectorized_hemodynamic_parameters.stroke_volume(*[readings[name] for name in INPUTS[:6]]),
+        expected_stroke_volume
+    )
+
+
+@pytest.mark.parametrize("row_count", [2, vectorized_hemodynamic_parameters.BLOCK_SIZE + 10])
+def test_results_have_the_shape_of_the_readings(row_count):
+    readings = {
+        "systolic_blood_pressure": numpy.full(row_count, 125.0),
+        "diastolic_blood_pressure": numpy.full(row_count, 80.0),
+        "heart_rate": numpy.full(row_count, 70.0),
+    }
+
+    results = vectorized_hemodynamic_parameters.compute_all(55, 80, 1.75, **readings)
+
+    for parameter in PARAMETERS:
+        assert results[parameter].shape == (row_count,), parameter
+
+    assert vectorized_hemodynamic_parameters.body_mass_index(80, numpy.full(row_count, 1.75)).shape == (row_count,)
+    assert numpy.ndim(vectorized_hemodynamic_parameters.compute_all(55, 80, 1.75, 125, 80, 70)["body_mass_index"]) == 0
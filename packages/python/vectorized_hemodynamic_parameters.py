@@ -0,0 +1,951 @@
+'''
+Module with vectorized versions of the functions in hemodynamic_parameters.
+Every function accepts scalars, lists or NumPy arrays, broadcasts them
+against each other and returns NumPy arrays with the same numbers as the
+scalar functions.
+Formulas are the ones that Dr. Dagnovar Aristizabal Ocampo uses.
+'''
+
+import functools
+
+import numpy
+
+
+ELASTANCE_COEFFICIENTS = (
+    0.35695,
+    (-7.2266),
+    74.249,
+    (-307.39),
+    684.54,
+    (-856.92),
+    571.95,
+    (-159.1)
+)
+
+# Rows evaluated at once on long inputs. Every operation of a formula makes
+# a temporary array, and on millions of rows they no longer fit in the CPU
+# cache, so long inputs are evaluated in blocks of this many rows
+BLOCK_SIZE = 16384
+
+def _as_array(value):
+    '''
+    Converts any array-like value into a float NumPy array
+    '''
+    return numpy.asarray(value, dtype=float)
+
+def _block_shape(arrays):
+    '''
+    Returns the number of rows of arrays that broadcast to a single
+    dimension longer than BLOCK_SIZE, None if they do not need blocks
+    '''
+    shape = numpy.broadcast(*arrays).shape
+    if len(shape) != 1 or shape[0] <= BLOCK_SIZE:
+        return None
+    return shape[0]
+
+def _block(array, start):
+    '''
+    Returns the rows of a block, arrays of a single value broadcast as they are
+    '''
+    if array.ndim == 0 or array.shape[0] == 1:
+        return array
+    return array[start:start + BLOCK_SIZE]
+
+def _broadcast_result(value, shape):
+    '''
+    Returns a result with the common shape of the inputs, also when it only
+    depends on the inputs of a single value
+    '''
+    if numpy.shape(value) == shape:
+        return value
+    return numpy.array(numpy.broadcast_to(value, shape))
+
+def _blocked(function):
+    '''
+    Evaluates a vectorized function in blocks of BLOCK_SIZE rows when its
+    inputs broadcast to a long one dimensional array. The result always has
+    the common shape of the inputs
+    '''
+    @functools.wraps(function)
+    def blocked_function(*arguments, **keyword_arguments):
+        arguments = [_as_array(argument) for argument in arguments]
+        keyword_arguments = {name: _as_array(argument) for name, argument in keyword_arguments.items()}
+        row_count = _block_shape(arguments + list(keyword_arguments.values()))
+        if row_count is None:
+            shape = numpy.broadcast(*arguments, *keyword_arguments.values()).shape
+            return _broadcast_result(function(*arguments, **keyword_arguments), shape)
+
+        output = numpy.empty(row_count, dtype=float)
+        for start in range(0, row_count, BLOCK_SIZE):
+            output[start:start + BLOCK_SIZE] = function(
+                *[_block(argument, start) for argument in arguments],
+                **{name: _block(argument, start) for name, argument in keyword_arguments.items()}
+            )
+        return output
+
+    return blocked_function
+
+@_blocked
+def body_mass_index(weight, height):
+    '''
+    Calculates body mass index given in kg/m2
+    Parameters
+    ----------
+    weight : given in kg
+    height : given in meters
+    '''
+    weight, height = _as_array(weight), _as_array(height)
+    return weight / (height ** 2)
+
+@_blocked
+def body_surface_area(weight, height):
+    '''
+    Calculates body surface area using the Mosteller formula, given in m2
+    Parameters
+    ----------
+    weight : given in kg
+    height : given in meters
+    '''
+    weight, height = _as_array(weight), _as_array(height)
+    return numpy.sqrt((weight * height * 100) / 3600)
+
+@_blocked
+def pulse_pressure(systolic_blood_pressure, diastolic_blood_pressure):
+    '''
+    Calculates pulse pressure given in mmHg
+    Parameters
+    ----------
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    '''
+    return _as_array(systolic_blood_pressure) - _as_array(diastolic_blood_pressure)
+
+@_blocked
+def mean_arterial_pressure(systolic_blood_pressure, diastolic_blood_pressure):
+    '''
+    Calculates mean arterial pressure given in mmHg
+    Parameters
+    ----------
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    '''
+    diastolic_blood_pressure = _as_array(diastolic_blood_pressure)
+    return diastolic_blood_pressure + (pulse_pressure(systolic_blood_pressure, diastolic_blood_pressure)) * 0.35
+
+def _normalized_pressure(age, mean_arterial_pressure_):
+    '''
+    Calculates the age normalized pressure term shared by compliance,
+    impedance and pulse wave velocity
+    '''
+    return _normalized_pressure_from_terms(mean_arterial_pressure_, 76 - 0.89 * age, 57 - 0.44 * age)
+
+def _normalized_pressure_from_terms(mean_arterial_pressure_, age_pressure_offset, age_pressure_width):
+    '''
+    Calculates the normalized pressure from the already computed age
+    dependent constants 76 - 0.89 * age and 57 - 0.44 * age
+    '''
+    return (mean_arterial_pressure_ - age_pressure_offset) / age_pressure_width
+
+@_blocked
+def pressure_dependent_arterial_compliance(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure):
+    '''
+    Calculates pressure-dependent arterial compliance C(p) given in ml/mmHg
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    '''
+    age, height = _as_array(age), _as_array(height)
+    body_mass_index_ = body_mass_index(weight, height)
+    normalized_pressure = _normalized_pressure(
+        age,
+        mean_arterial_pressure(systolic_blood_pressure, diastolic_blood_pressure)
+    )
+    return _pressure_dependent_arterial_compliance(age, height, body_mass_index_, normalized_pressure)
+
+def _pressure_dependent_arterial_compliance(age, height, body_mass_index_, normalized_pressure):
+    '''
+    Calculates the compliance from an already computed body mass index and
+    normalized pressure
+    '''
+    return _pressure_dependent_arterial_compliance_from_terms(
+        5.62 / (numpy.pi * (57 - 0.44 * age)),
+        height * 100 / 2,
+        body_mass_index_ / 27.5,
+        normalized_pressure
+    )
+
+def _pressure_dependent_arterial_compliance_from_terms(compliance_scale, half_height, body_mass_index_ratio, normalized_pressure):
+    '''
+    Calculates the compliance from the already computed patient factors
+    5.62 / (pi * (57 - 0.44 * age)), height * 100 / 2 and body mass index / 27.5
+    '''
+    intermediary = compliance_scale / (1 + (normalized_pressure ** 2))
+    output = half_height * intermediary
+    output = output * body_mass_index_ratio
+    return output
+
+@_blocked
+def characteristic_impedance(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure):
+    '''
+    Calculates the characteristic impedance (Zc) given in mmHg.s/cm3
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    '''
+    age, height = _as_array(age), _as_array(height)
+    body_mass_index_ = body_mass_index(weight, height)
+    normalized_pressure = _normalized_pressure(
+        age,
+        mean_arterial_pressure(systolic_blood_pressure, diastolic_blood_pressure)
+    )
+    compliance = _pressure_dependent_arterial_compliance(age, height, body_mass_index_, normalized_pressure)
+    return _characteristic_impedance(compliance, normalized_pressure)
+
+def _characteristic_impedance(compliance, normalized_pressure):
+    '''
+    Calculates the impedance from an already computed compliance and
+    normalized pressure
+    '''
+    intermediary = 5.62 * (0.5 + (1 / numpy.pi * numpy.arctan(normalized_pressure)))
+    return numpy.sqrt(1.06 / (intermediary * compliance))
+
+@_blocked
+def tau_rc(systolic_blood_pressure, diastolic_blood_pressure, heart_rate):
+    '''
+    Calculates the RC time constant given in seconds
+    Parameters
+    ----------
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    '''
+    mean_arterial_pressure_ = mean_arterial_pressure(systolic_blood_pressure, diastolic_blood_pressure)
+    pulse_pressure_ = pulse_pressure(systolic_blood_pressure, diastolic_blood_pressure)
+    return (mean_arterial_pressure_ / pulse_pressure_) * (60 / _as_array(heart_rate))
+
+def _ejection_time(mean_arterial_pressure_, heart_rate):
+    '''
+    Calculates the left ventricular ejection time given in seconds
+    '''
+    return ((413 - 1.7 * heart_rate) / numpy.sqrt(mean_arterial_pressure_ / 95)) / 1000
+
+@_blocked
+def tau_wk(systolic_blood_pressure, diastolic_blood_pressure, heart_rate):
+    '''
+    Calculates the RC time constant given in seconds using the winkesel model
+    Parameters
+    ----------
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    '''
+    diastolic_blood_pressure, heart_rate = _as_array(diastolic_blood_pressure), _as_array(heart_rate)
+    mean_arterial_pressure_ = mean_arterial_pressure(systolic_blood_pressure, diastolic_blood_pressure)
+    ejection_time = _ejection_time(mean_arterial_pressure_, heart_rate)
+    return _tau_wk(mean_arterial_pressure_, diastolic_blood_pressure, ejection_time, heart_rate)
+
+def _tau_wk(mean_arterial_pressure_, diastolic_blood_pressure, ejection_time, heart_rate):
+    '''
+    Calculates the winkesel time constant from an already computed ejection time
+    '''
+    return ((60 / heart_rate) - ejection_time) / numpy.log((mean_arterial_pressure_ / diastolic_blood_pressure))
+
+@_blocked
+def stroke_volume(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate):
+    '''
+    Calculates the stroke volume(sv) given in milliliters (ml)
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    '''
+    heart_rate = _as_array(heart_rate)
+    impedance = characteristic_impedance(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure)
+    mean_arterial_pressure_ = mean_arterial_pressure(systolic_blood_pressure, diastolic_blood_pressure)
+    ejection_time = _ejection_time(mean_arterial_pressure_, heart_rate)
+    return _stroke_volume(impedance, mean_arterial_pressure_, ejection_time, heart_rate)
+
+def _stroke_volume(impedance, mean_arterial_pressure_, ejection_time, heart_rate):
+    '''
+    Calculates the stroke volume from an already computed impedance, mean
+    arterial pressure and ejection time
+    '''
+    end_diastolic_blood_pressure_tau = mean_arterial_pressure_ * numpy.exp((- ejection_time / (heart_rate / 60)) - 0.25)
+    end_diastolic_blood_pressure = mean_arterial_pressure_ - end_diastolic_blood_pressure_tau
+    return end_diastolic_blood_pressure / impedance
+
+@_blocked
+def cardiac_output(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate):
+    '''
+    Calculates the cardiac output (co) given in liliters per minute (L/min)
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    '''
+    stroke_volume_ = stroke_volume(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate)
+    return (stroke_volume_ / 1000) * _as_array(heart_rate)
+
+@_blocked
+def cardiac_index(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate):
+    '''
+    Calculates the cardiac output (co) given in liliters per minute per m2 (L/min)
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    '''
+    body_surface_area_ = body_surface_area(weight, height)
+    cardiac_output_ = cardiac_output(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate)
+    return cardiac_output_ / body_surface_area_
+
+@_blocked
+def pulse_wave_velocity(age, systolic_blood_pressure, diastolic_blood_pressure):
+    '''
+    Calculates pulse wave velocity
+    Parameters
+    ----------
+    age : given in years
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    '''
+    age = _as_array(age)
+    normalized_pressure = _normalized_pressure(
+        age,
+        mean_arterial_pressure(systolic_blood_pressure, diastolic_blood_pressure)
+    )
+    return _pulse_wave_velocity(age, normalized_pressure)
+
+def _pulse_wave_velocity(age, normalized_pressure):
+    '''
+    Calculates pulse wave velocity from an already computed normalized pressure
+    '''
+    return _pulse_wave_velocity_from_terms(numpy.pi * (57 - 0.44 * age), normalized_pressure)
+
+def _pulse_wave_velocity_from_terms(pulse_wave_velocity_scale, normalized_pressure):
+    '''
+    Calculates pulse wave velocity from the already computed patient factor
+    pi * (57 - 0.44 * age) and normalized pressure
+    '''
+    intermediary_2 = (1 + (normalized_pressure ** 2))
+    intermediary_3 = ((1 / numpy.pi) * numpy.arctan(normalized_pressure))
+    return 0.357 * numpy.sqrt(pulse_wave_velocity_scale * intermediary_2 * (0.5 + intermediary_3))
+
+@_blocked
+def systemic_vascular_resistance(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate):
+    '''
+    Calculates the systemic vasclar resistance given in dyn × s/cm-5
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    '''
+    heart_rate = _as_array(heart_rate)
+    impedance = characteristic_impedance(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure)
+    mean_arterial_pressure_ = mean_arterial_pressure(systolic_blood_pressure, diastolic_blood_pressure)
+    sympathetic_nervous_system_activation_ = _sympathetic_nervous_system_activation(impedance, heart_rate)
+    ejection_time = _ejection_time(mean_arterial_pressure_, heart_rate)
+    cardiac_output_ = (_stroke_volume(impedance, mean_arterial_pressure_, ejection_time, heart_rate) / 1000) * heart_rate
+    return ((1 - (1 / sympathetic_nervous_system_activation_)) * (mean_arterial_pressure_ / cardiac_output_)) * 80
+
+@_blocked
+def sympathetic_activity_index(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate):
+    '''
+    Calculates the sympathetic activity index given in percentage %
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    '''
+    sympathetic_nervous_system_activation_ = sympathetic_nervous_system_activation(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate)
+    return (1 / sympathetic_nervous_system_activation_) * 100
+
+@_blocked
+def baroreflex_activity(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate):
+    '''
+    Calculates the baroreflex activity given in U
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    '''
+    sympathetic_nervous_system_activation_ = sympathetic_nervous_system_activation(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate)
+    baroreflex_heart_rate_ = baroreflex_heart_rate(systolic_blood_pressure, diastolic_blood_pressure)
+    return _baroreflex_activity(sympathetic_nervous_system_activation_, baroreflex_heart_rate_)
+
+def _baroreflex_activity(sympathetic_nervous_system_activation_, baroreflex_heart_rate_):
+    '''
+    Calculates the baroreflex activity from an already computed sympathetic
+    nervous system activation and baroreflex heart rate
+    '''
+    intermediary = (sympathetic_nervous_system_activation_ * 0.75) - (baroreflex_heart_rate_ * 0.25)
+    return numpy.sqrt(numpy.maximum(intermediary, 0) / 7.7)
+
+@_blocked
+def maximum_elastance(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate, left_ventricular_ejection_fraction=0.65):
+    '''
+    Calculates the maximum_elastance
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    left_ventricular_ejection_fraction : given as a the fraction of stroke volume over end diastolic volume
+    '''
+    systolic_blood_pressure, diastolic_blood_pressure = _as_array(systolic_blood_pressure), _as_array(diastolic_blood_pressure)
+    heart_rate = _as_array(heart_rate)
+    left_ventricular_ejection_fraction = _as_array(left_ventricular_ejection_fraction)
+    stroke_volume_ = stroke_volume(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate)
+    mean_arterial_pressure_ = mean_arterial_pressure(systolic_blood_pressure, diastolic_blood_pressure)
+    ejection_time = _ejection_time(mean_arterial_pressure_, heart_rate)
+    elastance_nd_mean = _elastance_nd_mean(mean_arterial_pressure_, ejection_time, heart_rate)
+    return _maximum_elastance(
+        stroke_volume_,
+        elastance_nd_mean,
+        systolic_blood_pressure,
+        diastolic_blood_pressure,
+        left_ventricular_ejection_fraction
+    )
+
+def _elastance_nd_mean(mean_arterial_pressure_, ejection_time, heart_rate):
+    '''
+    Calculates the mean normalized elastance term from the pre-ejection period
+    over the ejection time ratio
+    '''
+    pep = ((131 - 0.4 * heart_rate) * numpy.sqrt(mean_arterial_pressure_ / 100)) / 1000
+    ratio_pep_sistolic_time = pep / ejection_time
+    elastance_nd_mean = 0
+    for i in ELASTANCE_COEFFICIENTS:
+        elastance_nd_mean += (ratio_pep_sistolic_time * i)
+    return elastance_nd_mean
+
+def _maximum_elastance(
+    stroke_volume_,
+    elastance_nd_mean,
+    systolic_blood_pressure,
+    diastolic_blood_pressure,
+    left_ventricular_ejection_fraction
+    ):
+    '''
+    Calculates the maximum elastance from an already computed stroke volume
+    and mean normalized elastance
+    '''
+    elastance_nd_est = (
+        (0.0275 - (0.165 * left_ventricular_ejection_fraction))
+        + (0.3656 * (diastolic_blood_pressure
+        / systolic_blood_pressure))
+        + (0.515 * elastance_nd_mean)
+    )
+    elastance_es_sb = (
+        (diastolic_blood_pressure - (elastance_nd_est * 0.9 * systolic_blood_pressure))
+        / (stroke_volume_ * elastance_nd_est)
+        )
+    return 0.78 * elastance_es_sb + 0.55
+
+@_blocked
+def arterial_elastance(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate):
+    '''
+    Calculates the arterial elastance
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    '''
+    stroke_volume_ = stroke_volume(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate)
+    mean_arterial_pressure_ = mean_arterial_pressure(systolic_blood_pressure, diastolic_blood_pressure)
+    return mean_arterial_pressure_ / stroke_volume_
+
+@_blocked
+def arterial_ventricular_elastance(
+    age,
+    weight,
+    height,
+    systolic_blood_pressure,
+    diastolic_blood_pressure,
+    heart_rate,
+    left_ventricular_ejection_fraction=0.65
+    ):
+    '''
+    Calculates the arterial elastance over the maximum elastance
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    left_ventricular_ejection_fraction : given as a the fraction of stroke volume over end diastolic volume
+    '''
+    # Same as the scalar module, the maximum elastance always uses the default ejection fraction
+    maximum_elastance_ = maximum_elastance(
+        age,
+        weight,
+        height,
+        systolic_blood_pressure,
+        diastolic_blood_pressure,
+        heart_rate,
+        left_ventricular_ejection_fraction=0.65
+        )
+    arterial_elastance_ = arterial_elastance(
+        age,
+        weight,
+        height,
+        systolic_blood_pressure,
+        diastolic_blood_pressure,
+        heart_rate
+        )
+    return arterial_elastance_ / maximum_elastance_
+
+@_blocked
+def pulsatile_load(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate):
+    '''
+    Calculates the pulsatile charge
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    '''
+    stroke_volume_ = stroke_volume(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate)
+    pulse_pressure_ = pulse_pressure(systolic_blood_pressure, diastolic_blood_pressure)
+    return pulse_pressure_ / stroke_volume_
+
+@_blocked
+def cardiac_potency(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate):
+    '''
+    Calculates the cardiac potency
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    '''
+    cardiac_output_ = cardiac_output(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate)
+    mean_arterial_pressure_ = mean_arterial_pressure(systolic_blood_pressure, diastolic_blood_pressure)
+    return (cardiac_output_ * mean_arterial_pressure_) / 450
+
+@_blocked
+def sympathetic_nervous_system_activation(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate):
+    '''
+    Calculates the sympathetic nervous system activation
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    '''
+    impedance = characteristic_impedance(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure)
+    return _sympathetic_nervous_system_activation(impedance, _as_array(heart_rate))
+
+def _sympathetic_nervous_system_activation(impedance, heart_rate):
+    '''
+    Calculates the sympathetic nervous system activation from an already
+    computed impedance
+    '''
+    return numpy.exp(((60 / heart_rate) + 0.12) / impedance)
+
+@_blocked
+def baroreflex_heart_rate(systolic_blood_pressure, diastolic_blood_pressure):
+    '''
+    baroreflex_heart_rate
+    Parameters
+    ----------
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    '''
+    mean_arterial_pressure_ = mean_arterial_pressure(systolic_blood_pressure, diastolic_blood_pressure)
+    return _baroreflex_heart_rate(mean_arterial_pressure_)
+
+def _baroreflex_heart_rate(mean_arterial_pressure_):
+    '''
+    Calculates the baroreflex heart rate from an already computed mean arterial pressure
+    '''
+    return 0.66 + ((0.66 - 1.2) / (1 + 67000000000000 * numpy.exp(-31 * mean_arterial_pressure_ / 89)))
+
+INPUTS = (
+    "age",
+    "weight",
+    "height",
+    "systolic_blood_pressure",
+    "diastolic_blood_pressure",
+    "heart_rate",
+    "left_ventricular_ejection_fraction",
+)
+
+# Every node of the dependency graph maps to the nodes (or INPUTS) it
+# depends on and to the function that calculates it from those values.
+PARAMETER_GRAPH = {
+    "body_mass_index": (
+        ("weight", "height"),
+        lambda weight, height: weight / (height ** 2)
+    ),
+    "body_surface_area": (
+        ("weight", "height"),
+        lambda weight, height: numpy.sqrt((weight * height * 100) / 3600)
+    ),
+    "pulse_pressure": (
+        ("systolic_blood_pressure", "diastolic_blood_pressure"),
+        lambda systolic_blood_pressure, diastolic_blood_pressure: systolic_blood_pressure - diastolic_blood_pressure
+    ),
+    "mean_arterial_pressure": (
+        ("diastolic_blood_pressure", "pulse_pressure"),
+        lambda diastolic_blood_pressure, pulse_pressure_: diastolic_blood_pressure + pulse_pressure_ * 0.35
+    ),
+    # Patient terms, seeded from the PatientContext by compute_for_patient
+    "age_pressure_offset": (
+        ("age",),
+        lambda age: 76 - 0.89 * age
+    ),
+    "age_pressure_width": (
+        ("age",),
+        lambda age: 57 - 0.44 * age
+    ),
+    "half_height": (
+        ("height",),
+        lambda height: height * 100 / 2
+    ),
+    "body_mass_index_ratio": (
+        ("body_mass_index",),
+        lambda body_mass_index_: body_mass_index_ / 27.5
+    ),
+    "compliance_scale": (
+        ("age_pressure_width",),
+        lambda age_pressure_width: 5.62 / (numpy.pi * age_pressure_width)
+    ),
+    "pulse_wave_velocity_scale": (
+        ("age_pressure_width",),
+        lambda age_pressure_width: numpy.pi * age_pressure_width
+    ),
+    "normalized_pressure": (
+        ("mean_arterial_pressure", "age_pressure_offset", "age_pressure_width"),
+        _normalized_pressure_from_terms
+    ),
+    "pressure_dependent_arterial_compliance": (
+        ("compliance_scale", "half_height", "body_mass_index_ratio", "normalized_pressure"),
+        _pressure_dependent_arterial_compliance_from_terms
+    ),
+    "characteristic_impedance": (
+        ("pressure_dependent_arterial_compliance", "normalized_pressure"),
+        _characteristic_impedance
+    ),
+    "ejection_time": (
+        ("mean_arterial_pressure", "heart_rate"),
+        _ejection_time
+    ),
+    "tau_rc": (
+        ("mean_arterial_pressure", "pulse_pressure", "heart_rate"),
+        lambda mean_arterial_pressure_, pulse_pressure_, heart_rate: (mean_arterial_pressure_ / pulse_pressure_) * (60 / heart_rate)
+    ),
+    "tau_wk": (
+        ("mean_arterial_pressure", "diastolic_blood_pressure", "ejection_time", "heart_rate"),
+        _tau_wk
+    ),
+    "stroke_volume": (
+        ("characteristic_impedance", "mean_arterial_pressure", "ejection_time", "heart_rate"),
+        _stroke_volume
+    ),
+    "cardiac_output": (
+        ("stroke_volume", "heart_rate"),
+        lambda stroke_volume_, heart_rate: (stroke_volume_ / 1000) * heart_rate
+    ),
+    "cardiac_index": (
+        ("cardiac_output", "body_surface_area"),
+        lambda cardiac_output_, body_surface_area_: cardiac_output_ / body_surface_area_
+    ),
+    "pulse_wave_velocity": (
+        ("pulse_wave_velocity_scale", "normalized_pressure"),
+        _pulse_wave_velocity_from_terms
+    ),
+    "sympathetic_nervous_system_activation": (
+        ("characteristic_impedance", "heart_rate"),
+        _sympathetic_nervous_system_activation
+    ),
+    "systemic_vascular_resistance": (
+        ("sympathetic_nervous_system_activation", "mean_arterial_pressure", "cardiac_output"),
+        lambda sympathetic_nervous_system_activation_, mean_arterial_pressure_, cardiac_output_: (
+            ((1 - (1 / sympathetic_nervous_system_activation_)) * (mean_arterial_pressure_ / cardiac_output_)) * 80
+        )
+    ),
+    "sympathetic_activity_index": (
+        ("sympathetic_nervous_system_activation",),
+        lambda sympathetic_nervous_system_activation_: (1 / sympathetic_nervous_system_activation_) * 100
+    ),
+    "baroreflex_heart_rate": (
+        ("mean_arterial_pressure",),
+        _baroreflex_heart_rate
+    ),
+    "baroreflex_activity": (
+        ("sympathetic_nervous_system_activation", "baroreflex_heart_rate"),
+        _baroreflex_activity
+    ),
+    "elastance_nd_mean": (
+        ("mean_arterial_pressure", "ejection_time", "heart_rate"),
+        _elastance_nd_mean
+    ),
+    "maximum_elastance": (
+        (
+            "stroke_volume",
+            "elastance_nd_mean",
+            "systolic_blood_pressure",
+            "diastolic_blood_pressure",
+            "left_ventricular_ejection_fraction",
+        ),
+        _maximum_elastance
+    ),
+    # Same as the scalar module, the arterial ventricular elastance always
+    # uses the maximum elastance of the default ejection fraction
+    "default_maximum_elastance": (
+        ("stroke_volume", "elastance_nd_mean", "systolic_blood_pressure", "diastolic_blood_pressure"),
+        lambda stroke_volume_, elastance_nd_mean, systolic_blood_pressure, diastolic_blood_pressure: _maximum_elastance(
+            stroke_volume_,
+            elastance_nd_mean,
+            systolic_blood_pressure,
+            diastolic_blood_pressure,
+            0.65
+        )
+    ),
+    "arterial_elastance": (
+        ("mean_arterial_pressure", "stroke_volume"),
+        lambda mean_arterial_pressure_, stroke_volume_: mean_arterial_pressure_ / stroke_volume_
+    ),
+    "arterial_ventricular_elastance": (
+        ("arterial_elastance", "default_maximum_elastance"),
+        lambda arterial_elastance_, maximum_elastance_: arterial_elastance_ / maximum_elastance_
+    ),
+    "pulsatile_load": (
+        ("pulse_pressure", "stroke_volume"),
+        lambda pulse_pressure_, stroke_volume_: pulse_pressure_ / stroke_volume_
+    ),
+    "cardiac_potency": (
+        ("cardiac_output", "mean_arterial_pressure"),
+        lambda cardiac_output_, mean_arterial_pressure_: (cardiac_output_ * mean_arterial_pressure_) / 450
+    ),
+}
+
+# The parameters that have a public function in hemodynamic_parameters
+PARAMETERS = (
+    "body_mass_index",
+    "body_surface_area",
+    "pulse_pressure",
+    "mean_arterial_pressure",
+    "pressure_dependent_arterial_compliance",
+    "characteristic_impedance",
+    "tau_rc",
+    "tau_wk",
+    "stroke_volume",
+    "cardiac_output",
+    "cardiac_index",
+    "pulse_wave_velocity",
+    "systemic_vascular_resistance",
+    "sympathetic_activity_index",
+    "baroreflex_activity",
+    "maximum_elastance",
+    "arterial_elastance",
+    "arterial_ventricular_elastance",
+    "pulsatile_load",
+    "cardiac_potency",
+    "sympathetic_nervous_system_activation",
+    "baroreflex_heart_rate",
+)
+
+_evaluation_plans = {}
+
+def evaluation_plan(parameters):
+    '''
+    Returns the graph nodes needed to calculate the given parameters, sorted
+    so that every node comes after the nodes it depends on
+    Parameters
+    ----------
+    parameters : iterable with the names of the nodes to calculate
+    '''
+    parameters = tuple(parameters)
+    if parameters in _evaluation_plans:
+        return _evaluation_plans[parameters]
+
+    plan = []
+    visited = set(INPUTS)
+
+    def visit(node):
+        if node in visited:
+            return
+        if node not in PARAMETER_GRAPH:
+            raise ValueError(f"Unknown hemodynamic parameter: {node}")
+        visited.add(node)
+        for dependency in PARAMETER_GRAPH[node][0]:
+            visit(dependency)
+        plan.append(node)
+
+    for parameter in parameters:
+        visit(parameter)
+
+    _evaluation_plans[parameters] = plan
+    return plan
+
+def compute(parameters, age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate, left_ventricular_ejection_fraction=0.65):
+    '''
+    Calculates only the given parameters and the graph nodes they depend on.
+    Every node is evaluated once and shared by all the parameters that need
+    it. Returns a dict keyed by the requested parameter names
+    Parameters
+    ----------
+    parameters : iterable with the names of the nodes to calculate, see PARAMETERS
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    left_ventricular_ejection_fraction : given as a the fraction of stroke volume over end diastolic volume
+    '''
+    parameters = tuple(parameters)
+    values = {
+        "age": _as_array(age),
+        "weight": _as_array(weight),
+        "height": _as_array(height),
+        "systolic_blood_pressure": _as_array(systolic_blood_pressure),
+        "diastolic_blood_pressure": _as_array(diastolic_blood_pressure),
+        "heart_rate": _as_array(heart_rate),
+        "left_ventricular_ejection_fraction": _as_array(left_ventricular_ejection_fraction),
+    }
+
+    return _evaluate(parameters, values)
+
+def compute_for_patient(context, parameters, systolic_blood_pressure, diastolic_blood_pressure, heart_rate, left_ventricular_ejection_fraction=0.65):
+    '''
+    Calculates the given parameters for the readings of a single patient,
+    seeding the graph with the terms precomputed by its
+    hemodynamic_parameters.PatientContext, so only the pressure dependent
+    nodes are evaluated for every batch of readings
+    Parameters
+    ----------
+    context : hemodynamic_parameters.PatientContext of the patient
+    parameters : iterable with the names of the nodes to calculate, see PARAMETERS
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    left_ventricular_ejection_fraction : given as a the fraction of stroke volume over end diastolic volume
+    '''
+    parameters = tuple(parameters)
+    values = {
+        "age": _as_array(context.age),
+        "weight": _as_array(context.weight),
+        "height": _as_array(context.height),
+        "body_mass_index": _as_array(context.body_mass_index),
+        "body_surface_area": _as_array(context.body_surface_area),
+        "age_pressure_offset": _as_array(context.age_pressure_offset),
+        "age_pressure_width": _as_array(context.age_pressure_width),
+        "half_height": _as_array(context.half_height),
+        "body_mass_index_ratio": _as_array(context.body_mass_index_ratio),
+        "compliance_scale": _as_array(context.compliance_scale),
+        "pulse_wave_velocity_scale": _as_array(context.pulse_wave_velocity_scale),
+        "systolic_blood_pressure": _as_array(systolic_blood_pressure),
+        "diastolic_blood_pressure": _as_array(diastolic_blood_pressure),
+        "heart_rate": _as_array(heart_rate),
+        "left_ventricular_ejection_fraction": _as_array(left_ventricular_ejection_fraction),
+    }
+
+    return _evaluate(parameters, values)
+
+def _evaluate(parameters, values):
+    row_count = _block_shape(list(values.values()))
+    if row_count is None:
+        # Parameters that only depend on the patient take the shape of the readings
+        shape = numpy.broadcast(*values.values()).shape
+        return {
+            parameter: _broadcast_result(value, shape)
+            for parameter, value in _evaluate_block(parameters, values).items()
+        }
+
+    results = {parameter: numpy.empty(row_count, dtype=float) for parameter in parameters}
+    for start in range(0, row_count, BLOCK_SIZE):
+        block_results = _evaluate_block(
+            parameters,
+            {name: _block(value, start) for name, value in values.items()}
+        )
+        for parameter, value in block_results.items():
+            results[parameter][start:start + BLOCK_SIZE] = value
+
+    return results
+
+def _evaluate_block(parameters, values):
+    for node in evaluation_plan(parameters):
+        if node in values:
+            continue
+        dependencies, function = PARAMETER_GRAPH[node]
+        values[node] = function(*[values[dependency] for dependency in dependencies])
+
+    return {parameter: values[parameter] for parameter in parameters}
+
+def compute_all(age, weight, height, systolic_blood_pressure, diastolic_blood_pressure, heart_rate, left_ventricular_ejection_fraction=0.65):
+    '''
+    Calculates every hemodynamic parameter in a single pass over the
+    dependency graph. Returns a dict keyed by the parameter function names
+    Parameters
+    ----------
+    age : given in years
+    weight : given in kg
+    height : given in meters
+    systolic_blood_pressure : given in mmHg
+    diastolic_blood_pressure : given in mmHg
+    heart_rate : given in beats per minute
+    left_ventricular_ejection_fraction : given as a the fraction of stroke volume over end diastolic volume
+    '''
+    return compute(
+        PARAMETERS,
+        age,
+        weight,
+        height,
+        systolic_blood_pressure,
+        diastolic_blood_pressure,
+        heart_rate,
+        left_ventricular_ejection_fraction
+    )